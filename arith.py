@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Big-integer operations of the dragonfly code. The gmpy2 backend is used when gmpy2 is installed,
+# and otherwise the pure Python one. Both return Python ints. Select one with set_backend().
+import os
+
+try:
+	import gmpy2
+except ImportError:
+	gmpy2 = None
+
+def _python_jacobi(a, n):
+	"""Jacobi symbol (a/n) for odd n > 0. This is faster than Euler's criterion in pure Python."""
+	a %= n
+	result = 1
+	while a != 0:
+		while a & 1 == 0:
+			a >>= 1
+			if n & 7 in (3, 5):
+				result = -result
+		# Quadratic reciprocity
+		a, n = n, a
+		if a & 3 == 3 and n & 3 == 3:
+			result = -result
+		a %= n
+	return result if n == 1 else 0
+
+def _python_powmod(a, e, m):
+	return pow(a, e, m)
+
+def _gmpy2_jacobi(a, n):
+	return int(gmpy2.jacobi(a, n))
+
+def _gmpy2_powmod(a, e, m):
+	return int(gmpy2.powmod(a, e, m))
+
+def from_bytes(data):
+	return int.from_bytes(data, "big")
+
+def sqrt_3mod4(a, p):
+	"""Square root of a quadratic residue a modulo a prime p that is 3 modulo 4"""
+	return powmod(a, (p + 1) >> 2, p)
+
+backend = None
+jacobi = _python_jacobi
+powmod = _python_powmod
+
+def set_backend(name):
+	"""Use the "gmpy2" or "python" backend. Raises ImportError if gmpy2 is not installed."""
+	global backend, jacobi, powmod
+	if name == "gmpy2":
+		if gmpy2 is None:
+			raise ImportError("The gmpy2 backend requires the gmpy2 module")
+		backend, jacobi, powmod = name, _gmpy2_jacobi, _gmpy2_powmod
+	elif name == "python":
+		backend, jacobi, powmod = name, _python_jacobi, _python_powmod
+	else:
+		raise ValueError("Unknown arithmetic backend %s" % name)
+
+set_backend(os.environ.get("LIBWIFI_ARITH", "gmpy2" if gmpy2 is not None else "python"))
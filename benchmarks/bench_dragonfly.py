@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# Compare optimized dragonfly arithmetic with the plain PyCryptodome operators.
+# Run from the parent directory: python -m libwifi.benchmarks.bench_dragonfly
+from libwifi.dragonfly import *
+import timeit
+
+def bench(name, func, number=100):
+	per_call = timeit.timeit(func, number=number) / number
+	log(STATUS, "%-45s %10.1f us" % (name, per_call * 1e6))
+	return per_call
+
+def bench_fixed_base():
+	curve = get_curve(19)
+	pwe = derive_pwe_ecc("password", "01:02:03:04:05:06", "11:22:33:44:55:66")
+	scalar = random.randint(2, curve.r - 1)
+
+	plain = bench("PWE * scalar (PyCryptodome)", lambda: pwe * scalar)
+	for window in [4, 6, 8]:
+		start = time.perf_counter()
+		table = FixedBaseTable(pwe, curve, window)
+		log(STATUS, "Precomputing table with window %d took %.1f ms" % (window, (time.perf_counter() - start) * 1000))
+		fast = bench("FixedBaseTable(window=%d).multiply" % window, lambda: table.multiply(scalar))
+		log(STATUS, "    speedup: %.2fx" % (plain / fast))
+
+def bench_multi_scalar():
+	curve = get_curve(19)
+	pwe = derive_pwe_ecc("password", "01:02:03:04:05:06", "11:22:33:44:55:66")
+	element = pwe * random.randint(2, curve.r - 1)
+	a, b = random.randint(2, curve.r - 1), random.randint(2, curve.r - 1)
+	table = FixedBaseTable(pwe, curve)
+
+	plain = bench("PWE * a + element * b (PyCryptodome)", lambda: pwe * a + element * b)
+	fast = bench("multi_scalar_mult (Shamir's trick)", lambda: multi_scalar_mult(pwe, a, element, b, curve))
+	log(STATUS, "    speedup: %.2fx" % (plain / fast))
+	fast = bench("multi_scalar_mult (fixed-base table)", lambda: multi_scalar_mult(pwe, a, element, b, curve, table))
+	log(STATUS, "    speedup: %.2fx" % (plain / fast))
+
+def bench_prf():
+	key, data = b"\x01\x02\x03\x04\x05\x06\x11\x22\x33\x44\x55\x66", b"password\x01"
+	def pycryptodome_hmac():
+		h = HMAC.new(key, digestmod=SHA256)
+		h.update(data)
+		return h.digest()
+	prf = HmacPrf(key)
+
+	plain = bench("HMAC-SHA256 (PyCryptodome)", pycryptodome_hmac, 10000)
+	fast = bench("HMAC256 (hmac.digest)", lambda: HMAC256(key, data), 10000)
+	log(STATUS, "    speedup: %.2fx" % (plain / fast))
+	fast = bench("HmacPrf (pre-keyed)", lambda: prf(data), 10000)
+	log(STATUS, "    speedup: %.2fx" % (plain / fast))
+
+	for curve in ["p256", "p521"]:
+		bench("derive_pwe_ecc %s" % curve, lambda: derive_pwe_ecc("password", "01:02:03:04:05:06",
+		      "11:22:33:44:55:66", curve))
+	bench("derive_pwe_ecc_eappwd p256", lambda: derive_pwe_ecc_eappwd("password", "user", "server", 2546484939))
+
+def bench_templates():
+	sta, ap = "01:02:03:04:05:06", "11:22:33:44:55:66"
+	curve = get_curve(19)
+	element = derive_pwe_ecc("password", sta, ap) * random.randint(2, curve.r - 1)
+	scalar = random.randint(2, curve.r - 1)
+	template = sae_commit_template(sta, ap)
+
+	plain = bench("raw(RadioTap()/build_sae_commit(...))", lambda: raw(RadioTap()/build_sae_commit(sta, ap, scalar, element)), 10000)
+	fast = bench("FrameTemplate.build", lambda: template.build(scalar=scalar, element=element, sc=0x10), 10000)
+	log(STATUS, "    speedup: %.2fx" % (plain / fast))
+
+def bench_arith():
+	curve = get_curve(19)
+	values = [random.randint(1, curve.p - 1) for i in range(100)]
+	exp = (curve.p - 1) // 2
+	plain = bench("Legendre symbol (Euler's criterion, 100x)", lambda: [pow(a, exp, curve.p) for a in values], 100)
+	backends = ["python"] + (["gmpy2"] if arith.gmpy2 is not None else [])
+	for backend in backends:
+		arith.set_backend(backend)
+		fast = bench("Jacobi symbol (%s, 100x)" % backend, lambda: [arith.jacobi(a, curve.p) for a in values], 100)
+		log(STATUS, "    speedup: %.2fx" % (plain / fast))
+		bench("derive_pwe_ecc p256 (%s)" % backend, lambda: derive_pwe_ecc("password", "01:02:03:04:05:06",
+		      "11:22:33:44:55:66"))
+
+if __name__ == "__main__":
+	bench_arith()
+	bench_templates()
+	bench_prf()
+	bench_fixed_base()
+	bench_multi_scalar()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Measure the memory usage and query time of a FrameStore compared to one IvInfo-like object per frame.
+# Run from the parent directory: python -m libwifi.benchmarks.bench_framestore
+from libwifi.framestore import *
+import random, sys, tempfile, timeit, tracemalloc
+
+def bench(name, func, number=1):
+	per_call = timeit.timeit(func, number=number) / number
+	log(STATUS, "%-45s %10.1f ms" % (name, per_call * 1e3))
+	return per_call
+
+class FrameInfo():
+	def __init__(self, ts, ta, ra, fc, sc, tid, pn, rssi, length):
+		self.ts, self.ta, self.ra, self.fc, self.sc = ts, ta, ra, fc, sc
+		self.tid, self.pn, self.rssi, self.length = tid, pn, rssi, length
+
+def bench_store(num_frames=1000000):
+	random.seed(0)
+	tas = [random.getrandbits(48) for i in range(100)]
+	ap = random.getrandbits(48)
+	rows = [(float(i), tas[i % 100], ap, 0x4188 | (0x0800 if i % 50 == 0 else 0), (i & 0xFFF) << 4, 0, i // 100,
+	         -40, 1500) for i in range(num_frames)]
+
+	tracemalloc.start()
+	objects = [FrameInfo(*row) for row in rows]
+	log(STATUS, "%-45s %10.1f MB" % ("One object per frame", tracemalloc.get_traced_memory()[0] / 1e6))
+	del objects
+	tracemalloc.stop()
+
+	tracemalloc.start()
+	store = FrameStore()
+	for row in rows:
+		store.append(*row)
+	log(STATUS, "%-45s %10.1f MB" % ("FrameStore", tracemalloc.get_traced_memory()[0] / 1e6))
+	tracemalloc.stop()
+
+	bench("FrameStore.group_by_transmitter", store.group_by_transmitter)
+	bench("FrameStore.retransmissions", store.retransmissions)
+	bench("FrameStore.pn_reuse", store.pn_reuse)
+
+	with tempfile.TemporaryDirectory() as directory:
+		spilled = FrameStore(chunk_size=1 << 18, spill_dir=directory)
+		bench("FrameStore.append (spilling)", lambda: [spilled.append(*row) for row in rows])
+		bench("FrameStore.group_by_transmitter (spilled)", spilled.group_by_transmitter)
+		spilled.close()
+
+if __name__ == "__main__":
+	bench_store(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
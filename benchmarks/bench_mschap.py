@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# Compare the MSCHAPv2 verifier with recomputing the NT-Response using the plain functions.
+# Run from the parent directory: python -m libwifi.benchmarks.bench_mschap
+from libwifi.mschap import *
+from libwifi.wifi import log, STATUS
+import os, timeit
+
+def bench(name, func, number=100):
+	per_call = timeit.timeit(func, number=number) / number
+	log(STATUS, "%-45s %10.1f us" % (name, per_call * 1e6))
+	return per_call
+
+def bench_verifier(num_users=1000):
+	users = [(b"user%d" % i, "password%d" % i) for i in range(num_users)]
+	auth_challenge, peer_challenge = os.urandom(16), os.urandom(16)
+	requests = [(username, auth_challenge, peer_challenge,
+	             generate_nt_response_mschap2(auth_challenge, peer_challenge, username, password))
+	            for username, password in users]
+
+	verifier = MSCHAPv2Verifier()
+	for username, password in users:
+		verifier.add_user(username, password)
+
+	def plain_verify():
+		for (username, password), request in zip(users, requests):
+			nt_response = generate_nt_response_mschap2(auth_challenge, peer_challenge, username, password)
+			if nt_response == request[3]:
+				generate_authenticator_response(password, nt_response, peer_challenge, auth_challenge, username)
+
+	plain = bench("%d users (plain functions)" % num_users, plain_verify, 5)
+	fast = bench("%d users (MSCHAPv2Verifier.verify_batch)" % num_users, lambda: verifier.verify_batch(requests), 5)
+	log(STATUS, "    speedup: %.2fx, %.0f verifications/s" % (plain / fast, num_users / fast))
+
+if __name__ == "__main__":
+	bench_verifier()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# Measure the latency of interface operations using netlink, compared to starting iw and ifconfig.
+# The channel is only read and set to its current value. Requires a wireless interface and root.
+# Run from the parent directory: python -m libwifi.benchmarks.bench_netlink [interface]
+from libwifi.wifi import *
+from libwifi.netlink import NetlinkClient
+import statistics, sys
+
+def bench(name, func, number=50):
+	latencies = []
+	for i in range(number):
+		start = time.perf_counter()
+		func()
+		latencies.append(time.perf_counter() - start)
+	log(STATUS, "%-40s median %9.1f us   max %9.1f us" % (name, statistics.median(latencies) * 1e6, max(latencies) * 1e6))
+
+def find_wireless_iface():
+	for iface in sorted(os.listdir("/sys/class/net")):
+		if os.path.exists("/sys/class/net/%s/phy80211" % iface):
+			return iface
+	return None
+
+if __name__ == "__main__":
+	iface = sys.argv[1] if len(sys.argv) > 1 else find_wireless_iface()
+	if iface is None:
+		log(WARNING, "No wireless interface found, skipping the netlink benchmark")
+		sys.exit(0)
+
+	client = NetlinkClient()
+	channel = client.get_channel(iface, cached=False)
+	bench("get channel, iw", lambda: str(subprocess.check_output(["iw", iface, "info"])))
+	bench("get channel, netlink", lambda: client.get_channel(iface, cached=False))
+	bench("get channel, netlink cache", lambda: client.get_channel(iface))
+	bench("get type, iw", lambda: str(subprocess.check_output(["iw", iface, "info"])))
+	bench("get type, netlink", lambda: client.get_iftype(iface, cached=False))
+	if channel is not None:
+		bench("set channel, iw", lambda: subprocess.check_output(["iw", iface, "set", "channel", str(channel)]))
+		bench("set channel, netlink", lambda: client.set_channel(iface, channel))
+	bench("set up, ifconfig", lambda: subprocess.check_output(["ifconfig", iface, "up"]))
+	bench("set up, netlink", lambda: client.set_up(iface, True))
+	client.close()
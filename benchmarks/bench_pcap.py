@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# Compare reading a capture with MmapPcapReader and with scapy's PcapReader.
+# Run from the parent directory: python -m libwifi.benchmarks.bench_pcap
+from libwifi.pcap import *
+import tempfile, timeit
+
+def bench(name, func, number=3):
+	per_call = timeit.timeit(func, number=number) / number
+	log(STATUS, "%-45s %10.1f ms" % (name, per_call * 1e3))
+	return per_call
+
+def bench_reader(num_frames=5000):
+	beacon = RadioTap()/Dot11(type=0, subtype=8, addr1="ff:ff:ff:ff:ff:ff", addr2="00:11:22:33:44:55",
+		addr3="00:11:22:33:44:55")/Dot11Beacon()/Dot11Elt(ID=0, info=b"benchmark")
+	data = RadioTap()/Dot11(type=2, addr1="00:11:22:33:44:55", addr2="02:00:00:00:00:01",
+		addr3="00:11:22:33:44:55")/LLC()/SNAP()/Raw(b"A" * 1000)
+
+	with tempfile.NamedTemporaryFile(suffix=".pcap") as tmp:
+		frames = [raw(beacon), raw(data)]
+		def write():
+			with BufferedPcapWriter(tmp.name) as writer:
+				for i in range(num_frames):
+					writer.write(frames[i % 2], ts=i)
+		bench("BufferedPcapWriter (%d frames)" % num_frames, write)
+
+		def scapy_beacons():
+			with PcapReader(tmp.name) as reader:
+				return sum(1 for p in reader if Dot11Beacon in p)
+		def mmap_beacons():
+			with MmapPcapReader(tmp.name, prefilter_dot11(types=[(0, 8)])) as reader:
+				return sum(1 for _ in reader)
+		assert scapy_beacons() == mmap_beacons() == num_frames // 2
+
+		plain = bench("Count beacons (scapy PcapReader)", scapy_beacons, 1)
+		fast = bench("Count beacons (MmapPcapReader + prefilter)", mmap_beacons)
+		log(STATUS, "    speedup: %.2fx" % (plain / fast))
+
+if __name__ == "__main__":
+	bench_reader()
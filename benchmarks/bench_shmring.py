@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Measure the throughput and latency of handing frames to worker processes using a SharedRing,
+# compared to sending scapy packets over a multiprocessing.Queue.
+# Run from the parent directory: python -m libwifi.benchmarks.bench_shmring
+from libwifi.shmring import *
+import hashlib, statistics
+
+def work(ts, meta, data):
+	# Stand-in for per-frame work such as decryption
+	return hashlib.sha256(data).digest()
+
+def queue_worker(frames, results):
+	while True:
+		item = frames.get()
+		if item is None:
+			break
+		ts, p = item
+		results.put((ts, work(ts, 0, raw(p))))
+
+def report(name, num_frames, elapsed, latencies):
+	latencies.sort()
+	log(STATUS, "%-40s %9.0f frames/s   median latency %7.1f us   p99 %8.1f us" % (name, num_frames / elapsed,
+	    statistics.median(latencies) * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6))
+
+def bench_ring(num_workers, frame, num_frames):
+	frames, results = SharedRing(num_slots=4096, slot_size=2048), SharedRing(num_slots=num_frames + 1, slot_size=64)
+	workers = [multiprocessing.Process(target=ring_worker, args=(frames, results, work)) for i in range(num_workers)]
+	for worker in workers:
+		worker.start()
+
+	latencies = []
+	def collect(timeout):
+		record = results.get(timeout=timeout)
+		if record is not None:
+			latencies.append(time.perf_counter() - record.ts)
+			record.release()
+
+	start = time.perf_counter()
+	for i in range(num_frames):
+		while not frames.put(frame, time.perf_counter(), i):
+			collect(0.001)
+	while len(latencies) < num_frames:
+		collect(1)
+	elapsed = time.perf_counter() - start
+
+	stop_ring_workers(frames, num_workers)
+	for worker in workers:
+		worker.join()
+	frames.close()
+	results.close()
+	report("SharedRing, %d workers" % num_workers, num_frames, elapsed, latencies)
+
+def bench_queue(num_workers, p, num_frames):
+	frames, results = multiprocessing.Queue(4096), multiprocessing.Queue()
+	workers = [multiprocessing.Process(target=queue_worker, args=(frames, results)) for i in range(num_workers)]
+	for worker in workers:
+		worker.start()
+
+	latencies = []
+	start = time.perf_counter()
+	for i in range(num_frames):
+		frames.put((time.perf_counter(), p))
+	for i in range(num_frames):
+		ts, _ = results.get()
+		latencies.append(time.perf_counter() - ts)
+	elapsed = time.perf_counter() - start
+
+	for worker in workers:
+		frames.put(None)
+	for worker in workers:
+		worker.join()
+	report("Queue of scapy packets, %d workers" % num_workers, num_frames, elapsed, latencies)
+
+if __name__ == "__main__":
+	p = RadioTap()/Dot11(type=2, addr1="00:11:22:33:44:55", addr2="02:00:00:00:00:01",
+		addr3="00:11:22:33:44:55")/LLC()/SNAP()/Raw(b"A" * 1000)
+	for num_workers in [1, 2, 4, 8]:
+		bench_queue(num_workers, p, 5000)
+		bench_ring(num_workers, raw(p), 50000)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Build filters for common 802.11 predicates. They are compiled to classic BPF so the kernel can
+# drop uninteresting frames before they are copied to userspace, and can also be evaluated on the
+# raw bytes of a frame when a kernel filter can't be attached.
+import ctypes, socket, struct
+
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+
+# Classic BPF opcodes
+BPF_LD, BPF_LDX, BPF_ALU, BPF_JMP, BPF_RET, BPF_MISC = 0x00, 0x01, 0x04, 0x05, 0x06, 0x07
+BPF_W, BPF_H, BPF_B = 0x00, 0x08, 0x10
+BPF_IMM, BPF_ABS, BPF_IND = 0x00, 0x20, 0x40
+BPF_OR, BPF_AND, BPF_LSH = 0x40, 0x50, 0x60
+BPF_JEQ = 0x10
+BPF_K, BPF_X = 0x00, 0x08
+BPF_TAX = 0x00
+
+BPF_LOAD_SIZES = {1: BPF_B, 2: BPF_H, 4: BPF_W}
+BPF_ACCEPT_LEN = 0x40000
+
+# Load the little-endian RadioTap length into the X register
+BPF_RADIOTAP_HEADER = [(BPF_LD | BPF_B | BPF_ABS, 0, 0, 3),
+                       (BPF_ALU | BPF_LSH | BPF_K, 0, 0, 8),
+                       (BPF_MISC | BPF_TAX, 0, 0, 0),
+                       (BPF_LD | BPF_B | BPF_ABS, 0, 0, 2),
+                       (BPF_ALU | BPF_OR | BPF_X, 0, 0, 0),
+                       (BPF_MISC | BPF_TAX, 0, 0, 0)]
+
+class Dot11Filter():
+	"""
+	Conjunction of 802.11 predicates. Calls can be chained, for example
+	Dot11Filter().frame_type(0, 8).addr2("00:11:22:33:44:55"). Multiple frame_type calls are
+	alternatives. Offsets are relative to the 802.11 header, which follows the RadioTap header
+	when radiotap is True.
+	"""
+	def __init__(self, radiotap=True):
+		self.radiotap = radiotap
+		# Checks are (offset, size, mask, value) tuples on big-endian fields of the 802.11 header
+		self.checks = []
+		self.types = []
+		# Byte strings that must occur in the frame. These can't be checked by the kernel.
+		self.needles = []
+
+	def frame_type(self, type, subtype=None):
+		if subtype is None:
+			self.types.append((0x0C, type << 2))
+		else:
+			self.types.append((0xFC, (subtype << 4) | (type << 2)))
+		return self
+
+	def qos(self):
+		"""Match QoS data frames"""
+		self.types.append((0x8C, 0x88))
+		return self
+
+	def _addr(self, offset, addr):
+		value = bytes.fromhex(addr.replace(":", ""))
+		self.checks.append((offset, 4, None, struct.unpack(">I", value[:4])[0]))
+		self.checks.append((offset + 4, 2, None, struct.unpack(">H", value[4:])[0]))
+		return self
+
+	def addr1(self, addr):
+		return self._addr(4, addr)
+
+	def addr2(self, addr):
+		return self._addr(10, addr)
+
+	def addr3(self, addr):
+		return self._addr(16, addr)
+
+	def protected(self, enabled=True):
+		self.checks.append((1, 1, 0x40, 0x40 if enabled else 0))
+		return self
+
+	def contains(self, data):
+		self.needles.append(bytes(data))
+		return self
+
+	def kernel_complete(self):
+		"""Returns True if the compiled BPF program checks all predicates"""
+		return len(self.needles) == 0
+
+	#### Compilation to classic BPF ####
+
+	def compile(self):
+		"""Returns the BPF program as a list of (code, jt, jf, k) instructions"""
+		if self.radiotap:
+			prog = list(BPF_RADIOTAP_HEADER)
+		else:
+			prog = [(BPF_LDX | BPF_W | BPF_IMM, 0, 0, 0)]
+
+		# Jumps to the final reject instruction are resolved at the end
+		reject = []
+		for offset, size, mask, value in self.checks:
+			prog.append((BPF_LD | BPF_LOAD_SIZES[size] | BPF_IND, 0, 0, offset))
+			if mask is not None:
+				prog.append((BPF_ALU | BPF_AND | BPF_K, 0, 0, mask))
+			reject.append(len(prog))
+			prog.append((BPF_JMP | BPF_JEQ | BPF_K, 0, 0, value))
+
+		for i, (mask, value) in enumerate(self.types):
+			remaining = len(self.types) - i - 1
+			prog.append((BPF_LD | BPF_B | BPF_IND, 0, 0, 0))
+			prog.append((BPF_ALU | BPF_AND | BPF_K, 0, 0, mask))
+			# On a match skip the remaining alternatives, otherwise try the next one
+			if remaining > 0:
+				prog.append((BPF_JMP | BPF_JEQ | BPF_K, 3 * remaining, 0, value))
+			else:
+				reject.append(len(prog))
+				prog.append((BPF_JMP | BPF_JEQ | BPF_K, 0, 0, value))
+
+		prog.append((BPF_RET | BPF_K, 0, 0, BPF_ACCEPT_LEN))
+		prog.append((BPF_RET | BPF_K, 0, 0, 0))
+
+		for pos in reject:
+			code, jt, _, k = prog[pos]
+			prog[pos] = (code, jt, len(prog) - 1 - pos - 1, k)
+		return prog
+
+	def attach(self, sock):
+		"""Attach the compiled filter to a socket. Raises OSError if this isn't supported."""
+		prog = self.compile()
+		data = b"".join(struct.pack("HBBI", *instruction) for instruction in prog)
+		buf = ctypes.create_string_buffer(data)
+		fprog = struct.pack("HL", len(prog), ctypes.addressof(buf))
+		sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+	@staticmethod
+	def detach(sock):
+		try:
+			sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+		except OSError:
+			pass
+
+	#### Evaluation in Python ####
+
+	def match(self, data):
+		"""Evaluate the filter on the raw bytes of a frame"""
+		if self.radiotap:
+			if len(data) < 4:
+				return False
+			base = data[2] | (data[3] << 8)
+		else:
+			base = 0
+
+		for offset, size, mask, value in self.checks:
+			pos = base + offset
+			if pos + size > len(data):
+				return False
+			field = int.from_bytes(data[pos:pos + size], "big")
+			if (field if mask is None else field & mask) != value:
+				return False
+
+		if len(self.types) > 0:
+			if base >= len(data):
+				return False
+			if not any(data[base] & mask == value for mask, value in self.types):
+				return False
+
+		if len(self.needles) > 0 and not isinstance(data, (bytes, bytearray)):
+			data = bytes(data)
+		return all(needle in data for needle in self.needles)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Capture from several monitor interfaces at once. One thread reads all sockets into bounded
+# per-interface queues, and the frames are merged into a single stream ordered by timestamp.
+from .wifi import *
+import collections, select, threading, time
+
+class CapturedFrame():
+	"""A received frame as raw bytes, tagged with the interface and timestamps"""
+	__slots__ = ["ts", "iface", "tsft", "data"]
+
+	def __init__(self, ts, iface, tsft, data):
+		self.ts = ts
+		self.iface = iface
+		self.tsft = tsft
+		self.data = data
+
+	def packet(self):
+		p = RadioTap(self.data)
+		p.time = self.ts
+		return p
+
+	def __repr__(self):
+		return "CapturedFrame(%.6f, %s, len=%d)" % (self.ts, self.iface, len(self.data))
+
+class InterfaceStats():
+	__slots__ = ["received", "dropped", "duplicates"]
+
+	def __init__(self):
+		self.received = self.dropped = self.duplicates = 0
+
+	def __repr__(self):
+		return "InterfaceStats(received=%d, dropped=%d, duplicates=%d)" % (self.received, self.dropped, self.duplicates)
+
+class CaptureMux():
+	"""
+	Reads frames with a RadioTap header from the given sockets, which is a dict that maps interface
+	names to sockets. MonitorSockets drop frames like their recv() does, such as our own injected
+	frames. Every interface has a queue of at most queue_size frames, and new frames are dropped
+	when it's full. Frames are merged in order of their host timestamp and are only returned once
+	they are reorder_delay seconds old, so frames of slower interfaces can be sorted in. The TSFT
+	is not used for ordering because the TSF timers of different radios are not synchronized. A
+	frame that was received by another radio less than dedup_window seconds ago is dropped as a
+	duplicate.
+	"""
+	def __init__(self, sockets, queue_size=4096, reorder_delay=0.01, dedup_window=0.05):
+		self.sockets = dict(sockets)
+		self.queue_size = queue_size
+		self.reorder_delay = reorder_delay
+		self.dedup_window = dedup_window
+		self.queues = {iface: collections.deque() for iface in self.sockets}
+		self.stats = {iface: InterfaceStats() for iface in self.sockets}
+		# Maps the 802.11 bytes of recent frames to the (time, interface) they were received at
+		self.recent = collections.OrderedDict()
+		self.cond = threading.Condition()
+		self.thread = None
+		self.running = False
+
+	def start(self):
+		"""Read the sockets on a background thread"""
+		self.running = True
+		self.thread = threading.Thread(target=self._run, name="CaptureMux", daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+	def close(self):
+		self.stop()
+		for sock in self.sockets.values():
+			sock.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
+
+	def _run(self):
+		while self.running:
+			self.poll(0.1)
+
+	def poll(self, timeout=0, budget=256):
+		"""Read the frames that are available, waiting at most timeout seconds. Returns the number read."""
+		socks = {sock.fileno(): (iface, sock) for iface, sock in self.sockets.items()}
+		readable, _, _ = select.select(list(socks), [], [], timeout)
+		num = 0
+		while len(readable) > 0 and num < budget:
+			for fd in readable:
+				iface, sock = socks[fd]
+				frame = self._recv(sock)
+				# Frames that the socket drops also count towards the budget
+				num += 1
+				if frame is not None:
+					data, ts = frame
+					self._enqueue(iface, data, ts if ts else time.time())
+			readable, _, _ = select.select(list(socks), [], [], 0)
+		return num
+
+	def _recv(self, sock):
+		if isinstance(sock, MonitorSocket):
+			return sock.recv_frame(MTU)
+		cls, data, ts = sock.recv_raw(MTU)
+		return (data, ts) if data else None
+
+	def _is_duplicate(self, iface, data, ts):
+		# Compare frames without their RadioTap header and FCS, since these differ between radios
+		if len(data) < 8 or len(data) < radiotap_len(data):
+			return False
+		end = len(data) - 4 if radiotap_has_fcs(data) else len(data)
+		key = bytes(data[radiotap_len(data):end])
+
+		recent = self.recent
+		while len(recent) > 0:
+			oldest = next(iter(recent.values()))[0]
+			if oldest >= ts - self.dedup_window:
+				break
+			recent.popitem(last=False)
+
+		# Retransmissions received by the same radio are not duplicates
+		if key in recent and recent[key][1] != iface:
+			return True
+		recent[key] = (ts, iface)
+		recent.move_to_end(key)
+		return False
+
+	def _enqueue(self, iface, data, ts):
+		stats = self.stats[iface]
+		stats.received += 1
+		with self.cond:
+			if self.dedup_window and self._is_duplicate(iface, data, ts):
+				stats.duplicates += 1
+				metrics.count("capture.duplicates")
+				return
+			queue = self.queues[iface]
+			if len(queue) >= self.queue_size:
+				stats.dropped += 1
+				metrics.count("capture.dropped")
+				return
+			tsft = radiotap_tsft(data) if len(data) >= 8 else None
+			queue.append(CapturedFrame(ts, iface, tsft, data))
+			self.cond.notify()
+
+	def backlog(self):
+		"""Returns the fill level of the fullest queue, between 0 and 1"""
+		with self.cond:
+			return max(len(queue) for queue in self.queues.values()) / self.queue_size
+
+	def _pop_ready(self, now, flush=False):
+		"""Returns the oldest queued frame if it can be returned without breaking the order"""
+		heads = [(queue[0].ts, iface) for iface, queue in self.queues.items() if len(queue) > 0]
+		if len(heads) == 0:
+			return None
+		ts, iface = min(heads)
+		# When every queue has a frame the oldest one can always be returned
+		if flush or len(heads) == len(self.queues) or ts <= now - self.reorder_delay:
+			return self.queues[iface].popleft()
+		return None
+
+	def recv(self, timeout=None, flush=False):
+		"""
+		Returns the next CapturedFrame of the merged stream, or None on timeout. When flush is True
+		the reordering delay is ignored, e.g. to drain the queues after stopping the capture.
+		"""
+		deadline = None if timeout is None else time.time() + timeout
+		with self.cond:
+			while True:
+				now = time.time()
+				frame = self._pop_ready(now, flush)
+				if frame is not None:
+					return frame
+				if deadline is not None and now >= deadline:
+					return None
+				wait = self.reorder_delay
+				if deadline is not None:
+					wait = min(wait, deadline - now)
+				self.cond.wait(wait)
+
+	def __iter__(self):
+		while self.running:
+			frame = self.recv(timeout=0.1)
+			if frame is not None:
+				yield frame
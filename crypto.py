@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
-import struct, binascii
+import struct, binascii, hmac, collections, hashlib, dbm, multiprocessing
 from .wifi import *
+from . import metrics
 #from binascii import a2b_hex
 #from struct import unpack,pack
 
@@ -9,6 +10,14 @@ from scapy.layers.dot11 import Dot11, Dot11CCMP, Dot11QoS
 
 import zlib
 
+def prf_sha1(key, label, data, num_bytes):
+	"""The 802.11 PRF based on HMAC-SHA1"""
+	prefix = label + b"\x00" + data
+	result = b""
+	for i in range((num_bytes + 19) // 20):
+		result += hmac.digest(key, prefix + struct.pack("B", i), "sha1")
+	return result[:num_bytes]
+
 def pn2bytes(pn):
 	pn_bytes = [0] * 6
 	for i in range(6):
@@ -85,10 +94,12 @@ def encrypt_ccmp(p, tk, pn, keyid=0):
 
 	# Encrypt the plaintext using AES in CCM Mode.
 	#print("Payload:", payload.hex())
-	cipher = AES.new(tk, AES.MODE_CCM, ccm_nonce, mac_len=8)
-	cipher.update(ccm_aad)
-	ciphertext = cipher.encrypt(payload)
-	digest = cipher.digest()
+	with metrics.timed("crypto.ccmp.encrypt"):
+		cipher = AES.new(tk, AES.MODE_CCM, ccm_nonce, mac_len=8)
+		cipher.update(ccm_aad)
+		ciphertext = cipher.encrypt(payload)
+		digest = cipher.digest()
+	metrics.count("crypto.ccmp.encrypted")
 	newp = newp/Raw(ciphertext)
 	newp = newp/Raw(digest)
 
@@ -98,12 +109,158 @@ def encrypt_ccmp(p, tk, pn, keyid=0):
 
 	return newp
 
+@metrics.timed("crypto.derive_pmk")
+def derive_pmk(passphrase, ssid):
+	"""Derive the WPA2-Personal PMK of a passphrase using PBKDF2-SHA1 with 4096 iterations"""
+	if isinstance(passphrase, str): passphrase = passphrase.encode()
+	if isinstance(ssid, str): ssid = ssid.encode()
+	return hashlib.pbkdf2_hmac("sha1", passphrase, ssid, 4096, 32)
+
+def _derive_pmk_job(network):
+	return derive_pmk(network[1], network[0])
+
+class PmkCache():
+	"""
+	Least-recently-used cache of PMKs keyed by (SSID, passphrase). When a filename is given the
+	PMKs are also stored on disk, indexed by a hash of the SSID and passphrase, so they survive
+	between runs.
+	"""
+	def __init__(self, maxsize=1024, filename=None):
+		self.maxsize = maxsize
+		self.entries = collections.OrderedDict()
+		self.db = dbm.open(filename, "c") if filename is not None else None
+
+	@staticmethod
+	def disk_key(ssid, passphrase):
+		ssid = ssid.encode() if isinstance(ssid, str) else ssid
+		passphrase = passphrase.encode() if isinstance(passphrase, str) else passphrase
+		return hashlib.sha256(struct.pack("<B", len(ssid)) + ssid + passphrase).hexdigest()
+
+	def lookup(self, ssid, passphrase):
+		"""Returns the cached PMK or None"""
+		key = (ssid, passphrase)
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			return self.entries[key]
+		if self.db is not None:
+			pmk = self.db.get(PmkCache.disk_key(ssid, passphrase))
+			if pmk is not None:
+				self._add(key, pmk)
+				return pmk
+		return None
+
+	def _add(self, key, pmk):
+		self.entries[key] = pmk
+		if len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+
+	def store(self, ssid, passphrase, pmk):
+		self._add((ssid, passphrase), pmk)
+		if self.db is not None:
+			self.db[PmkCache.disk_key(ssid, passphrase)] = pmk
+
+	def get(self, ssid, passphrase):
+		pmk = self.lookup(ssid, passphrase)
+		if pmk is None:
+			pmk = derive_pmk(passphrase, ssid)
+			self.store(ssid, passphrase, pmk)
+		return pmk
+
+	def get_many(self, networks, processes=None, chunksize=1):
+		"""
+		Return the PMKs of a list of (SSID, passphrase) tuples. PMKs that aren't cached yet are
+		derived in parallel using a process pool.
+		"""
+		pmks = dict()
+		for network in networks:
+			if network not in pmks:
+				pmks[network] = self.lookup(*network)
+		missing = [network for network, pmk in pmks.items() if pmk is None]
+
+		if processes == 1 or len(missing) <= 1:
+			derived = map(_derive_pmk_job, missing)
+		else:
+			with multiprocessing.Pool(processes) as pool:
+				derived = pool.map(_derive_pmk_job, missing, chunksize)
+		for network, pmk in zip(missing, derived):
+			self.store(network[0], network[1], pmk)
+			pmks[network] = pmk
+
+		return [pmks[network] for network in networks]
+
+	def close(self):
+		if self.db is not None:
+			self.db.close()
+			self.db = None
+
+	def __len__(self):
+		return len(self.entries)
+
+class KeyStore():
+	"""
+	Temporal keys indexed by their (AP, STA) pair. The previous key of every pair is kept so
+	that frames which are still sent with the old key during a rekey can be decrypted. The PMK
+	of every AP can also be stored so handshakes can be followed.
+	"""
+	def __init__(self, max_pairs=4096, pmk_cache=None):
+		self.max_pairs = max_pairs
+		self.keys = collections.OrderedDict()
+		self.pmks = dict()
+		self.pmk_cache = pmk_cache if pmk_cache is not None else PmkCache()
+
+	def set_pmk(self, ap, pmk):
+		self.pmks[ap] = pmk
+
+	def get_pmk(self, ap):
+		return self.pmks.get(ap)
+
+	def add_networks(self, networks, processes=None):
+		"""Derive and store the PMK of (SSID, passphrase, [AP addresses]) tuples in parallel"""
+		pmks = self.pmk_cache.get_many([(ssid, passphrase) for ssid, passphrase, _ in networks], processes)
+		for (_, _, aps), pmk in zip(networks, pmks):
+			for ap in aps:
+				self.set_pmk(ap, pmk)
+
+	def install(self, ap, sta, tk):
+		pair = (ap, sta)
+		old = self.keys.pop(pair, None)
+		if old is not None and old[0] == tk:
+			# Reinstalling the same key must not overwrite the previous one
+			self.keys[pair] = old
+			return
+		self.keys[pair] = (tk, old[0] if old is not None else None)
+		if len(self.keys) > self.max_pairs:
+			self.keys.popitem(last=False)
+
+	def remove(self, ap, sta):
+		self.keys.pop((ap, sta), None)
+
+	def get_keys(self, addr1, addr2):
+		"""Return the current and previous key to decrypt a frame sent between both addresses"""
+		keys = self.keys.get((addr1, addr2)) or self.keys.get((addr2, addr1))
+		if keys is None:
+			return []
+		return [tk for tk in keys if tk is not None]
+
+	def __len__(self):
+		return len(self.keys)
+
 # XXX Assure this is still compatible with KRACK attack scripts
-def decrypt_ccmp(p, tk):
-	"""Takes a Dot11CCMP frame and decrypts it"""
+def decrypt_ccmp(p, tk=None, keystore=None):
+	"""
+	Takes a Dot11CCMP frame and decrypts it. Instead of a tk a KeyStore can be given, and
+	then its current and previous key of the sender are tried.
+	"""
+	if tk is None:
+		tks = keystore.get_keys(p.addr1, p.addr2) if keystore is not None else []
+		for tk in tks:
+			try:
+				return decrypt_ccmp(p, tk)
+			except ValueError:
+				pass
+		metrics.count("crypto.ccmp.no_key")
+		raise ValueError("No key in the KeyStore can decrypt the frame")
 
-	# We currently don't support Dot11QoS frames
-	assert not Dot11QoS in p
 	p = p.copy()
 
 	# Get used CCMP parameters
@@ -114,20 +271,33 @@ def decrypt_ccmp(p, tk):
 	# TODO: Mask flags in p.FCfield that are not part of the AAD
 	fc = p.FCfield
 	payload = get_ccmp_payload(p)
-	p.remove_payload()
+	# Keep the QoS header because it's part of the AAD
+	if Dot11QoS in p:
+		p[Dot11QoS].remove_payload()
+	else:
+		p.remove_payload()
 
 	# Prepare for CCMP decryption
 	ccm_nonce = ccmp_get_nonce(priority, p.addr2, pn)
 	ccm_aad = ccmp_get_aad(p)
 
 	# Decrypt using AES in CCM Mode.
-	cipher = AES.new(tk, AES.MODE_CCM, ccm_nonce, mac_len=8)
-	cipher.update(ccm_aad)
-	plaintext = cipher.decrypt(payload[:-8])
-	cipher.verify(payload[-8:])
+	with metrics.timed("crypto.ccmp.decrypt"):
+		cipher = AES.new(tk, AES.MODE_CCM, ccm_nonce, mac_len=8)
+		cipher.update(ccm_aad)
+		plaintext = cipher.decrypt(payload[:-8])
+		try:
+			cipher.verify(payload[-8:])
+		except ValueError:
+			metrics.count("crypto.ccmp.mic_failures")
+			raise
+	metrics.count("crypto.ccmp.decrypted")
 
 	# TODO: Strip the protected bit from the frame?
 
+	# An A-MSDU doesn't start with an LLC header. Use amsdu_subframes to parse it.
+	if Dot11QoS in p and p[Dot11QoS].A_MSDU_Present:
+		return p/conf.raw_layer(plaintext)
 	return p/LLC(plaintext)
 
 def encrypt_wep(p, key, pn, keyid=0):
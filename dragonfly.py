@@ -3,9 +3,10 @@
 #!/usr/bin/env python3
 from scapy.all import *
 from .wifi import *
-import sys, struct, math, random, select, time, binascii
+from . import metrics, arith
+import sys, struct, math, random, select, time, binascii, functools, collections, hashlib, hmac
 
-from Crypto.Hash import HMAC, SHA256
+from Crypto.Hash import HMAC, SHA256, SHA384, SHA512
 from Crypto.PublicKey import ECC
 from Crypto.Math.Numbers import Integer
 
@@ -14,11 +15,11 @@ from sympy.ntheory.residue_ntheory import sqrt_mod_iter
 
 # ----------------------- Utility ---------------------------------
 
-def int_to_data(num):
-	return binascii.unhexlify("%064x" % num)
+def int_to_data(num, num_bytes=32):
+	return int(num).to_bytes(num_bytes, "big")
 
-def zeropoint_to_data():
-	return int_to_data(0) + int_to_data(0)
+def zeropoint_to_data(num_bytes=32):
+	return int_to_data(0, num_bytes) + int_to_data(0, num_bytes)
 
 #TODO: Not sure if this actually works under python2...
 def str2bytes(password):
@@ -34,10 +35,41 @@ def getord(value):
 	else:
 		return ord(value)
 
+class HmacPrf():
+	"""
+	HMAC-SHA256 with a fixed key. The key pads are hashed once and every message clones
+	that keyed state, which avoids redoing this work when the same key is used many times.
+	"""
+	__slots__ = ["inner", "outer"]
+
+	def __init__(self, key):
+		if len(key) > 64:
+			key = hashlib.sha256(key).digest()
+		key = key.ljust(64, b"\x00")
+		self.inner = hashlib.sha256(bytes(c ^ 0x36 for c in key))
+		self.outer = hashlib.sha256(bytes(c ^ 0x5c for c in key))
+
+	def __call__(self, data):
+		inner = self.inner.copy()
+		inner.update(data)
+		outer = self.outer.copy()
+		outer.update(inner.digest())
+		return outer.digest()
+
 def HMAC256(pw, data):
-	h = HMAC.new(pw, digestmod=SHA256)
-	h.update(data)
-	return h.digest()
+	"""The key can be given as bytes or as a pre-keyed HmacPrf"""
+	if isinstance(pw, HmacPrf):
+		return pw(data)
+	return hmac.digest(pw, data, "sha256")
+
+def hmac_hash(key, data, hashmod=SHA256):
+	"""HMAC with the given hash. With SHA-256 the key can also be a pre-keyed HmacPrf."""
+	if hashmod is SHA256:
+		return HMAC256(key, data)
+	return HMAC.new(key, data, digestmod=hashmod).digest()
+
+# The all-zero key is used to derive the keyseed and by EAP-pwd
+zero_key_prf = HmacPrf(b"\x00" * 32)
 
 
 # ----------------------- Elliptic Curve Operations ---------------------------------
@@ -47,23 +79,222 @@ secp256r1_p = 0xffffffff00000001000000000000000000000000ffffffffffffffffffffffff
 secp256r1_r = 0xffffffff00000000ffffffffffffffffbce6faada7179e84f3b9cac2fc632551
 
 def legendre_symbol(a, p):
-	"""Compute the Legendre symbol."""
-	if a % p == 0: return 0
-
-	ls = pow(a, (p - 1)//2, p)
-	return -1 if ls == p - 1 else ls
+	"""Compute the Legendre symbol. For an odd prime it equals the Jacobi symbol."""
+	return arith.jacobi(a, p)
 
 def point_on_curve(x, y, curve="p256"):
-	try:
-		point = ECC.EccPoint(x, y)
-	except ValueError:
+	curve = get_curve(curve)
+	x, y = int(x), int(y)
+	if not (0 <= x < curve.p and 0 <= y < curve.p):
 		return False
-	return True
+	return y * y % curve.p == curve.y_squared(x)
 
-def point_to_data(p):
+def point_to_data(p, num_bytes=32):
 	if p is None:
-		return zeropoint_to_data()
-	return int_to_data(p.x) + int_to_data(p.y)
+		return zeropoint_to_data(num_bytes)
+	return int_to_data(p.x, num_bytes) + int_to_data(p.y, num_bytes)
+
+
+class CurveContext():
+	"""Parameters of a NIST curve group, including constants that are precomputed once"""
+	__slots__ = ["name", "group", "p", "r", "b", "bits", "prime_len", "order_len", "prime_data", "sqrt_exp"]
+
+	def __init__(self, name, group):
+		curve = ECC._curves[name]
+		init = lambda attr, value: object.__setattr__(self, attr, value)
+		init("name", name)
+		init("group", group)
+		init("p", int(curve.p))
+		init("r", int(curve.order))
+		init("b", int(curve.b))
+		init("bits", curve.modulus_bits)
+		init("prime_len", (self.bits + 7) // 8)
+		init("order_len", (self.r.bit_length() + 7) // 8)
+		init("prime_data", self.int_to_data(self.p))
+		# All supported primes are 3 modulo 4 so a square root is a single exponentiation
+		assert self.p % 4 == 3
+		init("sqrt_exp", (self.p + 1) // 4)
+
+	def __setattr__(self, attr, value):
+		raise AttributeError("CurveContext objects are immutable")
+
+	def __repr__(self):
+		return "CurveContext(%s, group=%d)" % (self.name, self.group)
+
+	def int_to_data(self, num):
+		return int(num).to_bytes(self.prime_len, "big")
+
+	def scalar_to_data(self, num):
+		return int(num).to_bytes(self.order_len, "big")
+
+	def data_to_int(self, data):
+		return arith.from_bytes(data)
+
+	def point_to_data(self, p):
+		return point_to_data(p, self.prime_len)
+
+	def data_to_point(self, data):
+		x = int.from_bytes(data[:self.prime_len], "big")
+		y = int.from_bytes(data[self.prime_len:2*self.prime_len], "big")
+		return ECC.EccPoint(x, y, self.name)
+
+	def legendre(self, a):
+		"""Compute the Legendre symbol of a modulo the prime of the curve."""
+		return arith.jacobi(a, self.p)
+
+	def sqrt(self, a):
+		return arith.powmod(a, self.sqrt_exp, self.p)
+
+	def y_squared(self, x):
+		return (x * x * x - 3 * x + self.b) % self.p
+
+# Curves of the ECC groups that are supported by SAE and EAP-pwd
+sae_group_curves = {19: "p256", 20: "p384", 21: "p521"}
+
+curve_contexts = {group: CurveContext(name, group) for group, name in sae_group_curves.items()}
+curve_contexts.update({curve.name: curve for curve in list(curve_contexts.values())})
+
+def get_curve(curve):
+	"""Get the context of a curve given its name, group number, or the context itself"""
+	if isinstance(curve, CurveContext):
+		return curve
+	if curve not in curve_contexts:
+		raise ValueError("Unsupported curve or group %s" % curve)
+	return curve_contexts[curve]
+
+
+# ----------------------- Fixed-base and Multi-scalar Multiplication ---------------------------------
+
+# Points are represented as Jacobian (X, Y, Z) tuples of Python integers where Z == 0 is the point
+# at infinity. All supported curves have a = -3, which the doubling formula takes advantage of.
+
+def ec_double(P, curve):
+	X1, Y1, Z1 = P
+	if Z1 == 0 or Y1 == 0:
+		return (1, 1, 0)
+	p = curve.p
+	delta = Z1 * Z1 % p
+	gamma = Y1 * Y1 % p
+	beta = X1 * gamma % p
+	alpha = 3 * (X1 - delta) * (X1 + delta) % p
+	X3 = (alpha * alpha - 8 * beta) % p
+	Z3 = ((Y1 + Z1) ** 2 - gamma - delta) % p
+	Y3 = (alpha * (4 * beta - X3) - 8 * gamma * gamma) % p
+	return (X3, Y3, Z3)
+
+def ec_add_affine(P, Q, curve):
+	"""Add the affine point Q = (x, y) to the Jacobian point P"""
+	X1, Y1, Z1 = P
+	if Z1 == 0:
+		return (Q[0], Q[1], 1)
+	p = curve.p
+	Z1Z1 = Z1 * Z1 % p
+	H = (Q[0] * Z1Z1 - X1) % p
+	r = 2 * (Q[1] * Z1 * Z1Z1 - Y1) % p
+	if H == 0:
+		return ec_double(P, curve) if r == 0 else (1, 1, 0)
+	HH = H * H % p
+	I = 4 * HH
+	J = H * I % p
+	V = X1 * I % p
+	X3 = (r * r - J - 2 * V) % p
+	Y3 = (r * (V - X3) - 2 * Y1 * J) % p
+	Z3 = ((Z1 + H) ** 2 - Z1Z1 - HH) % p
+	return (X3, Y3, Z3)
+
+def ec_to_affine(P, curve):
+	X, Y, Z = P
+	if Z == 0:
+		return None
+	p = curve.p
+	zinv = pow(Z, -1, p)
+	zinv2 = zinv * zinv % p
+	return (X * zinv2 % p, Y * zinv2 * zinv % p)
+
+def ec_to_point(P, curve):
+	affine = ec_to_affine(P, curve)
+	if affine is None:
+		return ECC.EccPoint(0, 0, curve.name)
+	return ECC.EccPoint(affine[0], affine[1], curve.name)
+
+class FixedBaseTable():
+	"""
+	Precomputed multiples j * 2^(window*i) * P of a fixed point P. Multiplying P by a scalar then
+	only needs one point addition per window instead of a full double-and-add.
+	"""
+	def __init__(self, point, curve_name="p256", window=4):
+		self.curve = get_curve(curve_name)
+		self.window = window
+		self.point = point
+
+		self.rows = []
+		base = (int(point.x), int(point.y))
+		for i in range((self.curve.r.bit_length() + window - 1) // window):
+			row = [base]
+			acc = (base[0], base[1], 1)
+			for j in range(2, 1 << window):
+				acc = ec_add_affine(acc, base, self.curve)
+				row.append(ec_to_affine(acc, self.curve))
+			self.rows.append(row)
+			acc = ec_add_affine((row[-1][0], row[-1][1], 1), base, self.curve)
+			base = ec_to_affine(acc, self.curve)
+
+	def multiply_jacobian(self, scalar):
+		scalar %= self.curve.r
+		mask = (1 << self.window) - 1
+		acc = (1, 1, 0)
+		for row in self.rows:
+			digit = scalar & mask
+			if digit != 0:
+				acc = ec_add_affine(acc, row[digit - 1], self.curve)
+			scalar >>= self.window
+		return acc
+
+	def multiply(self, scalar):
+		return ec_to_point(self.multiply_jacobian(scalar), self.curve)
+
+def multi_scalar_mult(P, a, Q, b, curve_name="p256", table=None, window=2):
+	"""
+	Compute P * a + Q * b using Shamir's trick: both scalars are processed in one pass that shares
+	the point doublings. When a fixed-base table of P is given it is used for P * a instead, and
+	only Q * b is computed using a generic scalar multiplication.
+
+	Note that the interleaved version is pure Python and therefore slower than two scalar
+	multiplications by PyCryptodome. Only the table-based version is faster (see benchmarks).
+	"""
+	curve = get_curve(curve_name)
+	a %= curve.r
+	b %= curve.r
+
+	if table is not None:
+		acc = table.multiply_jacobian(a)
+		Qb = Q * b
+		if not Qb.is_point_at_infinity():
+			acc = ec_add_affine(acc, (int(Qb.x), int(Qb.y)), curve)
+		return ec_to_point(acc, curve)
+
+	# Precompute i * P + j * Q for all window digits i and j
+	size = 1 << window
+	Pa = (int(P.x), int(P.y))
+	Qa = (int(Q.x), int(Q.y))
+	combos = [[None] * size for _ in range(size)]
+	for i in range(size):
+		acc = (1, 1, 0)
+		for _ in range(i):
+			acc = ec_add_affine(acc, Pa, curve)
+		for j in range(size):
+			combos[i][j] = ec_to_affine(acc, curve)
+			acc = ec_add_affine(acc, Qa, curve)
+
+	acc = (1, 1, 0)
+	mask = size - 1
+	for shift in reversed(range(0, max(a.bit_length(), b.bit_length()), window)):
+		for _ in range(window):
+			acc = ec_double(acc, curve)
+		i, j = (a >> shift) & mask, (b >> shift) & mask
+		if i != 0 or j != 0:
+			acc = ec_add_affine(acc, combos[i][j], curve)
+	return ec_to_point(acc, curve)
 
 
 # ----------------------- WPA3 ---------------------------------
@@ -79,74 +310,404 @@ def is_sae_commit(p):
 def is_sae_confirm(p):
 	return is_sae(p) and p[Dot11Auth].seqnum == 2
 
-def KDF_Length(data, label, context, length):
-	iterations = int(math.ceil(length / 256.0))
+def KDF_Length(data, label, context, length, hashmod=SHA256):
+	iterations = int(math.ceil(length / (hashmod.digest_size * 8.0)))
+	prf = data
+	if hashmod is SHA256 and iterations > 1 and not isinstance(data, HmacPrf):
+		prf = HmacPrf(data)
+	suffix = str2bytes(label) + context + struct.pack("<H", length)
 	result = b""
 	for i in range(1, iterations + 1):
-		hash_data = struct.pack("<H", i) + str2bytes(label) + context + struct.pack("<H", length)
-		result += HMAC256(data, hash_data)
+		result += hmac_hash(prf, struct.pack("<H", i) + suffix, hashmod)
+
+	# Only keep the requested number of bits (this matters for curve 521)
+	result = result[:(length + 7) // 8]
+	if length % 8 != 0:
+		num_clear = 8 - (length % 8)
+		result = result[:-1] + struct.pack(">B", result[-1] >> num_clear << num_clear)
 	return result
 
-# TODO: Also modify to support curve 521
-def derive_pwe_ecc(password, addr1, addr2, curve_name="p256"):
-	curve = ECC._curves[curve_name]
-	bits = curve.modulus_bits
-	assert bits % 8 == 0
+metrics.register_histogram("dragonfly.pwe.iterations", [1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 40])
+
+@metrics.timed("dragonfly.derive_pwe_ecc")
+def derive_pwe_ecc(password, addr1, addr2, curve_name="p256", info=None):
+	curve = get_curve(curve_name)
+	bits = curve.bits
 
 	addr1 = binascii.unhexlify(addr1.replace(':', ''))
 	addr2 = binascii.unhexlify(addr2.replace(':', ''))
-	hash_pw = addr1 + addr2 if addr1 > addr2 else addr2 + addr1
+	hash_pw = HmacPrf(addr1 + addr2 if addr1 > addr2 else addr2 + addr1)
+	password = str2bytes(password)
 
 	for counter in range(1, 100):
-		hash_data = str2bytes(password) + struct.pack("<B", counter)
-		pwd_seed = HMAC256(hash_pw, hash_data)
+		pwd_seed = hash_pw(password + struct.pack("<B", counter))
 		log(DEBUG, "PWD-seed: %s" % pwd_seed)
-		pwd_value = KDF_Length(pwd_seed, "SAE Hunting and Pecking", curve.p.to_bytes(bits // 8), bits)
+		pwd_value = KDF_Length(pwd_seed, "SAE Hunting and Pecking", curve.prime_data, bits)
 		log(DEBUG, "PWD-value: %s" % pwd_value)
-		pwd_value = int(binascii.hexlify(pwd_value), 16)
+		pwd_value = curve.data_to_int(pwd_value)
+
+		if bits % 8 != 0:
+			pwd_value = pwd_value >> (8 - (bits % 8))
 
 		if pwd_value >= curve.p:
 			continue
-		x = Integer(pwd_value)
+		x = pwd_value
 
-		y_sqr = (x**3 - x * 3 + curve.b) % curve.p
-		if legendre_symbol(y_sqr, curve.p) != 1:
+		y_sqr = curve.y_squared(x)
+		if curve.legendre(y_sqr) != 1:
 			continue
 
-		y = y_sqr.sqrt(curve.p)
+		y = curve.sqrt(y_sqr)
 		y_bit = getord(pwd_seed[-1]) & 1
+		if not info is None: info["counter"] = counter
+		metrics.observe("dragonfly.pwe.iterations", counter)
 		if y & 1 == y_bit:
-			return ECC.EccPoint(x, y, curve_name)
+			return ECC.EccPoint(x, y, curve.name)
 		else:
-			return ECC.EccPoint(x, curve.p - y, curve_name)
-
-
-# TODO: Use this somewhere???
-def calc_k_kck_pmk(pwe, peer_element, peer_scalar, my_rand, my_scalar):
-	k = ((pwe * peer_scalar + peer_element) * my_rand).x
+			return ECC.EccPoint(x, curve.p - y, curve.name)
+
+
+# ----------------------- WPA3 Hash-to-Element ---------------------------------
+
+# Status codes used in SAE authentication frames
+SAE_STATUS_SUCCESS = 0
+SAE_STATUS_ANTI_CLOGGING_TOKEN_REQUIRED = 76
+SAE_STATUS_UNSUPPORTED_GROUP = 77
+SAE_STATUS_HASH_TO_ELEMENT = 126
+
+# Element IDs of the (extension) elements that can be appended to an H2E commit
+WLAN_EID_EXTENSION = 255
+WLAN_EID_EXT_PASSWORD_IDENTIFIER = 33
+WLAN_EID_EXT_ANTI_CLOGGING_TOKEN = 93
+
+# Non-square z parameter of the Simplified SWU mapping for each NIST curve
+sswu_z = {"p256": -10, "p384": -12, "p521": -4}
+
+def hash_for_prime_len(num_bytes):
+	"""Hash function that H2E uses for a group with a prime of the given length"""
+	if num_bytes <= 32: return SHA256
+	if num_bytes <= 48: return SHA384
+	return SHA512
+
+def sae_hash(curve_name="p256", h2e=False):
+	"""Hash of the key derivation and confirm: H2E depends on the group, otherwise it's SHA-256"""
+	return hash_for_prime_len(get_curve(curve_name).prime_len) if h2e else SHA256
+
+def HKDF_Extract(salt, ikm, hashmod=SHA256):
+	return HMAC.new(salt, ikm, digestmod=hashmod).digest()
+
+def HKDF_Expand(prk, info, length, hashmod=SHA256):
+	result, block = b"", b""
+	for i in range(1, (length + hashmod.digest_size - 1) // hashmod.digest_size + 1):
+		block = HMAC.new(prk, block + str2bytes(info) + struct.pack("B", i), digestmod=hashmod).digest()
+		result += block
+	return result[:length]
+
+def sswu(u, curve_name="p256"):
+	"""Simplified Shallue-van de Woestijne-Ulas mapping of a field element to a curve point"""
+	curve = get_curve(curve_name)
+	p, b = curve.p, curve.b
+	a = p - 3
+	z = sswu_z[curve.name] % p
+
+	m = (z * z * pow(u, 4, p) + z * u * u) % p
+	if m == 0:
+		x1 = b * pow(z * a, p - 2, p) % p
+	else:
+		t = pow(m, p - 2, p)
+		x1 = (p - b) * pow(a, p - 2, p) * (1 + t) % p
+	gx1 = (x1**3 + a * x1 + b) % p
+	x2 = z * u * u * x1 % p
+	gx2 = (x2**3 + a * x2 + b) % p
+
+	if curve.legendre(gx1) == 1:
+		x, v = x1, gx1
+	else:
+		x, v = x2, gx2
+
+	y = curve.sqrt(v)
+	if u & 1 != y & 1:
+		y = p - y
+	return ECC.EccPoint(x, y, curve.name)
+
+@functools.lru_cache(maxsize=128)
+def derive_pt_h2e(ssid, password, identifier=None, curve_name="p256"):
+	"""
+	Derive the password token PT of hash-to-element. It only depends on the SSID, password,
+	and password identifier, so the result is cached and reused by all handshakes.
+	"""
+	curve = get_curve(curve_name)
+	prime_len = curve.prime_len
+	hashmod = hash_for_prime_len(prime_len)
+
+	ikm = str2bytes(password)
+	if identifier is not None:
+		ikm += str2bytes(identifier)
+	pwd_seed = HKDF_Extract(str2bytes(ssid), ikm, hashmod)
+	log(DEBUG, "H2E PWD-seed: %s" % pwd_seed)
+
+	# len = olen(p) + ceil(olen(p)/2)
+	length = prime_len + (prime_len + 1) // 2
+	pwd_value1 = HKDF_Expand(pwd_seed, "SAE Hash to Element u1 P1", length, hashmod)
+	pwd_value2 = HKDF_Expand(pwd_seed, "SAE Hash to Element u2 P2", length, hashmod)
+	p1 = sswu(curve.data_to_int(pwd_value1) % curve.p, curve)
+	p2 = sswu(curve.data_to_int(pwd_value2) % curve.p, curve)
+	return p1 + p2
+
+def derive_pwe_h2e(pt, addr1, addr2, curve_name="p256"):
+	"""Derive the PWE of a specific handshake from the (cached) password token PT"""
+	curve = get_curve(curve_name)
+	hashmod = hash_for_prime_len(curve.prime_len)
+
+	addr1 = addr2bin(addr1)
+	addr2 = addr2bin(addr2)
+	macs = addr1 + addr2 if addr1 > addr2 else addr2 + addr1
+
+	# val = H(0^n, MAX(addr1, addr2) || MIN(addr1, addr2)) modulo (q - 1) + 1
+	val = HKDF_Extract(b"\x00" * hashmod.digest_size, macs, hashmod)
+	val = curve.data_to_int(val) % (curve.r - 1) + 1
+	return pt * val
+
+
+class PweCache():
+	"""Least-recently-used cache of derived PWEs, each stored together with its fixed-base table"""
+	def __init__(self, maxsize=64, window=4):
+		self.maxsize = maxsize
+		self.window = window
+		self.entries = collections.OrderedDict()
+
+	def get(self, password, addr1, addr2, curve_name="p256", ssid=None, identifier=None):
+		"""Return the PWE and its table (None when the window is zero). With an SSID H2E is used."""
+		curve = get_curve(curve_name)
+		addrs = tuple(sorted([addr1.lower(), addr2.lower()]))
+		key = (password, addrs, curve.group, ssid, identifier)
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+		if ssid is not None:
+			pwe = derive_pwe_h2e(derive_pt_h2e(ssid, password, identifier, curve.name), addr1, addr2, curve)
+		else:
+			pwe = derive_pwe_ecc(password, addr1, addr2, curve)
+		table = FixedBaseTable(pwe, curve, self.window) if self.window else None
+
+		self.entries[key] = (pwe, table)
+		if len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+		return pwe, table
+
+
+@metrics.timed("dragonfly.calc_k_kck_pmk")
+def calc_k_kck_pmk(pwe, peer_element, peer_scalar, my_rand, my_scalar, curve_name="p256", pwe_table=None,
+                   hashmod=SHA256):
+	"""The KCK is as long as the output of hashmod, which is given by sae_hash()"""
+	curve = get_curve(curve_name)
+	if pwe_table is None:
+		k = ((pwe * peer_scalar + peer_element) * my_rand).x
+	else:
+		# k = rand * (peer_scalar * PWE + peer_element) = (rand * peer_scalar) * PWE + rand * peer_element
+		k = multi_scalar_mult(pwe, my_rand * peer_scalar, peer_element, my_rand, curve, pwe_table).x
 
-	keyseed = HMAC256(b"\x00" * 32, int_to_data(k))
+	# keyseed = H(<0>32, k) where the length of the salt is that of the hash output
+	hash_len = hashmod.digest_size
+	if hashmod is SHA256:
+		keyseed = zero_key_prf(curve.int_to_data(k))
+	else:
+		keyseed = hmac_hash(b"\x00" * hash_len, curve.int_to_data(k), hashmod)
 	kck_and_pmk = KDF_Length(keyseed, "SAE KCK and PMK",
-	                         int_to_data((my_scalar + peer_scalar) % secp256r1_r), 512)
-	kck = kck_and_pmk[0:32]
-	pmk = kck_and_pmk[32:]
+	                         curve.scalar_to_data((my_scalar + peer_scalar) % curve.r), hash_len * 8 + 256, hashmod)
+	kck = kck_and_pmk[:hash_len]
+	pmk = kck_and_pmk[hash_len:]
 
 	return k, kck, pmk
 
 
-def calculate_confirm_hash(kck, send_confirm, scalar, element, peer_scalar, peer_element):
-	return HMAC256(kck, struct.pack("<H", send_confirm) + int_to_data(scalar) + point_to_data(element)
-	                    + int_to_data(peer_scalar) + point_to_data(peer_element))
+def sae_commit_values(pwe, curve_name="p256", pwe_table=None):
+	"""Generate rand together with the commit scalar and element"""
+	curve = get_curve(curve_name)
 
-def build_sae_commit(srcaddr, dstaddr, scalar, element, token=""):
-	p = Dot11(addr1=dstaddr, addr2=srcaddr, addr3=dstaddr)
-	p = p/Dot11Auth(algo=3, seqnum=1, status=0)
+	# After generation of the PWE, each STA shall generate a secret value, rand, and a temporary secret value,
+	# mask, each of which shall be chosen randomly such that 1 < rand < r and 1 < mask < r and (rand + mask)
+	# mod r is greater than 1, where r is the (prime) order of the group.
+	scalar = 0
+	while scalar <= 1:
+		rand = random.randint(2, curve.r - 1)
+		mask = random.randint(2, curve.r - 1)
 
-	group_id = 19
-	scalar_blob = ("%064x" % scalar).decode("hex")
-	element_blob = ("%064x" % element.x).decode("hex") + ("%064x" % element.y).decode("hex")
+		# commit-scalar = (rand + mask) mod r
+		scalar = (rand + mask) % curve.r
+
+	# COMMIT-ELEMENT = inverse(mask * PWE)
+	temp = pwe * mask if pwe_table is None else pwe_table.multiply(mask)
+	element = ECC.EccPoint(temp.x, curve.p - int(temp.y), curve.name)
+
+	return rand, scalar, element
+
+def parse_sae_elements(data):
+	"""Parse the extension elements after an H2E commit into a dictionary indexed by extension ID"""
+	elements = dict()
+	while len(data) >= 3 and data[0] == WLAN_EID_EXTENSION:
+		length = data[1]
+		elements[data[2]] = data[3:2 + length]
+		data = data[2 + length:]
+	return elements
+
+def parse_sae_commit(payload, status=SAE_STATUS_SUCCESS):
+	"""
+	Parse the body of an SAE commit into (group_id, token, scalar, element_x, element_y, identifier).
+	Requests for an anti-clogging token only contain the group and the token. Without H2E, the token
+	is everything between the group and the scalar, meaning trailing elements are not supported.
+	"""
+	payload = bytes(payload)
+	h2e = status == SAE_STATUS_HASH_TO_ELEMENT
+	group_id = struct.unpack("<H", payload[:2])[0]
+
+	if status == SAE_STATUS_ANTI_CLOGGING_TOKEN_REQUIRED:
+		token = payload[2:]
+		elements = parse_sae_elements(token)
+		if WLAN_EID_EXT_ANTI_CLOGGING_TOKEN in elements:
+			token = elements[WLAN_EID_EXT_ANTI_CLOGGING_TOKEN]
+		return group_id, token, None, None, None, None
+
+	curve = get_curve(group_id)
+	fields_len = curve.order_len + 2 * curve.prime_len
+	if h2e:
+		pos, token = 2, b""
+	else:
+		pos = len(payload) - fields_len
+		token = payload[2:pos]
+	if pos < 2 or len(payload) < pos + fields_len:
+		raise ValueError("SAE commit is too short")
+
+	scalar = curve.data_to_int(payload[pos:pos + curve.order_len])
+	pos += curve.order_len
+	x = curve.data_to_int(payload[pos:pos + curve.prime_len])
+	y = curve.data_to_int(payload[pos + curve.prime_len:pos + 2 * curve.prime_len])
+	pos += 2 * curve.prime_len
+
+	identifier = None
+	if h2e:
+		elements = parse_sae_elements(payload[pos:])
+		token = elements.get(WLAN_EID_EXT_ANTI_CLOGGING_TOKEN, b"")
+		identifier = elements.get(WLAN_EID_EXT_PASSWORD_IDENTIFIER)
+
+	return group_id, token, scalar, x, y, identifier
+
+def parse_sae_confirm(payload, confirm_len=32):
+	"""Parse the body of an SAE confirm into (send_confirm, confirm). The length depends on sae_hash()."""
+	payload = bytes(payload)
+	return struct.unpack("<H", payload[:2])[0], payload[2:2 + confirm_len]
+
+SaeCommitCheck = collections.namedtuple("SaeCommitCheck", ["index", "srcaddr", "dstaddr", "status", "group_id",
+                                                            "token", "scalar", "x", "y", "problems"])
+
+def _parse_auth_frame(frame, fcs=False):
+	"""
+	Returns (addr1, addr2, algo, seqnum, status, body) of a raw Dot11 authentication frame, or None
+	if it is another type of frame. The HT control field and, if fcs is True, the FCS are skipped.
+	"""
+	frame = bytes(frame)
+	if len(frame) < 2 or frame[0] & 0xFC != 0xB0:
+		return None
+	if fcs:
+		frame = frame[:-4]
+	# Management frames with the Order flag set contain an HT control field
+	hdrlen = 28 if frame[1] & 0x80 else 24
+	if len(frame) < hdrlen + 6:
+		raise ValueError("Authentication frame is too short")
+	algo, seqnum, status = struct.unpack("<HHH", frame[hdrlen:hdrlen + 6])
+	return bin2addr(frame[4:10]), bin2addr(frame[10:16]), algo, seqnum, status, frame[hdrlen + 6:]
+
+def validate_sae_commits(frames, fcs=False):
+	"""
+	Parse and validate a batch of captured SAE commits. Frames are raw Dot11 bytes without RadioTap
+	header, which end with an FCS if fcs is True, or Dot11 packets. Other frames than authentication
+	frames are skipped. Returns a SaeCommitCheck for each commit, where problems is a set that
+	contains zero or more of the following:
+	- malformed: the commit could not be parsed or uses an unsupported group
+	- token-request: an AP asking for an anti-clogging token, which is not validated further
+	- scalar-range: the scalar does not satisfy 1 < scalar < r
+	- not-on-curve: the element does not satisfy y^2 = x^3 - 3x + b mod p
+	- retransmitted: the sender already sent this scalar and element to the same receiver
+	- duplicate: a different sender already used this scalar and element
+	- reflected: the receiver of this commit earlier sent the same scalar and element to the sender
+	"""
+	results = []
+	seen = dict()
+	for index, frame in enumerate(frames):
+		frame_fcs = fcs
+		if not isinstance(frame, (bytes, bytearray, memoryview)):
+			frame_fcs = Dot11FCS in frame
+			frame = raw(frame[Dot11])
+		problems = set()
+		group_id = token = scalar = x = y = None
+
+		try:
+			auth = _parse_auth_frame(frame, frame_fcs)
+		except ValueError:
+			results.append(SaeCommitCheck(index, None, None, None, None, None, None, None, None, {"malformed"}))
+			continue
+		if auth is None:
+			continue
+		addr1, addr2, algo, seqnum, status, body = auth
+		if algo != 3 or seqnum != 1:
+			continue
 
-	return p/Raw(struct.pack("<H", group_id) + token + scalar_blob + element_blob)
+		try:
+			group_id, token, scalar, x, y, _ = parse_sae_commit(body, status)
+		except (ValueError, struct.error):
+			problems.add("malformed")
+
+		if status == SAE_STATUS_ANTI_CLOGGING_TOKEN_REQUIRED:
+			problems.add("token-request")
+		elif not problems:
+			curve = get_curve(group_id)
+			if not 1 < scalar < curve.r:
+				problems.add("scalar-range")
+			if not (x < curve.p and y < curve.p and y * y % curve.p == curve.y_squared(x)):
+				problems.add("not-on-curve")
+
+			key = (group_id, scalar, x, y)
+			previous = seen.get(key)
+			if previous is None:
+				seen[key] = (addr2, addr1)
+			elif previous == (addr2, addr1):
+				problems.add("retransmitted")
+			elif previous == (addr1, addr2):
+				problems.add("reflected")
+			else:
+				problems.add("duplicate")
+
+		results.append(SaeCommitCheck(index, addr2, addr1, status, group_id, token, scalar, x, y, problems))
+
+	return results
+
+def calculate_confirm_hash(kck, send_confirm, scalar, element, peer_scalar, peer_element, curve_name="p256",
+                           hashmod=SHA256):
+	curve = get_curve(curve_name)
+	return hmac_hash(kck, struct.pack("<H", send_confirm) + curve.scalar_to_data(scalar) + curve.point_to_data(element)
+	                      + curve.scalar_to_data(peer_scalar) + curve.point_to_data(peer_element), hashmod)
+
+def build_sae_commit(srcaddr, dstaddr, scalar, element, token=b"", status=0, identifier=None, group_id=19):
+	p = Dot11(addr1=dstaddr, addr2=srcaddr, addr3=dstaddr)
+	p = p/Dot11Auth(algo=3, seqnum=1, status=status)
+	h2e = status == SAE_STATUS_HASH_TO_ELEMENT
+	curve = get_curve(group_id)
+
+	payload = struct.pack("<H", group_id)
+	if token and not h2e:
+		payload += token
+	payload += curve.scalar_to_data(scalar) + curve.point_to_data(element)
+
+	# With H2E the identifier and token are encoded as extension elements after the element. The
+	# identifier is only sent with H2E, since other commits can't contain trailing elements.
+	if identifier is not None and h2e:
+		identifier = str2bytes(identifier)
+		payload += struct.pack("BBB", WLAN_EID_EXTENSION, 1 + len(identifier), WLAN_EID_EXT_PASSWORD_IDENTIFIER) + identifier
+	if token and h2e:
+		payload += struct.pack("BBB", WLAN_EID_EXTENSION, 1 + len(token), WLAN_EID_EXT_ANTI_CLOGGING_TOKEN) + token
+
+	return p/Raw(payload)
 	
 
 def build_sae_confirm(srcaddr, dstaddr, send_confirm, confirm):
@@ -156,80 +717,113 @@ def build_sae_confirm(srcaddr, dstaddr, send_confirm, confirm):
 	return p/Raw(struct.pack("<H", send_confirm) + confirm)	
 
 
+def sae_commit_template(srcaddr, dstaddr, token=b"", status=0, identifier=None, group_id=19):
+	"""Returns a FrameTemplate of an SAE commit with scalar and element fields"""
+	curve = get_curve(group_id)
+	template = FrameTemplate(build_sae_commit(srcaddr, dstaddr, 0, None, token, status, identifier, group_id))
+
+	# Offset of the scalar: 802.11 header, authentication header, and the group id
+	offset = 24 + 6 + 2
+	if token and status != SAE_STATUS_HASH_TO_ELEMENT:
+		offset += len(token)
+	template.add_field("scalar", offset, curve.order_len, curve.scalar_to_data)
+	template.add_field("element", offset + curve.order_len, 2 * curve.prime_len, curve.point_to_data)
+	return template
+
+def sae_confirm_template(srcaddr, dstaddr, confirm_len=32):
+	"""Returns a FrameTemplate of an SAE confirm with send_confirm and confirm fields"""
+	template = FrameTemplate(build_sae_confirm(srcaddr, dstaddr, 0, b"\x00" * confirm_len))
+	template.add_field("send_confirm", 24 + 6, 2)
+	template.add_field("confirm", 24 + 6 + 2, confirm_len)
+	return template
+
+
 class SAEHandshake():
-	def __init__(self, password, srcaddr, dstaddr):
+	def __init__(self, password, srcaddr, dstaddr, ssid=None, identifier=None, group_id=19, pwe_cache=None):
 		self.password = password
 		self.srcaddr = srcaddr
 		self.dstaddr = dstaddr
+		self.curve = get_curve(group_id)
+		self.pwe_cache = pwe_cache
+		self.pwe_table = None
+
+		# When the SSID is given the PWE is derived using hash-to-element
+		self.ssid = ssid
+		self.identifier = identifier
+		self.hashmod = sae_hash(self.curve, ssid is not None)
 
+		self.token = b""
 		self.pwe = None
 		self.rand = None
 		self.scalar = None
 		self.element = None
 		self.kck = None
+		self.kck_prf = None
 		self.pmk = None
 
 	def send_commit(self, password):
-		self.pwe = derive_pwe_ecc(password, self.dstaddr, self.srcaddr)
-
-		# After generation of the PWE, each STA shall generate a secret value, rand, and a temporary secret value,
-		# mask, each of which shall be chosen randomly such that 1 < rand < r and 1 < mask < r and (rand + mask)
-		# mod r is greater than 1, where r is the (prime) order of the group.
-		self.rand = random.randint(0, secp256r1_r - 1)
-		mask = random.randint(0, secp256r1_r - 1)
-
-		# commit-scalar = (rand + mask) mod r
-		self.scalar = (self.rand + mask) % secp256r1_r
-		assert self.scalar > 1
+		if self.pwe_cache is not None:
+			self.pwe, self.pwe_table = self.pwe_cache.get(password, self.dstaddr, self.srcaddr, self.curve,
+			                                              self.ssid, self.identifier)
+		elif self.ssid is not None:
+			pt = derive_pt_h2e(self.ssid, password, self.identifier, self.curve.name)
+			self.pwe = derive_pwe_h2e(pt, self.dstaddr, self.srcaddr, self.curve)
+		else:
+			self.pwe = derive_pwe_ecc(password, self.dstaddr, self.srcaddr, self.curve)
 
-		# COMMIT-ELEMENT = inverse(mask * PWE)
-		temp = self.pwe * mask
-		self.element = ECC.EccPoint(temp.x, Integer(secp256r1_p) - temp.y)
+		self.rand, self.scalar, self.element = sae_commit_values(self.pwe, self.curve, self.pwe_table)
+		self._send_commit_frame()
 
-		auth = build_sae_commit(self.srcaddr, self.dstaddr, self.scalar, self.element)
+	def _send_commit_frame(self):
+		status = SAE_STATUS_HASH_TO_ELEMENT if self.ssid is not None else 0
+		auth = build_sae_commit(self.srcaddr, self.dstaddr, self.scalar, self.element, self.token, status,
+		                        identifier=self.identifier if self.ssid is not None else None,
+		                        group_id=self.curve.group)
 		sendp(RadioTap()/auth)
 
 	def process_commit(self, p):
-		payload = str(p[Dot11Auth].payload)
-
-		group_id = struct.unpack("<H", payload[:2])[0]
-		pos = 2
-
-		self.peer_scalar = int(payload[pos:pos+32].encode("hex"), 16)
-		pos += 32
-
-		peer_element_x = int(payload[pos:pos+32].encode("hex"), 16)
-		peer_element_y = int(payload[pos+32:pos+64].encode("hex"), 16)
-		self.peer_element = ECC.EccPoint(peer_element_x, peer_element_y)
-		pos += 64
-
-		k = ((self.pwe * self.peer_scalar + self.peer_element) * self.rand).x
-
-		keyseed = HMAC256("\x00"*32, int_to_data(k))
-		kck_and_pmk = KDF_Length(keyseed, "SAE KCK and PMK",
-		                         int_to_data((self.scalar + self.peer_scalar) % secp256r1_r), 512)
-		self.kck = kck_and_pmk[0:32]
-		self.pmk = kck_and_pmk[32:]
+		status = p[Dot11Auth].status
+		group_id, token, scalar, x, y, identifier = parse_sae_commit(raw(p[Dot11Auth].payload), status)
+
+		# Retransmit our commit with the token that the peer requested
+		if status == SAE_STATUS_ANTI_CLOGGING_TOKEN_REQUIRED:
+			log(DEBUG, "Peer requested anti-clogging token")
+			self.token = token
+			self._send_commit_frame()
+			return
+		elif status != (SAE_STATUS_HASH_TO_ELEMENT if self.ssid is not None else 0):
+			raise ValueError("SAE commit has unexpected status %d" % status)
+		elif group_id != self.curve.group:
+			raise ValueError("SAE commit uses group %d instead of %d" % (group_id, self.curve.group))
+		elif not 1 < scalar < self.curve.r:
+			raise ValueError("Invalid SAE commit scalar")
+		self.peer_scalar = scalar
+
+		# This raises a ValueError if the element is not on the curve
+		self.peer_element = ECC.EccPoint(x, y, self.curve.name)
+
+		k, self.kck, self.pmk = calc_k_kck_pmk(self.pwe, self.peer_element, self.peer_scalar, self.rand,
+		                                       self.scalar, self.curve, self.pwe_table, self.hashmod)
+		# Both the sent and received confirm are computed with the KCK
+		self.kck_prf = HmacPrf(self.kck) if self.hashmod is SHA256 else self.kck
 
 		self.send_confirm()
 
 	def send_confirm(self):
 		send_confirm = 0
-		confirm = calculate_confirm_hash(self.kck, send_confirm, self.scalar, self.element, self.peer_scalar, self.peer_element)
+		confirm = calculate_confirm_hash(self.kck_prf, send_confirm, self.scalar, self.element, self.peer_scalar,
+		                                 self.peer_element, self.curve, self.hashmod)
 
 		auth = build_sae_confirm(self.srcaddr, self.dstaddr, send_confirm, confirm)
 		sendp(RadioTap()/auth)
 
 	def process_confirm(self, p):
-		payload = str(p[Dot11Auth].payload)
+		"""Returns True if the confirm of the peer is valid"""
+		send_confirm, received_confirm = parse_sae_confirm(raw(p[Dot11Auth].payload), self.hashmod.digest_size)
 
-		send_confirm = struct.unpack("<H", payload[:2])[0]
-		pos = 2
-
-		received_confirm = payload[pos:pos+32]
-		pos += 32
-
-		expected_confirm = calculate_confirm_hash(self.kck, send_confirm, self.peer_scalar, self.peer_element, self.scalar, self.element)
+		expected_confirm = calculate_confirm_hash(self.kck_prf, send_confirm, self.peer_scalar, self.peer_element,
+		                                          self.scalar, self.element, self.curve, self.hashmod)
+		return received_confirm == expected_confirm
 
 
 # ----------------------- EAP-pwd (TODO Test with Python3) ---------------------------------
@@ -239,11 +833,12 @@ def KDF_Length_eappwd(data, label, length):
 	iterations = (num_bytes + 31) // 32
 
 	# TODO: EAP-pwd uses a different byte ordering for the counter and length?!? WTF!
-	result = b""
+	# Each block is chained to the digest of the previous block
+	prf = HmacPrf(data) if iterations > 1 and not isinstance(data, HmacPrf) else data
+	suffix = str2bytes(label) + struct.pack(">H", length)
+	result, digest = b"", b""
 	for i in range(1, iterations + 1):
-		hash_data  = digest if i > 1 else b""
-		hash_data += struct.pack(">H", i) + str2bytes(label) + struct.pack(">H", length)
-		digest = HMAC256(data, hash_data)
+		digest = HMAC256(prf, digest + struct.pack(">H", i) + suffix)
 		result += digest
 
 	result = result[:num_bytes]
@@ -255,80 +850,67 @@ def KDF_Length_eappwd(data, label, length):
 
 
 def derive_pwe_ecc_eappwd(password, peer_id, server_id, token, curve_name="p256", info=None):
-	curve = ECC._curves[curve_name]
-	bits = curve.modulus_bits
+	curve = get_curve(curve_name)
+	bits = curve.bits
 
 	hash_pw = struct.pack(">I", token) + str2bytes(peer_id + server_id + password)
 	for counter in range(1, 100):
 		hash_data = hash_pw + struct.pack("<B", counter)
-		pwd_seed = HMAC256(b"\x00", hash_data)
+		pwd_seed = zero_key_prf(hash_data)
 		log(DEBUG, "PWD-Seed: %s" % pwd_seed)
 		pwd_value = KDF_Length_eappwd(pwd_seed, "EAP-pwd Hunting And Pecking", bits)
 		log(DEBUG, "PWD-Value: %s" % pwd_value)
-		pwd_value = int(binascii.hexlify(pwd_value), 16)
+		pwd_value = curve.data_to_int(pwd_value)
 
 		if bits % 8 != 0:
-			pwd_value = pwd_value >> (8 - (521 % 8))
+			pwd_value = pwd_value >> (8 - (bits % 8))
 
 		if pwd_value >= curve.p:
 			continue
-		x = Integer(pwd_value)
+		x = pwd_value
 
 		log(DEBUG, "X-candidate: %x" % x)
-		y_sqr = (x**3 - x * 3 + curve.b) % curve.p
-		if legendre_symbol(y_sqr, curve.p) != 1:
+		y_sqr = curve.y_squared(x)
+		if curve.legendre(y_sqr) != 1:
 			continue
 
-		y = y_sqr.sqrt(curve.p)
+		y = curve.sqrt(y_sqr)
 		y_bit = getord(pwd_seed[-1]) & 1
 		if y & 1 == y_bit:
 			if not info is None: info["counter"] = counter
-			return ECC.EccPoint(x, y, curve_name)
+			return ECC.EccPoint(x, y, curve.name)
 		else:
 			if not info is None: info["counter"] = counter
-			return ECC.EccPoint(x, curve.p - y, curve_name)
+			return ECC.EccPoint(x, curve.p - y, curve.name)
 
 
 def calculate_confirm_eappwd(k, element1, scalar1, element2, scalar2, group_num=19, rand_func=1, prf=1):
-	hash_data  = int_to_data(k)
-	hash_data += point_to_data(element1)
-	hash_data += int_to_data(scalar1)
-	hash_data += point_to_data(element2)
-	hash_data += int_to_data(scalar2)
+	curve = get_curve(group_num)
+	hash_data  = curve.int_to_data(k)
+	hash_data += curve.point_to_data(element1)
+	hash_data += curve.scalar_to_data(scalar1)
+	hash_data += curve.point_to_data(element2)
+	hash_data += curve.scalar_to_data(scalar2)
 	hash_data += struct.pack(">HBB", group_num, rand_func, prf)
-	confirm = HMAC256(b"\x00" * 32, hash_data)
+	confirm = zero_key_prf(hash_data)
 	return confirm
 
 # ----------------------- Fuzzing/Testing ---------------------------------
 
-def inject_sae_auth(srcaddr, bssid):
-	p = Dot11(addr1=bssid, addr2=srcaddr, addr3=bssid)
-	p = p/Dot11Auth(algo=3, seqnum=1, status=0)
-
-	group_id = 19
-	scalar = 0
-	element_x = 0
-	element_y = 0
-	p = p/Raw(struct.pack("<H", group_id))
-
-	if False:
-		# Convert to octets
-		commit_scalar = ("%064x" % scalar).decode("hex")
-		commit_element = ("%064x" % element_x).decode("hex") + ("%064x" % element_y).decode("hex")
-		p = p / Raw(commit_scalar + commit_element)
-	else:
-		p = p / Raw(open("/dev/urandom").read(32*3))
-	sendp(RadioTap()/p)
+def inject_sae_auth(srcaddr, bssid, count=1):
+	"""Inject SAE commits with random scalar and element bytes"""
+	template = sae_commit_template(srcaddr, bssid)
+	sock = conf.L2socket(iface=conf.iface)
+	for i in range(count):
+		sock.send(template.build(scalar=os.urandom(32), element=os.urandom(64), sc=(i & 0xFFF) << 4))
+	sock.close()
 
 def forge_sae_confirm(bssid, stamac):
-	kck = "\x00" * 32
-	send_confirm = "\x00\x00"
+	kck = b"\x00" * 32
+	send_confirm = b"\x00\x00"
 	confirm = HMAC256(kck, send_confirm + int_to_data(0) + zeropoint_to_data()
 	                       + int_to_data(0) + zeropoint_to_data())
 
-	auth = Dot11(addr1=bssid, addr2=stamac, addr3=bssid)
-	auth = auth/Dot11Auth(algo=3, seqnum=2, status=0)
-	auth = auth/Raw(struct.pack("<H", 0) + confirm)
-
-	sendp(RadioTap()/auth)
-
+	sock = conf.L2socket(iface=conf.iface)
+	sock.send(sae_confirm_template(stamac, bssid).build(confirm=confirm))
+	sock.close()
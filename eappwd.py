@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# Streaming analyzer that follows EAP-pwd exchanges in captured or live traffic. When the password
+# is known it derives the PWE, and when the private value of one side is also known it derives k
+# and verifies both confirms.
+from .dragonfly import *
+import collections
+
+EAP_CODE_REQUEST, EAP_CODE_RESPONSE, EAP_CODE_SUCCESS, EAP_CODE_FAILURE = range(1, 5)
+EAP_TYPE_PWD = 52
+
+EAP_PWD_EXCH_ID, EAP_PWD_EXCH_COMMIT, EAP_PWD_EXCH_CONFIRM = range(1, 4)
+EAP_PWD_FLAG_L = 0x80
+EAP_PWD_FLAG_M = 0x40
+
+# Password and (optional) private values of the server or peer that are known to the analyzer
+EapPwdCredentials = collections.namedtuple("EapPwdCredentials", ["password", "server_private", "peer_private"])
+EapPwdCredentials.__new__.__defaults__ = (None, None)
+
+class EapPwdSession():
+	"""State of one EAP-pwd exchange between a supplicant and authenticator"""
+	__slots__ = ["supplicant", "authenticator", "group", "rand_func", "prf", "token", "server_id", "peer_id",
+	             "server_element", "server_scalar", "peer_element", "peer_scalar", "server_confirm",
+	             "peer_confirm", "pwe", "counter", "k", "server_confirm_ok", "peer_confirm_ok", "result",
+	             "problems", "fragments", "last_seen"]
+
+	def __init__(self, supplicant, authenticator):
+		self.supplicant = supplicant
+		self.authenticator = authenticator
+		self.group = self.rand_func = self.prf = self.token = None
+		self.server_id = self.peer_id = None
+		self.server_element = self.server_scalar = None
+		self.peer_element = self.peer_scalar = None
+		self.server_confirm = self.peer_confirm = None
+		self.pwe = self.counter = self.k = None
+		self.server_confirm_ok = self.peer_confirm_ok = None
+		self.result = None
+		self.problems = set()
+		# Reassembly buffer of each direction, indexed by the EAP code
+		self.fragments = dict()
+		self.last_seen = 0
+
+	def __repr__(self):
+		return "EapPwdSession(%s, %s, peer_id=%s, result=%s)" % (self.supplicant, self.authenticator,
+			self.peer_id, self.result)
+
+class EapPwdAnalyzer():
+	"""
+	Follows EAP-pwd exchanges per (supplicant, authenticator) pair. At most max_sessions sessions are
+	tracked, and reassembled messages are limited to max_message_len bytes, so memory stays bounded.
+	Finished sessions are passed to the callback and then forgotten.
+	"""
+	def __init__(self, credentials=None, max_sessions=1024, max_message_len=4096, callback=None):
+		# Maps peer identities (bytes) to passwords or EapPwdCredentials
+		self.credentials = credentials or dict()
+		self.max_sessions = max_sessions
+		self.max_message_len = max_message_len
+		self.callback = callback
+		self.sessions = collections.OrderedDict()
+
+	#### Input ####
+
+	def process(self, p):
+		"""Process a single packet. Packets that don't contain EAP-pwd are ignored."""
+		if not EAPOL in p or p[EAPOL].type != 0:
+			return
+		src, dst = get_eapol_addresses(p)
+		data = raw(p[EAPOL].payload)
+		if len(data) < 4:
+			return
+
+		code, ident, length = struct.unpack(">BBH", data[:4])
+		if code == EAP_CODE_REQUEST:
+			key = (dst, src)
+		elif code in [EAP_CODE_RESPONSE, EAP_CODE_SUCCESS, EAP_CODE_FAILURE]:
+			key = (src, dst) if code == EAP_CODE_RESPONSE else (dst, src)
+		else:
+			return
+
+		if code in [EAP_CODE_SUCCESS, EAP_CODE_FAILURE]:
+			if key in self.sessions:
+				self.sessions[key].result = "success" if code == EAP_CODE_SUCCESS else "failure"
+				self._finish(key)
+			return
+
+		if length < 6 or len(data) < length or data[4] != EAP_TYPE_PWD:
+			return
+		session = self._get_session(key, p)
+		message = self._reassemble(session, code, data[5:length])
+		if message is not None:
+			exch, payload = message
+			try:
+				self._process_message(session, code, exch, payload)
+			except (ValueError, struct.error) as ex:
+				log(DEBUG, "EAP-pwd: malformed message from %s: %s" % (src, ex))
+				session.problems.add("malformed")
+
+	def process_pcap(self, filename):
+		"""Stream all packets of a capture through the analyzer without loading it in memory"""
+		with PcapReader(filename) as reader:
+			for p in reader:
+				self.process(p)
+
+	def monitor(self, sock, timeout=None):
+		"""Analyze live traffic received on a MonitorSocket"""
+		sniff(opened_socket=sock, timeout=timeout, store=False, prn=self.process)
+
+	def flush(self):
+		"""Report all sessions that are still in progress"""
+		for key in list(self.sessions.keys()):
+			self._finish(key)
+
+	#### Sessions ####
+
+	def _get_session(self, key, p):
+		session = self.sessions.get(key)
+		if session is None:
+			session = EapPwdSession(*key)
+			self.sessions[key] = session
+			if len(self.sessions) > self.max_sessions:
+				oldest = next(iter(self.sessions))
+				self.sessions[oldest].problems.add("evicted")
+				self._finish(oldest)
+		else:
+			self.sessions.move_to_end(key)
+		session.last_seen = getattr(p, "time", 0)
+		return session
+
+	def _finish(self, key):
+		session = self.sessions.pop(key)
+		if self.callback is not None:
+			self.callback(session)
+		else:
+			log(STATUS, "EAP-pwd %s: result=%s peer_id=%s server_confirm_ok=%s peer_confirm_ok=%s problems=%s" % (
+				key, session.result, session.peer_id, session.server_confirm_ok, session.peer_confirm_ok,
+				",".join(sorted(session.problems)) or "none"))
+
+	def _reassemble(self, session, code, body):
+		"""Returns (exch, payload) once a complete message was received, otherwise None"""
+		if len(body) < 1:
+			return None
+		flags = body[0]
+		exch = flags & 0x3f
+		pos = 1
+		if flags & EAP_PWD_FLAG_L:
+			total_len = struct.unpack(">H", body[1:3])[0]
+			pos = 3
+			if total_len > self.max_message_len:
+				session.problems.add("oversized")
+				return None
+			session.fragments[code] = [exch, total_len, bytearray()]
+
+		buf = session.fragments.get(code)
+		if buf is None:
+			# Unfragmented message. Empty messages are fragment acknowledgements.
+			if flags & EAP_PWD_FLAG_M:
+				session.problems.add("fragment-without-length")
+				return None
+			return (exch, body[pos:]) if len(body) > pos else None
+
+		buf[2] += body[pos:]
+		if len(buf[2]) > buf[1]:
+			session.problems.add("fragment-overflow")
+			del session.fragments[code]
+			return None
+		if flags & EAP_PWD_FLAG_M:
+			return None
+
+		del session.fragments[code]
+		if len(buf[2]) != buf[1]:
+			session.problems.add("fragment-length-mismatch")
+		return buf[0], bytes(buf[2])
+
+	#### Message processing ####
+
+	def _process_message(self, session, code, exch, payload):
+		from_server = code == EAP_CODE_REQUEST
+		if exch == EAP_PWD_EXCH_ID:
+			group, rand_func, prf, token, prep = struct.unpack(">HBBIB", payload[:9])
+			if from_server:
+				session.group, session.rand_func, session.prf, session.token = group, rand_func, prf, token
+				session.server_id = payload[9:]
+			else:
+				session.peer_id = payload[9:]
+				if session.token is not None and token != session.token:
+					session.problems.add("token-mismatch")
+
+		elif exch == EAP_PWD_EXCH_COMMIT:
+			curve = get_curve(session.group if session.group is not None else 19)
+			element_len = 2 * curve.prime_len
+			if len(payload) != element_len + curve.order_len:
+				raise ValueError("unexpected commit length %d" % len(payload))
+			x = curve.data_to_int(payload[:curve.prime_len])
+			y = curve.data_to_int(payload[curve.prime_len:element_len])
+			scalar = curve.data_to_int(payload[element_len:])
+			if not point_on_curve(x, y, curve):
+				session.problems.add("invalid-element")
+				return
+			if not 1 < scalar < curve.r:
+				session.problems.add("invalid-scalar")
+				return
+
+			element = ECC.EccPoint(x, y, curve.name)
+			if from_server:
+				session.server_element, session.server_scalar = element, scalar
+			else:
+				session.peer_element, session.peer_scalar = element, scalar
+				if (element, scalar) == (session.server_element, session.server_scalar):
+					session.problems.add("reflected-commit")
+			self._derive_keys(session, curve)
+
+		elif exch == EAP_PWD_EXCH_CONFIRM:
+			if from_server:
+				session.server_confirm = payload[:32]
+			else:
+				session.peer_confirm = payload[:32]
+			self._verify_confirms(session)
+
+	def _get_credentials(self, session):
+		credentials = self.credentials.get(session.peer_id)
+		if isinstance(credentials, (str, bytes)):
+			credentials = EapPwdCredentials(credentials)
+		return credentials
+
+	def _derive_keys(self, session, curve):
+		credentials = self._get_credentials(session)
+		if credentials is None or session.token is None:
+			return
+
+		if session.pwe is None:
+			info = dict()
+			session.pwe = derive_pwe_ecc_eappwd(str2bytes(credentials.password), session.peer_id,
+			                                    session.server_id, session.token, curve, info)
+			session.counter = info.get("counter")
+
+		if session.server_scalar is None or session.peer_scalar is None:
+			return
+		if credentials.server_private is not None:
+			k = (session.pwe * session.peer_scalar + session.peer_element) * credentials.server_private
+		elif credentials.peer_private is not None:
+			k = (session.pwe * session.server_scalar + session.server_element) * credentials.peer_private
+		else:
+			return
+		session.k = int(k.x)
+
+	def _verify_confirms(self, session):
+		if session.k is None:
+			return
+		args = (session.group, session.rand_func, session.prf)
+		if session.server_confirm is not None:
+			expected = calculate_confirm_eappwd(session.k, session.server_element, session.server_scalar,
+			                                    session.peer_element, session.peer_scalar, *args)
+			session.server_confirm_ok = session.server_confirm == expected
+		if session.peer_confirm is not None:
+			expected = calculate_confirm_eappwd(session.k, session.peer_element, session.peer_scalar,
+			                                    session.server_element, session.server_scalar, *args)
+			session.peer_confirm_ok = session.peer_confirm == expected
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# Append-only store of per-frame metadata. Every field is kept in a typed array instead of in a
+# Python object per frame, and full chunks can be spilled to memory-mapped files, so the metadata
+# of tens of millions of frames fits in memory and can be analyzed in seconds.
+from .wifi import *
+import array, collections, itertools, mmap, os, tempfile
+
+# Name and array typecode of every column. Addresses are stored as 48-bit integers.
+FRAMESTORE_COLUMNS = [("ts", "d"), ("ta", "Q"), ("ra", "Q"), ("fc", "H"), ("sc", "H"), ("tid", "B"),
+                      ("pn", "Q"), ("rssi", "b"), ("length", "I")]
+# Values of the tid, pn, and rssi columns when the field isn't present in the frame
+NO_TID = 0xFF
+NO_PN = 0xFFFFFFFFFFFFFFFF
+NO_RSSI = -128
+
+FC_RETRY = 0x0800
+
+def addr2int(addr):
+	return int(addr.replace(":", ""), 16)
+
+def int2addr(num):
+	return ":".join("%02x" % b for b in num.to_bytes(6, "big"))
+
+class FrameChunk():
+	"""Columns of at most FrameStore.chunk_size frames, either in arrays or in a memory-mapped file"""
+	__slots__ = ["columns", "mmap", "filename"]
+
+	def __init__(self):
+		self.columns = {name: array.array(code) for name, code in FRAMESTORE_COLUMNS}
+		self.mmap = None
+		self.filename = None
+
+	def __len__(self):
+		return len(self.columns["ts"])
+
+	def spill(self, directory):
+		"""Write the columns to a file and replace them by views on a memory mapping of it"""
+		fd, self.filename = tempfile.mkstemp(prefix="frames-", suffix=".bin", dir=directory)
+		layout = []
+		with os.fdopen(fd, "wb") as fp:
+			pos = 0
+			for name, code in FRAMESTORE_COLUMNS:
+				column = self.columns[name]
+				# Keep every column aligned to its item size
+				padding = -pos % 8
+				fp.write(b"\x00" * padding)
+				pos += padding
+				layout.append((name, code, pos, len(column) * column.itemsize))
+				fp.write(column.tobytes())
+				pos += len(column) * column.itemsize
+
+		with open(self.filename, "rb") as fp:
+			self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+		view = memoryview(self.mmap)
+		self.columns = {name: view[pos:pos + size].cast(code) for name, code, pos, size in layout}
+
+	def close(self):
+		if self.mmap is not None:
+			for column in self.columns.values():
+				column.release()
+			self.mmap.close()
+			os.unlink(self.filename)
+			self.mmap = None
+		self.columns = None
+
+class FrameStore():
+	"""
+	Columnar store of frame metadata: timestamp, transmitter and receiver address, frame control,
+	sequence control, TID, packet number, RSSI, and length. Frames are appended to the current
+	chunk, and when a chunk holds chunk_size frames a new one is started. When spill_dir is given,
+	full chunks are written to a file in that directory and memory-mapped. NumPy is not a
+	dependency, so the queries are Python loops over the columns. They use C-level helpers such as
+	Counter.update and itertools.compress where possible, but still handle every selected row in Python.
+	"""
+	def __init__(self, chunk_size=1 << 20, spill_dir=None):
+		self.chunk_size = chunk_size
+		self.spill_dir = spill_dir
+		self.chunks = [FrameChunk()]
+		self.num_frames = 0
+
+	def __len__(self):
+		return self.num_frames
+
+	def append(self, ts, ta, ra, fc, sc, tid=NO_TID, pn=NO_PN, rssi=NO_RSSI, length=0):
+		"""Add a frame. The ta and ra addresses are 48-bit integers."""
+		chunk = self.chunks[-1]
+		if len(chunk) >= self.chunk_size:
+			if self.spill_dir is not None:
+				chunk.spill(self.spill_dir)
+			chunk = FrameChunk()
+			self.chunks.append(chunk)
+
+		columns = chunk.columns
+		columns["ts"].append(ts)
+		columns["ta"].append(ta)
+		columns["ra"].append(ra)
+		columns["fc"].append(fc)
+		columns["sc"].append(sc)
+		columns["tid"].append(tid)
+		columns["pn"].append(pn)
+		columns["rssi"].append(rssi)
+		columns["length"].append(length)
+		self.num_frames += 1
+
+	def append_raw(self, linktype, data, ts=0):
+		"""Add a frame given as bytes, e.g. a record of MmapPcapReader. Returns False if it's not 802.11."""
+		offset = raw_dot11_offset(linktype, data)
+		if offset is None or len(data) < offset + 10:
+			return False
+
+		fc = data[offset] | (data[offset + 1] << 8)
+		ra = int.from_bytes(data[offset + 4:offset + 10], "big")
+		# Control frames such as ACKs don't have a transmitter address or sequence number
+		ta = int.from_bytes(data[offset + 10:offset + 16], "big") if len(data) >= offset + 16 else 0
+		sc = struct.unpack_from("<H", data, offset + 22)[0] if len(data) >= offset + 24 else 0
+		tid, pn = NO_TID, NO_PN
+		if data[offset] & 0x0C == 0x08 and len(data) >= offset + raw_dot11_hdrlen(data, offset):
+			if data[offset] & 0x80:
+				# The QoS control field follows the (optional) fourth address
+				tid = data[offset + (30 if data[offset + 1] & 3 == 3 else 24)] & 0x0F
+			if data[offset + 1] & 0x40:
+				pn = raw_ccmp_pn(data, offset)
+				pn = NO_PN if pn is None else pn
+
+		rssi = radiotap_antsignal(data) if linktype == DLT_IEEE802_11_RADIO else None
+		rssi = NO_RSSI if rssi is None else rssi
+		self.append(ts, ta, ra, fc, sc, tid, pn, rssi, len(data) - offset)
+		return True
+
+	def append_packet(self, p):
+		"""Add a scapy frame that starts with a RadioTap or Dot11 header"""
+		linktype = DLT_IEEE802_11_RADIO if RadioTap in p else DLT_IEEE802_11
+		return self.append_raw(linktype, raw(p), float(p.time))
+
+	def close(self):
+		"""Release all chunks and remove the files of spilled chunks"""
+		for chunk in self.chunks:
+			chunk.close()
+		self.chunks = [FrameChunk()]
+		self.num_frames = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	#### Queries ####
+
+	def column(self, name):
+		"""Iterate over all values of a column"""
+		for chunk in self.chunks:
+			yield from chunk.columns[name]
+
+	def columns(self, *names):
+		"""Iterate over tuples with the values of the given columns"""
+		for chunk in self.chunks:
+			yield from zip(*[chunk.columns[name] for name in names])
+
+	def group_by_transmitter(self):
+		"""Returns a dict that maps every transmitter address to its (frames, bytes)"""
+		frames, lengths = collections.Counter(), collections.Counter()
+		for chunk in self.chunks:
+			tas = chunk.columns["ta"]
+			frames.update(tas)
+			for ta, length in zip(tas, chunk.columns["length"]):
+				lengths[ta] += length
+		return {ta: (num, lengths[ta]) for ta, num in frames.items()}
+
+	def retransmissions(self):
+		"""Returns a dict that maps transmitter addresses to the number of frames with the Retry flag set"""
+		counts = collections.Counter()
+		for chunk in self.chunks:
+			counts.update(ta for ta, fc in zip(chunk.columns["ta"], chunk.columns["fc"]) if fc & FC_RETRY)
+		return dict(counts)
+
+	def pn_reuse(self, window=4096):
+		"""
+		Find protected frames of a link that reuse the packet number of an earlier frame but are
+		not retransmissions of it. Returns (ta, ra, pn, first_row, row) tuples, where rows are the
+		positions at which the frames were appended. Per link only the last window to 2 * window
+		packet numbers are remembered, so memory use doesn't grow with the number of frames, and
+		older reuse is not detected.
+		"""
+		# Per (ta, ra) link, a current and previous dict that map packet numbers to the row of their
+		# first frame. When the current one is full it replaces the previous one.
+		links = dict()
+		reused = []
+		base = 0
+		for chunk in self.chunks:
+			columns = chunk.columns
+			pns = columns["pn"]
+			rows = zip(itertools.count(base), columns["ta"], columns["ra"], pns, columns["sc"], columns["fc"])
+			# Unprotected frames are skipped by itertools.compress, every protected frame is handled below
+			for row, ta, ra, pn, sc, fc in itertools.compress(rows, map(NO_PN.__ne__, pns)):
+				generations = links.get((ta, ra))
+				if generations is None:
+					generations = links[(ta, ra)] = [dict(), dict()]
+				current = generations[0]
+				first = current.get(pn)
+				if first is None:
+					first = generations[1].get(pn)
+					if first is None:
+						current[pn] = row
+						if len(current) >= window:
+							generations[0], generations[1] = dict(), current
+						continue
+				# A retransmission has the Retry flag set and the same sequence control
+				if not (fc & FC_RETRY and self._get(first, "sc") == sc):
+					reused.append((ta, ra, pn, first, row))
+			base += len(pns)
+		return reused
+
+	def _get(self, row, name):
+		# All chunks except the last one are full
+		index, pos = divmod(row, self.chunk_size)
+		return self.chunks[index].columns[name][pos]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# Follow 4-way handshakes in live or captured traffic, derive the PTK of every (AP, STA) pair
+# using a known PMK, and install the TK in a KeyStore so data frames can be decrypted on the fly.
+from .dragonfly import *
+from .crypto import *
+import collections, hmac
+from Crypto.Hash import CMAC
+
+KEY_INFO_VERSION_MASK = 0x0007
+KEY_INFO_PAIRWISE = 0x0008
+KEY_INFO_INSTALL = 0x0040
+KEY_INFO_ACK = 0x0080
+KEY_INFO_MIC = 0x0100
+KEY_INFO_SECURE = 0x0200
+
+# Key descriptor versions: 0 means the algorithms are defined by the AKM (e.g. SAE)
+KEY_VERSION_AKM, KEY_VERSION_HMAC_MD5, KEY_VERSION_HMAC_SHA1, KEY_VERSION_AES_CMAC = range(4)
+
+# Offset and length of the MIC in an EAPOL-Key frame, including the EAPOL header
+EAPOL_KEY_MIC_OFFSET = 81
+EAPOL_KEY_MIC_LEN = 16
+EAPOL_KEY_HEADER = struct.Struct(">BBHBHHQ32s16s8s8s16sH")
+
+EapolKey = collections.namedtuple("EapolKey", ["key_info", "replay_counter", "nonce", "mic", "key_data", "frame"])
+
+def parse_eapol_key(data):
+	"""Parse an EAPOL-Key frame that starts with the EAPOL header. Returns None if it's malformed."""
+	if len(data) < EAPOL_KEY_HEADER.size:
+		return None
+	(version, eapol_type, length, desc_type, key_info, key_len, replay_counter, nonce, iv, rsc,
+		reserved, mic, data_len) = EAPOL_KEY_HEADER.unpack_from(data)
+	if eapol_type != 3 or length + 4 > len(data) or EAPOL_KEY_HEADER.size + data_len > length + 4:
+		return None
+	frame = bytes(data[:length + 4])
+	key_data = frame[EAPOL_KEY_HEADER.size:EAPOL_KEY_HEADER.size + data_len]
+	return EapolKey(key_info, replay_counter, nonce, mic, key_data, frame)
+
+def eapol_key_msgnum(key):
+	"""Returns the message number of a 4-way handshake frame, or 0 for other EAPOL-Key frames"""
+	info = key.key_info
+	if not info & KEY_INFO_PAIRWISE:
+		return 0
+	if info & KEY_INFO_ACK:
+		return 3 if info & KEY_INFO_MIC else 1
+	if not info & KEY_INFO_MIC:
+		return 0
+	# Message 2 always includes the RSNE of the station
+	return 2 if len(key.key_data) > 0 else 4
+
+def calc_eapol_mic(kck, key_version, frame):
+	"""Calculate the MIC over an EAPOL-Key frame, ignoring the current MIC field"""
+	end = EAPOL_KEY_MIC_OFFSET + EAPOL_KEY_MIC_LEN
+	data = frame[:EAPOL_KEY_MIC_OFFSET] + b"\x00" * EAPOL_KEY_MIC_LEN + frame[end:]
+	if key_version == KEY_VERSION_HMAC_MD5:
+		return hmac.digest(kck, data, "md5")
+	elif key_version == KEY_VERSION_HMAC_SHA1:
+		return hmac.digest(kck, data, "sha1")[:16]
+	return CMAC.new(kck, data, ciphermod=AES).digest()
+
+def calc_ptk(pmk, anonce, snonce, ap, sta, key_version):
+	"""Returns (kck, kek, tk) of a CCMP or TKIP pairwise key"""
+	ap, sta = addr2bin(ap), addr2bin(sta)
+	data = min(ap, sta) + max(ap, sta) + min(anonce, snonce) + max(anonce, snonce)
+	if key_version == KEY_VERSION_HMAC_MD5:
+		# TKIP: the TK includes the Michael keys
+		ptk = prf_sha1(pmk, b"Pairwise key expansion", data, 64)
+		return ptk[:16], ptk[16:32], ptk[32:]
+	elif key_version == KEY_VERSION_HMAC_SHA1:
+		ptk = prf_sha1(pmk, b"Pairwise key expansion", data, 48)
+	else:
+		ptk = KDF_Length(pmk, "Pairwise key expansion", data, 384)
+	return ptk[:16], ptk[16:32], ptk[32:48]
+
+class HandshakeState():
+	"""Progress of the most recent 4-way handshake of an (AP, STA) pair"""
+	__slots__ = ["ap", "sta", "anonce", "snonce", "replay_counter", "ptk_nonces", "kck", "kek", "tk", "epoch",
+	             "complete", "last_seen"]
+
+	def __init__(self, ap, sta):
+		self.ap = ap
+		self.sta = sta
+		self.anonce = self.snonce = None
+		self.replay_counter = None
+		# The (ANonce, SNonce) that were used to derive the current PTK
+		self.ptk_nonces = None
+		self.kck = self.kek = self.tk = None
+		# Number of PTKs that were derived for this pair. Rekeys increase the epoch.
+		self.epoch = 0
+		self.complete = False
+		self.last_seen = 0
+
+	def __repr__(self):
+		return "HandshakeState(%s, %s, epoch=%d, complete=%s)" % (self.ap, self.sta, self.epoch, self.complete)
+
+class HandshakeTracker():
+	"""
+	Tracks the 4-way handshakes of at most max_pairs (AP, STA) pairs. The PMKs are given as a
+	dict that maps AP addresses to their PMK, or as a single PMK that is used for all APs. When
+	no PMKs are given, the PMKs stored in the KeyStore are used. Every verified PTK is installed
+	in the KeyStore so that process() can decrypt data frames.
+	"""
+	def __init__(self, pmks=None, keystore=None, max_pairs=1024, callback=None):
+		self.pmks = pmks
+		self.keystore = keystore if keystore is not None else KeyStore(max_pairs)
+		self.max_pairs = max_pairs
+		self.callback = callback
+		self.states = collections.OrderedDict()
+
+	def get_pmk(self, ap):
+		if self.pmks is None:
+			return self.keystore.get_pmk(ap)
+		elif isinstance(self.pmks, dict):
+			return self.pmks.get(ap)
+		return self.pmks
+
+	def process(self, p):
+		"""Process a frame. Returns the decrypted frame if it was a CCMP frame we have a key for."""
+		if EAPOL in p:
+			if p[EAPOL].type == 3:
+				self._process_eapol_key(p)
+			return None
+
+		if Dot11CCMP in p and len(self.keystore) > 0:
+			try:
+				return decrypt_ccmp(p, keystore=self.keystore)
+			except ValueError:
+				return None
+		return None
+
+	def process_pcap(self, filename):
+		"""Yields all frames of a capture, with CCMP frames decrypted when possible"""
+		with PcapReader(filename) as reader:
+			for p in reader:
+				decrypted = self.process(p)
+				yield decrypted if decrypted is not None else p
+
+	def monitor(self, sock, timeout=None, prn=None):
+		"""Track handshakes on a MonitorSocket and pass decrypted frames to prn"""
+		def handle(p):
+			decrypted = self.process(p)
+			if decrypted is not None and prn is not None:
+				prn(decrypted)
+		sniff(opened_socket=sock, timeout=timeout, store=False, prn=handle)
+
+	def _get_state(self, ap, sta, p):
+		pair = (ap, sta)
+		state = self.states.get(pair)
+		if state is None:
+			state = HandshakeState(ap, sta)
+			self.states[pair] = state
+			if len(self.states) > self.max_pairs:
+				self.states.popitem(last=False)
+		else:
+			self.states.move_to_end(pair)
+		state.last_seen = getattr(p, "time", 0)
+		return state
+
+	def _process_eapol_key(self, p):
+		key = parse_eapol_key(raw(p[EAPOL]))
+		if key is None:
+			return
+		msgnum = eapol_key_msgnum(key)
+		if msgnum == 0:
+			return
+
+		src, dst = get_eapol_addresses(p)
+		ap, sta = (src, dst) if msgnum in [1, 3] else (dst, src)
+		state = self._get_state(ap, sta, p)
+
+		if msgnum == 1:
+			state.anonce = key.nonce
+			state.replay_counter = key.replay_counter
+		elif msgnum == 2:
+			state.snonce = key.nonce
+			self._derive_ptk(state, key)
+		elif msgnum == 3:
+			# Message 3 also contains the ANonce, so a missed message 1 is not a problem
+			state.anonce = key.nonce
+			if state.ptk_nonces != (state.anonce, state.snonce):
+				self._derive_ptk(state, key)
+			elif self._verify_mic(state.kck, key):
+				state.replay_counter = key.replay_counter
+		elif msgnum == 4:
+			if state.kck is not None and self._verify_mic(state.kck, key):
+				state.complete = True
+
+	def _verify_mic(self, kck, key):
+		return hmac.compare_digest(calc_eapol_mic(kck, key.key_info & KEY_INFO_VERSION_MASK, key.frame), key.mic)
+
+	def _derive_ptk(self, state, key):
+		"""Derive the PTK and install it when the MIC of the given message is valid"""
+		pmk = self.get_pmk(state.ap)
+		if pmk is None or state.snonce is None or state.anonce is None:
+			return
+
+		key_version = key.key_info & KEY_INFO_VERSION_MASK
+		kck, kek, tk = calc_ptk(pmk, state.anonce, state.snonce, state.ap, state.sta, key_version)
+		if not self._verify_mic(kck, key):
+			log(DEBUG, "Handshake %s-%s: invalid MIC (wrong PMK?)" % (state.ap, state.sta))
+			return
+
+		state.ptk_nonces = (state.anonce, state.snonce)
+		state.kck, state.kek, state.tk = kck, kek, tk
+		state.epoch += 1
+		state.complete = False
+		state.replay_counter = key.replay_counter
+
+		# TKIP keys are tracked but only CCMP frames are decrypted
+		if key_version != KEY_VERSION_HMAC_MD5:
+			self.keystore.install(state.ap, state.sta, tk)
+		log(STATUS, "Handshake %s-%s: derived PTK (epoch %d)" % (state.ap, state.sta, state.epoch))
+		if self.callback is not None:
+			self.callback(state)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Lightweight counters and histograms to see where time goes. Instrumentation is disabled by
+# default, and then count() and observe() are bound to a no-op so hot paths stay cheap. Enable it
+# by calling enable() or by setting the LIBWIFI_METRICS environment variable.
+import os, time, json, bisect, functools, threading
+
+# Default histogram buckets, as upper bounds in seconds
+LATENCY_BUCKETS = [1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1, 5, 10]
+
+class Histogram():
+	__slots__ = ["buckets", "counts", "sum", "count"]
+
+	def __init__(self, buckets=LATENCY_BUCKETS):
+		self.buckets = list(buckets)
+		# The last count is for values larger than all buckets
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.sum = 0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def cumulative(self):
+		"""Return (upper bound, number of values <= bound) pairs like Prometheus does"""
+		total, result = 0, []
+		for bound, num in zip(self.buckets + [float("inf")], self.counts):
+			total += num
+			result.append((bound, total))
+		return result
+
+enabled = False
+counters = dict()
+histograms = dict()
+_lock = threading.Lock()
+
+def register_histogram(name, buckets):
+	"""Use custom buckets for the given histogram, e.g. when it's not measuring time"""
+	with _lock:
+		histograms[name] = Histogram(buckets)
+
+def _noop(*args, **kwargs):
+	pass
+
+def _count(name, num=1):
+	counters[name] = counters.get(name, 0) + num
+
+def _observe(name, value):
+	histogram = histograms.get(name)
+	if histogram is None:
+		with _lock:
+			histogram = histograms.setdefault(name, Histogram())
+	histogram.observe(value)
+
+count = _noop
+observe = _noop
+
+def enable():
+	global enabled, count, observe
+	enabled, count, observe = True, _count, _observe
+
+def disable():
+	global enabled, count, observe
+	enabled, count, observe = False, _noop, _noop
+
+def reset():
+	counters.clear()
+	for histogram in histograms.values():
+		histogram.counts = [0] * len(histogram.counts)
+		histogram.sum = histogram.count = 0
+
+class timed():
+	"""
+	Time a section and add the elapsed seconds to a histogram. Can be used as a context manager,
+	as in `with timed("crypto.ccmp.decrypt"):`, or as a function decorator.
+	"""
+	__slots__ = ["name", "start"]
+
+	def __init__(self, name):
+		self.name = name
+		self.start = None
+
+	def __enter__(self):
+		if enabled:
+			self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if self.start is not None:
+			observe(self.name, time.perf_counter() - self.start)
+			self.start = None
+
+	def __call__(self, func):
+		name = self.name
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return func(*args, **kwargs)
+			start = time.perf_counter()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				observe(name, time.perf_counter() - start)
+		return wrapper
+
+#### Snapshots ####
+
+def snapshot():
+	"""Return a copy of all counters and histograms"""
+	with _lock:
+		return {"counters": dict(counters),
+		        "histograms": {name: {"buckets": histogram.cumulative(), "sum": histogram.sum,
+		                              "count": histogram.count}
+		                       for name, histogram in histograms.items() if histogram.count > 0}}
+
+def to_json(data=None):
+	data = data if data is not None else snapshot()
+	# JSON has no infinity, so use the Prometheus notation for the last bucket
+	histograms = {name: dict(histogram, buckets=[["+Inf" if bound == float("inf") else bound, num]
+	                                             for bound, num in histogram["buckets"]])
+	              for name, histogram in data["histograms"].items()}
+	return json.dumps({"counters": data["counters"], "histograms": histograms}, indent=2, sort_keys=True)
+
+def _prometheus_name(name, prefix):
+	return prefix + "".join(c if c.isalnum() else "_" for c in name)
+
+def to_prometheus(data=None, prefix="libwifi_"):
+	"""Return all metrics in the Prometheus text exposition format"""
+	data = data if data is not None else snapshot()
+	lines = []
+	for name, value in sorted(data["counters"].items()):
+		name = _prometheus_name(name, prefix) + "_total"
+		lines += ["# TYPE %s counter" % name, "%s %s" % (name, value)]
+	for name, histogram in sorted(data["histograms"].items()):
+		name = _prometheus_name(name, prefix)
+		lines.append("# TYPE %s histogram" % name)
+		for bound, num in histogram["buckets"]:
+			bound = "+Inf" if bound in [float("inf"), "+Inf"] else repr(bound)
+			lines.append('%s_bucket{le="%s"} %d' % (name, bound, num))
+		lines += ["%s_sum %s" % (name, histogram["sum"]), "%s_count %d" % (name, histogram["count"])]
+	return "\n".join(lines) + "\n"
+
+if os.environ.get("LIBWIFI_METRICS"):
+	enable()
@@ -1,25 +1,19 @@
 #!/usr/bin/env python3
-import binascii, struct
+import binascii, struct, hashlib, hmac
 from Crypto.Hash import MD4, SHA
 from Crypto.Cipher import DES
+from . import metrics
 
+MAGIC1 = b"\x4D\x61\x67\x69\x63\x20\x73\x65\x72\x76\x65\x72\x20\x74\x6F\x20\x63\x6C\x69\x65\x6E\x74\x20\x73\x69\x67\x6E\x69\x6E\x67\x20\x63\x6F\x6E\x73\x74\x61\x6E\x74"
+MAGIC2 = b"\x50\x61\x64\x20\x74\x6F\x20\x6D\x61\x6B\x65\x20\x69\x74\x20\x64\x6F\x20\x6D\x6F\x72\x65\x20\x74\x68\x61\x6E\x20\x6F\x6E\x65\x20\x69\x74\x65\x72\x61\x74\x69\x6F\x6E"
 
-def des_encrypt(clear, key, offset):
-	cNext = 0
-	cWorking = 0
-	hexKey = {}
-
-	for x in range(0,8):
-		cWorking = 0xFF & key[x + offset]
-		hexKey[x] = ((cWorking >> x) | cNext | 1) & 0xFF
-		cWorking = 0xFF & key[x + offset]
-		cNext = ((cWorking << (7 - x)))
-
-	newKey = b""
-	for x in range(0, len(hexKey)):
-		newKey += struct.pack(">B", hexKey[x])
+def expand_des_key(key):
+	"""Expand a 7-byte key to an 8-byte DES key by inserting a (ignored) parity bit after every 7 bits"""
+	value = int.from_bytes(key[:7], "big")
+	return bytes(((value >> (49 - 7 * i)) & 0x7F) << 1 | 1 for i in range(8))
 
-	des = DES.new(newKey, DES.MODE_ECB)
+def des_encrypt(clear, key, offset):
+	des = DES.new(expand_des_key(key[offset:offset + 7]), DES.MODE_ECB)
 	return des.encrypt(clear)
 
 def challenge_hash(peer_challenge, authenticator_challenge, username):
@@ -47,14 +41,15 @@ def challenge_response(challenge, pwhash):
 
 	return response
 
+@metrics.timed("mschap.generate_nt_response")
 def generate_nt_response_mschap2(authenticator_challenge, peer_challenge, username, password):
 	challenge = challenge_hash(peer_challenge, authenticator_challenge, username)
 	password_hash = nt_password_hash(password)
 	return challenge_response(challenge, password_hash)
 
 def generate_authenticator_response(password, nt_response, peer_challenge, authenticator_challenge, username):
-	magic1 = b"\x4D\x61\x67\x69\x63\x20\x73\x65\x72\x76\x65\x72\x20\x74\x6F\x20\x63\x6C\x69\x65\x6E\x74\x20\x73\x69\x67\x6E\x69\x6E\x67\x20\x63\x6F\x6E\x73\x74\x61\x6E\x74"
-	magic2 = b"\x50\x61\x64\x20\x74\x6F\x20\x6D\x61\x6B\x65\x20\x69\x74\x20\x64\x6F\x20\x6D\x6F\x72\x65\x20\x74\x68\x61\x6E\x20\x6F\x6E\x65\x20\x69\x74\x65\x72\x61\x74\x69\x6F\x6E"
+	magic1 = MAGIC1
+	magic2 = MAGIC2
 
 	password_hash = nt_password_hash(password)
 	password_hash_hash = hash_nt_password_hash(password_hash)
@@ -75,3 +70,59 @@ def generate_authenticator_response(password, nt_response, peer_challenge, authe
 
 	return digest
 
+
+# ----------------------- Server-side verifier ---------------------------------
+
+class MSCHAPv2User():
+	"""Precomputed password hashes and DES key schedules of a single user"""
+	__slots__ = ["username", "password_hash", "password_hash_hash", "ciphers"]
+
+	def __init__(self, username, password_hash):
+		self.username = username
+		self.password_hash = password_hash
+		self.password_hash_hash = hash_nt_password_hash(password_hash)
+		key = password_hash + b"\x00" * 5
+		self.ciphers = [DES.new(expand_des_key(key[i:i + 7]), DES.MODE_ECB) for i in range(0, 21, 7)]
+
+	def challenge_response(self, challenge):
+		return b"".join(cipher.encrypt(challenge) for cipher in self.ciphers)
+
+class MSCHAPv2Verifier():
+	"""
+	Verifies MSCHAPv2 NT-Responses of many users. The NT hash, its hash, and the DES key
+	schedules of every user are computed once when the user is added.
+	"""
+	def __init__(self):
+		self.users = dict()
+
+	def add_user(self, username, password=None, password_hash=None):
+		if password_hash is None:
+			password_hash = nt_password_hash(password)
+		self.users[username] = MSCHAPv2User(username, password_hash)
+
+	def remove_user(self, username):
+		self.users.pop(username, None)
+
+	def __len__(self):
+		return len(self.users)
+
+	def verify(self, username, authenticator_challenge, peer_challenge, nt_response):
+		"""Returns the authenticator response if the NT-Response is valid, otherwise None"""
+		user = self.users.get(username)
+		if user is None or len(nt_response) != 24:
+			metrics.count("mschap.verify.unknown_user" if user is None else "mschap.verify.malformed")
+			return None
+
+		challenge = hashlib.sha1(peer_challenge + authenticator_challenge + username).digest()[:8]
+		if not hmac.compare_digest(user.challenge_response(challenge), nt_response):
+			metrics.count("mschap.verify.failures")
+			return None
+		metrics.count("mschap.verify.success")
+
+		digest = hashlib.sha1(user.password_hash_hash + nt_response + MAGIC1).digest()
+		return hashlib.sha1(digest + challenge + MAGIC2).digest()
+
+	def verify_batch(self, requests):
+		"""Verify (username, authenticator_challenge, peer_challenge, nt_response) tuples"""
+		verify = self.verify
+		return [verify(*request) for request in requests]
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# Control wireless interfaces in-process using rtnetlink and nl80211, instead of starting iw,
+# ifconfig, or macchanger for every operation. The state of every interface is cached so that
+# frequent queries, such as the current channel while hopping, don't need a round trip.
+import os, socket, struct, time
+from . import metrics
+
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NLM_F_DUMP = 0x300
+NLATTR_HEADER = struct.Struct("=HH")
+NLA_TYPE_MASK = 0x3FFF
+
+# Generic netlink controller
+GENL_HEADER = struct.Struct("=BBH")
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+# nl80211 commands and attributes
+NL80211_CMD_SET_WIPHY = 2
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_SET_INTERFACE = 6
+NL80211_ATTR_WIPHY = 1
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_IFNAME = 4
+NL80211_ATTR_IFTYPE = 5
+NL80211_ATTR_MAC = 6
+NL80211_ATTR_WIPHY_FREQ = 38
+NL80211_ATTR_WIPHY_CHANNEL_TYPE = 39
+NL80211_CHAN_NO_HT = 0
+
+NL80211_IFTYPES = {1: "IBSS", 2: "managed", 3: "AP", 4: "AP/VLAN", 5: "WDS", 6: "monitor", 7: "mesh point",
+                   8: "P2P-client", 9: "P2P-GO", 10: "P2P-device", 11: "outside context of a BSS", 12: "NAN"}
+NL80211_IFTYPE_IDS = {name: num for num, name in NL80211_IFTYPES.items()}
+
+# rtnetlink link messages and attributes
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+IFINFO_HEADER = struct.Struct("=BxHiII")
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFF_UP = 0x1
+
+def channel_to_freq(channel):
+	"""Frequency in MHz of a 2.4 or 5 GHz channel"""
+	if channel == 14:
+		return 2484
+	elif channel < 14:
+		return 2407 + 5 * channel
+	return 5000 + 5 * channel
+
+def freq_to_channel(freq):
+	if freq == 2484:
+		return 14
+	elif freq < 2484:
+		return (freq - 2407) // 5
+	elif freq >= 5955:
+		return (freq - 5950) // 5
+	return (freq - 5000) // 5
+
+#### Message encoding ####
+
+def nlattr(attr_type, value):
+	"""Encode an attribute. Integers must be encoded by the caller, strings are NUL-terminated."""
+	if isinstance(value, str):
+		value = value.encode() + b"\x00"
+	data = NLATTR_HEADER.pack(NLATTR_HEADER.size + len(value), attr_type) + value
+	return data + b"\x00" * (-len(data) % 4)
+
+def nlattr_u32(attr_type, value):
+	return nlattr(attr_type, struct.pack("=I", value))
+
+def parse_nlattrs(data, pos=0):
+	"""Returns a dict that maps attribute types to their raw values"""
+	attrs = dict()
+	while pos + NLATTR_HEADER.size <= len(data):
+		length, attr_type = NLATTR_HEADER.unpack_from(data, pos)
+		if length < NLATTR_HEADER.size or pos + length > len(data):
+			break
+		attrs[attr_type & NLA_TYPE_MASK] = data[pos + NLATTR_HEADER.size:pos + length]
+		pos += length + (-length % 4)
+	return attrs
+
+def nlmsg(msg_type, flags, seq, payload, pid=0):
+	return NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), msg_type, flags, seq, pid) + payload
+
+def parse_nlmsgs(data):
+	"""Returns the (type, flags, seq, payload) of all messages in a datagram"""
+	msgs, pos = [], 0
+	while pos + NLMSG_HEADER.size <= len(data):
+		length, msg_type, flags, seq, pid = NLMSG_HEADER.unpack_from(data, pos)
+		if length < NLMSG_HEADER.size or pos + length > len(data):
+			break
+		msgs.append((msg_type, flags, seq, data[pos + NLMSG_HEADER.size:pos + length]))
+		pos += length + (-length % 4)
+	return msgs
+
+class NetlinkSocket():
+	"""Sends requests on a netlink socket and collects the replies. A socket object can be given for testing."""
+	def __init__(self, protocol, sock=None):
+		if sock is None:
+			sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, protocol)
+			sock.bind((0, 0))
+		self.sock = sock
+		self.seq = int(time.time()) & 0xFFFFFFF
+
+	def request(self, msg_type, payload, flags=NLM_F_ACK):
+		"""Returns the payloads of all replies. Raises OSError when the kernel reports an error."""
+		self.seq += 1
+		self.sock.send(nlmsg(msg_type, NLM_F_REQUEST | flags, self.seq, payload))
+
+		replies = []
+		while True:
+			for reply_type, reply_flags, seq, reply in parse_nlmsgs(self.sock.recv(65536)):
+				if seq != self.seq:
+					continue
+				if reply_type == NLMSG_ERROR:
+					error = struct.unpack_from("=i", reply)[0]
+					if error != 0:
+						raise OSError(-error, os.strerror(-error))
+					return replies
+				elif reply_type == NLMSG_DONE:
+					return replies
+				replies.append(reply)
+				# Replies to requests without the ACK or DUMP flags consist of a single message
+				if not flags & (NLM_F_ACK | NLM_F_DUMP):
+					return replies
+
+	def close(self):
+		self.sock.close()
+
+#### Cached interface state ####
+
+class InterfaceState():
+	__slots__ = ["name", "index", "iftype", "freq", "up", "mac", "mtu"]
+
+	def __init__(self, name, index):
+		self.name = name
+		self.index = index
+		self.iftype = self.freq = self.up = self.mac = self.mtu = None
+
+	@property
+	def channel(self):
+		return freq_to_channel(self.freq) if self.freq is not None else None
+
+	def __repr__(self):
+		return "InterfaceState(%s, type=%s, channel=%s, up=%s)" % (self.name, self.iftype, self.channel, self.up)
+
+class NetlinkClient():
+	"""
+	Get and set the channel, type, up/down state, and MAC address of interfaces. Queries are
+	answered from a cache that is updated after every successful change. Call refresh() when
+	other programs may have changed the interface.
+	"""
+	def __init__(self, genl_sock=None, route_sock=None):
+		self.genl = NetlinkSocket(NETLINK_GENERIC, genl_sock)
+		self.route = NetlinkSocket(NETLINK_ROUTE, route_sock)
+		self.nl80211 = None
+		self.states = dict()
+
+	def _get_family(self):
+		if self.nl80211 is None:
+			payload = GENL_HEADER.pack(CTRL_CMD_GETFAMILY, 1, 0) + nlattr(CTRL_ATTR_FAMILY_NAME, "nl80211")
+			replies = self.genl.request(GENL_ID_CTRL, payload)
+			attrs = parse_nlattrs(replies[0], GENL_HEADER.size)
+			self.nl80211 = struct.unpack("=H", attrs[CTRL_ATTR_FAMILY_ID][:2])[0]
+		return self.nl80211
+
+	def _nl80211(self, cmd, attrs, flags=NLM_F_ACK):
+		payload = GENL_HEADER.pack(cmd, 0, 0) + b"".join(attrs)
+		return self.genl.request(self._get_family(), payload, flags)
+
+	def _index(self, iface):
+		state = self.states.get(iface)
+		return state.index if state is not None else socket.if_nametoindex(iface)
+
+	def refresh(self, iface):
+		"""Query the nl80211 and link state of the interface and update the cache"""
+		with metrics.timed("netlink.refresh"):
+			state = InterfaceState(iface, socket.if_nametoindex(iface))
+			replies = self._nl80211(NL80211_CMD_GET_INTERFACE, [nlattr_u32(NL80211_ATTR_IFINDEX, state.index)], 0)
+			attrs = parse_nlattrs(replies[0], GENL_HEADER.size)
+			if NL80211_ATTR_IFTYPE in attrs:
+				state.iftype = NL80211_IFTYPES.get(struct.unpack("=I", attrs[NL80211_ATTR_IFTYPE][:4])[0])
+			if NL80211_ATTR_WIPHY_FREQ in attrs:
+				state.freq = struct.unpack("=I", attrs[NL80211_ATTR_WIPHY_FREQ][:4])[0]
+
+			replies = self.route.request(RTM_GETLINK, IFINFO_HEADER.pack(socket.AF_UNSPEC, 0, state.index, 0, 0), 0)
+			family, dev_type, index, flags, change = IFINFO_HEADER.unpack_from(replies[0])
+			attrs = parse_nlattrs(replies[0], IFINFO_HEADER.size)
+			state.up = flags & IFF_UP != 0
+			if IFLA_ADDRESS in attrs:
+				state.mac = ":".join("%02x" % b for b in attrs[IFLA_ADDRESS][:6])
+			if IFLA_MTU in attrs:
+				state.mtu = struct.unpack("=I", attrs[IFLA_MTU][:4])[0]
+		self.states[iface] = state
+		return state
+
+	def get_state(self, iface, cached=True):
+		state = self.states.get(iface) if cached else None
+		return state if state is not None else self.refresh(iface)
+
+	def get_channel(self, iface, cached=True):
+		return self.get_state(iface, cached).channel
+
+	def get_iftype(self, iface, cached=True):
+		return self.get_state(iface, cached).iftype
+
+	def set_channel(self, iface, channel):
+		freq = channel_to_freq(channel)
+		with metrics.timed("netlink.set_channel"):
+			self._nl80211(NL80211_CMD_SET_WIPHY, [nlattr_u32(NL80211_ATTR_IFINDEX, self._index(iface)),
+			              nlattr_u32(NL80211_ATTR_WIPHY_FREQ, freq),
+			              nlattr_u32(NL80211_ATTR_WIPHY_CHANNEL_TYPE, NL80211_CHAN_NO_HT)])
+		if iface in self.states:
+			self.states[iface].freq = freq
+
+	def set_iftype(self, iface, iftype):
+		"""Change the type, e.g. to "monitor". Most drivers require the interface to be down."""
+		with metrics.timed("netlink.set_iftype"):
+			self._nl80211(NL80211_CMD_SET_INTERFACE, [nlattr_u32(NL80211_ATTR_IFINDEX, self._index(iface)),
+			              nlattr_u32(NL80211_ATTR_IFTYPE, NL80211_IFTYPE_IDS[iftype])])
+		if iface in self.states:
+			self.states[iface].iftype = iftype
+
+	def _set_link(self, iface, flags=0, change=0, attrs=[]):
+		payload = IFINFO_HEADER.pack(socket.AF_UNSPEC, 0, self._index(iface), flags, change) + b"".join(attrs)
+		self.route.request(RTM_NEWLINK, payload)
+
+	def set_up(self, iface, up=True):
+		with metrics.timed("netlink.set_up"):
+			self._set_link(iface, IFF_UP if up else 0, IFF_UP)
+		if iface in self.states:
+			self.states[iface].up = up
+
+	def set_macaddress(self, iface, macaddr):
+		with metrics.timed("netlink.set_macaddress"):
+			self._set_link(iface, attrs=[nlattr(IFLA_ADDRESS, bytes.fromhex(macaddr.replace(":", "")))])
+		if iface in self.states:
+			self.states[iface].mac = macaddr.lower()
+
+	def set_mtu(self, iface, mtu):
+		with metrics.timed("netlink.set_mtu"):
+			self._set_link(iface, attrs=[nlattr_u32(IFLA_MTU, mtu)])
+		if iface in self.states:
+			self.states[iface].mtu = mtu
+
+	def close(self):
+		self.genl.close()
+		self.route.close()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Detect reuse of CCMP packet numbers in very long captures. Instead of remembering every packet
+# number, every station has a Bloom filter, and hits are confirmed against a small window of
+# recent packet numbers. Memory usage stays bounded no matter how long the capture runs.
+from .wifi import *
+import array, collections, hashlib, math
+
+NonceReuse = collections.namedtuple("NonceReuse", ["ta", "pn", "epoch", "seq", "ts", "first_seq", "first_ts",
+                                                   "confirmed", "retransmission"])
+
+class BloomFilter():
+	"""Bloom filter for capacity items with the given false positive rate"""
+	__slots__ = ["num_bits", "num_hashes", "bits", "count"]
+
+	def __init__(self, capacity, fp_rate=0.001):
+		self.num_bits = max(8, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+		self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+		self.bits = bytearray((self.num_bits + 7) // 8)
+		self.count = 0
+
+	@staticmethod
+	def capacity_for(num_bytes, fp_rate):
+		"""The number of items a filter of num_bytes can hold with the given false positive rate"""
+		return max(1, int(num_bytes * 8 * math.log(2) ** 2 / -math.log(fp_rate)))
+
+	def _positions(self, item):
+		digest = hashlib.blake2b(item, digest_size=16).digest()
+		h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+		return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+	def add(self, item):
+		"""Add an item. Returns True if it was (probably) already present."""
+		present = True
+		bits = self.bits
+		for pos in self._positions(item):
+			mask = 1 << (pos & 7)
+			if not bits[pos >> 3] & mask:
+				present = False
+				bits[pos >> 3] |= mask
+		if not present:
+			self.count += 1
+		return present
+
+	def __contains__(self, item):
+		return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class StationNonces():
+	"""Packet numbers seen from one transmitter: a current and previous Bloom filter and a recent window"""
+	__slots__ = ["current", "previous", "keys", "seqs", "times", "pos"]
+	# Bytes used by every entry of the recent window
+	ENTRY_SIZE = 8 + 2 + 8
+
+	def __init__(self, capacity, fp_rate):
+		self.current = BloomFilter(capacity, fp_rate)
+		self.previous = None
+		# Ring buffer of recent (PN, epoch) keys with the sequence number and time of the frame that used them
+		self.keys = array.array("Q")
+		self.seqs = array.array("H")
+		self.times = array.array("d")
+		self.pos = 0
+
+	def find(self, key):
+		"""Returns the (sequence number, time) of the first use of key, or None if it's not in the window"""
+		try:
+			index = self.keys.index(key)
+		except ValueError:
+			return None
+		return self.seqs[index], self.times[index]
+
+	def add(self, key, seq, ts, window):
+		if len(self.keys) < window:
+			self.keys.append(key)
+			self.seqs.append(seq)
+			self.times.append(ts)
+		else:
+			self.keys[self.pos], self.seqs[self.pos], self.times[self.pos] = key, seq, ts
+			self.pos = (self.pos + 1) % window
+
+class NonceReuseDetector():
+	"""
+	Tracks the (PN, TK epoch) of protected frames per transmitter. Every station gets a window of
+	recent packet numbers and two Bloom filters that share the rest of memory_budget / max_stations:
+	when the current filter is full it replaces the previous one, so the oldest packet numbers are
+	forgotten first. A Bloom filter hit is confirmed when the packet number is in the window.
+	Retransmissions, i.e., frames with the same sequence number as the first use of the packet
+	number, or frames with the retry bit whose first use already left the window, are not reported.
+	Only the last max_reuses detections are kept in self.reuses. The epoch must be below 2^16.
+	"""
+	def __init__(self, max_stations=1024, memory_budget=64 << 20, fp_rate=0.001, window=1024, callback=None,
+	             max_reuses=1024):
+		filter_budget = memory_budget // max_stations - window * StationNonces.ENTRY_SIZE
+		if filter_budget < 16:
+			raise ValueError("Memory budget of %d bytes is too small for %d stations" % (memory_budget, max_stations))
+		self.max_stations = max_stations
+		self.fp_rate = fp_rate
+		self.capacity = BloomFilter.capacity_for(filter_budget // 2, fp_rate)
+		self.window = window
+		self.callback = callback
+		self.stations = collections.OrderedDict()
+		self.reuses = collections.deque(maxlen=max_reuses)
+
+	def _get_station(self, ta):
+		station = self.stations.get(ta)
+		if station is None:
+			station = StationNonces(self.capacity, self.fp_rate)
+			self.stations[ta] = station
+			if len(self.stations) > self.max_stations:
+				self.stations.popitem(last=False)
+		else:
+			self.stations.move_to_end(ta)
+		return station
+
+	def process(self, ta, pn, seq, ts, epoch=0, retry=False):
+		"""Track a frame of the transmitter ta, given as bytes. Returns a NonceReuse or None."""
+		station = self._get_station(ta)
+		key = pn | (epoch << 48)
+		hit = station.current.add(key.to_bytes(8, "little"))
+		if not hit and station.previous is not None:
+			hit = key.to_bytes(8, "little") in station.previous
+
+		result = None
+		first = station.find(key) if hit else None
+		if first is None:
+			station.add(key, seq, ts, self.window)
+			# Older than the window or a false positive of the Bloom filter
+			if hit and not retry:
+				result = NonceReuse(bin2addr(ta), pn, epoch, seq, ts, None, None, False, False)
+		elif first[0] != seq:
+			# Same check as IvInfo.is_reused, which also ignores retransmissions within a second
+			result = NonceReuse(bin2addr(ta), pn, epoch, seq, ts, first[0], first[1], True, ts < first[1] + 1)
+
+		if station.current.count >= self.capacity:
+			station.previous, station.current = station.current, BloomFilter(self.capacity, self.fp_rate)
+
+		if result is not None:
+			metrics.count("noncereuse.confirmed" if result.confirmed else "noncereuse.candidates")
+			self.reuses.append(result)
+			if self.callback is not None:
+				self.callback(result)
+		return result
+
+	def process_raw(self, linktype, data, ts=0, epoch=0):
+		"""Track a frame given as bytes, e.g. a record of MmapPcapReader"""
+		offset = raw_dot11_offset(linktype, data)
+		if offset is None or len(data) < offset + 24:
+			return None
+		# Only protected data frames have a packet number
+		if data[offset] & 0x0C != 0x08 or data[offset + 1] & 0x40 == 0:
+			return None
+		pn = raw_ccmp_pn(data, offset)
+		if pn is None:
+			return None
+		seq = (data[offset + 22] | (data[offset + 23] << 8)) >> 4
+		retry = data[offset + 1] & 0x08 != 0
+		return self.process(bytes(data[offset + 10:offset + 16]), pn, seq, ts, epoch, retry)
+
+	def process_packet(self, p, epoch=0):
+		linktype = DLT_IEEE802_11_RADIO if RadioTap in p else DLT_IEEE802_11
+		return self.process_raw(linktype, raw(p), float(p.time), epoch)
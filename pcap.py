@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Read pcap and pcapng files without dissecting frames, and write pcap files using large block
+# writes. This keeps the memory usage and processing time of multi-gigabyte captures low.
+from .wifi import *
+import mmap, os, time
+
+PCAP_MAGIC = {b"\xd4\xc3\xb2\xa1": ("<", 1e-6), b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+              b"\x4d\x3c\xb2\xa1": ("<", 1e-9), b"\xa1\xb2\x3c\x4d": (">", 1e-9)}
+PCAPNG_BLOCK_SHB = 0x0A0D0D0A
+PCAPNG_BLOCK_IDB = 1
+PCAPNG_BLOCK_SPB = 3
+PCAPNG_BLOCK_EPB = 6
+PCAPNG_OPT_IF_TSRESOL = 9
+
+class MmapPcapReader():
+	"""
+	Memory-maps a pcap or pcapng file and yields (timestamp, linktype, data) records, where data
+	is a memoryview into the file. Records are only valid while the reader is open, so convert
+	them to bytes when they must be kept. The optional prefilter is called as
+	prefilter(linktype, data) and only records for which it returns True are yielded.
+	"""
+	def __init__(self, filename, prefilter=None):
+		self.fp = open(filename, "rb")
+		self.prefilter = prefilter
+		size = os.fstat(self.fp.fileno()).st_size
+		self.mmap = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+		self.view = memoryview(self.mmap) if self.mmap is not None else memoryview(b"")
+
+	def __iter__(self):
+		magic = bytes(self.view[:4])
+		if magic in PCAP_MAGIC:
+			records = self._read_pcap(*PCAP_MAGIC[magic])
+		elif len(magic) == 4 and struct.unpack("<I", magic)[0] == PCAPNG_BLOCK_SHB:
+			records = self._read_pcapng()
+		elif len(magic) == 0:
+			return iter([])
+		else:
+			raise ValueError("Not a pcap or pcapng file")
+
+		if self.prefilter is None:
+			return records
+		prefilter = self.prefilter
+		return (record for record in records if prefilter(record[1], record[2]))
+
+	def _read_pcap(self, endian, resolution):
+		view, end = self.view, len(self.view)
+		linktype = struct.unpack_from(endian + "I", view, 20)[0] & 0x0FFFFFFF
+		header = struct.Struct(endian + "IIII")
+		pos = 24
+		while pos + 16 <= end:
+			sec, frac, caplen, origlen = header.unpack_from(view, pos)
+			pos += 16
+			if pos + caplen > end:
+				break
+			yield sec + frac * resolution, linktype, view[pos:pos + caplen]
+			pos += caplen
+
+	def _read_pcapng(self):
+		view, end = self.view, len(self.view)
+		endian = "<"
+		# Linktype and timestamp resolution of every interface in the current section
+		interfaces = []
+		pos = 0
+		while pos + 12 <= end:
+			block_type = struct.unpack_from(endian + "I", view, pos)[0]
+			if block_type == PCAPNG_BLOCK_SHB:
+				endian = "<" if bytes(view[pos + 8:pos + 12]) == b"\x4d\x3c\x2b\x1a" else ">"
+				interfaces = []
+			block_len = struct.unpack_from(endian + "I", view, pos + 4)[0]
+			if block_len < 12 or pos + block_len > end:
+				break
+			body = pos + 8
+
+			if block_type == PCAPNG_BLOCK_IDB:
+				linktype = struct.unpack_from(endian + "H", view, body)[0]
+				interfaces.append((linktype, self._get_tsresol(endian, body + 8, pos + block_len - 4)))
+			elif block_type == PCAPNG_BLOCK_EPB:
+				iface, ts_high, ts_low, caplen = struct.unpack_from(endian + "IIII", view, body)
+				# Skip corrupt blocks that refer to an undefined interface
+				if iface < len(interfaces):
+					linktype, resolution = interfaces[iface]
+					yield ((ts_high << 32) | ts_low) * resolution, linktype, view[body + 20:body + 20 + caplen]
+			elif block_type == PCAPNG_BLOCK_SPB and len(interfaces) > 0:
+				origlen = struct.unpack_from(endian + "I", view, body)[0]
+				caplen = min(origlen, block_len - 16)
+				yield 0.0, interfaces[0][0], view[body + 4:body + 4 + caplen]
+
+			pos += block_len
+
+	def _get_tsresol(self, endian, pos, end):
+		"""Parse the options of an Interface Description Block to get the timestamp resolution"""
+		while pos + 4 <= end:
+			code, length = struct.unpack_from(endian + "HH", self.view, pos)
+			if code == 0:
+				break
+			if code == PCAPNG_OPT_IF_TSRESOL and length >= 1:
+				tsresol = self.view[pos + 4]
+				return 2 ** -(tsresol & 0x7F) if tsresol & 0x80 else 10 ** -tsresol
+			pos += 4 + (length + 3) // 4 * 4
+		return 1e-6
+
+	def close(self):
+		self.view.release()
+		if self.mmap is not None:
+			try:
+				self.mmap.close()
+			except BufferError:
+				# Records are still referenced. The mapping is closed once they are freed.
+				pass
+			self.mmap = None
+		self.fp.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+class BufferedPcapWriter():
+	"""Writes a pcap file by collecting records in memory and writing them in large blocks"""
+	def __init__(self, filename, linktype=DLT_IEEE802_11_RADIO, buffer_size=1 << 20, snaplen=65535):
+		self.fp = open(filename, "wb", buffering=0)
+		self.buffer_size = buffer_size
+		self.buffer = bytearray(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, snaplen, linktype))
+		self.header = struct.Struct("<IIII")
+
+	def write(self, data, ts=None):
+		"""Add a frame given as bytes, a memoryview, or a scapy packet"""
+		if isinstance(data, Packet):
+			ts = float(data.time) if ts is None else ts
+			data = raw(data)
+		if ts is None:
+			ts = time.time()
+		sec, usec = divmod(int(round(ts * 1e6)), 1000000)
+		self.buffer += self.header.pack(sec, usec, len(data), len(data))
+		self.buffer += data
+		if len(self.buffer) >= self.buffer_size:
+			self.flush()
+
+	def flush(self):
+		self.fp.write(self.buffer)
+		del self.buffer[:]
+
+	def close(self):
+		if not self.fp.closed:
+			self.flush()
+			self.fp.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+def prefilter_dot11(types=None, addr=None):
+	"""
+	Returns a prefilter that only accepts 802.11 frames with one of the given (type, subtype)
+	tuples, and with the given address as addr1, addr2, or addr3.
+	"""
+	types = set(types) if types is not None else None
+	addr = addr2bin(addr) if addr is not None else None
+	def prefilter(linktype, data):
+		offset = raw_dot11_offset(linktype, data)
+		if offset is None or len(data) < offset + 24:
+			return False
+		if types is not None and raw_dot11_type(data, offset)[:2] not in types:
+			return False
+		if addr is not None and addr not in [raw_dot11_addr(data, i, offset) for i in [1, 2, 3]]:
+			return False
+		return True
+	return prefilter
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Profile the number of hunting-and-pecking iterations that are needed to derive the PWE of many
+# (password, MAC address) inputs. The number of iterations is what leaks in timing side channels.
+from .dragonfly import *
+import csv, time, collections, multiprocessing
+from array import array
+
+#### Result stores ####
+
+class ArrayResultStore():
+	"""Keeps all results in compact array-backed columns"""
+	def __init__(self):
+		self.ids = array("Q")
+		self.counters = array("B")
+		self.elapsed = array("Q")
+
+	def append(self, input_id, counter, elapsed_ns):
+		self.ids.append(input_id)
+		self.counters.append(counter)
+		self.elapsed.append(elapsed_ns)
+
+	def records(self):
+		return zip(self.ids, self.counters, self.elapsed)
+
+	def close(self):
+		pass
+
+	def __len__(self):
+		return len(self.ids)
+
+class CsvResultStore():
+	"""Streams all results to a CSV file so long runs don't grow in memory"""
+	def __init__(self, filename):
+		self.filename = filename
+		self.fp = open(filename, "w", newline="")
+		self.writer = csv.writer(self.fp)
+		self.writer.writerow(["id", "counter", "elapsed_ns"])
+		self.num = 0
+
+	def append(self, input_id, counter, elapsed_ns):
+		self.writer.writerow([input_id, counter, elapsed_ns])
+		self.num += 1
+
+	def records(self):
+		if not self.fp.closed:
+			self.fp.flush()
+		with open(self.filename, newline="") as fp:
+			reader = csv.reader(fp)
+			next(reader)
+			for row in reader:
+				yield int(row[0]), int(row[1]), int(row[2])
+
+	def close(self):
+		self.fp.close()
+
+	def __len__(self):
+		return self.num
+
+#### Batch engine ####
+
+def _profile_input(job):
+	"""Derive the PWE of a single input. This runs inside the worker processes."""
+	method, curve_name, args = job
+	input_id, password = args[0], args[1]
+	info = dict()
+
+	start = time.perf_counter_ns()
+	if method == "sae":
+		derive_pwe_ecc(password, args[2], args[3], curve_name, info=info)
+	else:
+		derive_pwe_ecc_eappwd(password, args[2], args[3], args[4], curve_name, info=info)
+	elapsed = time.perf_counter_ns() - start
+
+	return input_id, info.get("counter", 0), elapsed
+
+def profile_pwe(inputs, store=None, method="sae", curve_name="p256", processes=None, chunksize=64):
+	"""
+	Derive the PWE of all inputs and record the id, iteration count, and elapsed time of each.
+	For SAE the inputs are (id, password, addr1, addr2) tuples and for EAP-pwd they are
+	(id, password, peer_id, server_id, token) tuples. Results are streamed to the store.
+	"""
+	if method not in ["sae", "eappwd"]:
+		raise ValueError("Unknown PWE derivation method %s" % method)
+	if store is None:
+		store = ArrayResultStore()
+
+	jobs = ((method, curve_name, args) for args in inputs)
+	if processes == 1:
+		for result in map(_profile_input, jobs):
+			store.append(*result)
+		return store
+
+	with multiprocessing.Pool(processes) as pool:
+		for result in pool.imap_unordered(_profile_input, jobs, chunksize):
+			store.append(*result)
+	return store
+
+#### Analysis ####
+
+def counter_histogram(store):
+	"""Return the number of inputs that needed a given number of iterations"""
+	return collections.Counter(counter for _, counter, _ in store.records())
+
+def timing_histogram(store, bin_ns=10000):
+	"""Return a histogram of the elapsed time, grouped in bins of the given size"""
+	return collections.Counter(elapsed // bin_ns * bin_ns for _, _, elapsed in store.records())
+
+def iteration_timing(store):
+	"""Return the average elapsed time in nanoseconds for each iteration count"""
+	totals = collections.defaultdict(lambda: [0, 0])
+	for _, counter, elapsed in store.records():
+		totals[counter][0] += elapsed
+		totals[counter][1] += 1
+	return {counter: total // num for counter, (total, num) in totals.items()}
+
+def print_histogram(histogram, label="counter"):
+	total = sum(histogram.values())
+	for key in sorted(histogram):
+		num = histogram[key]
+		log(STATUS, "%s %8d: %8d (%5.2f%%) %s" % (label, key, num, 100.0 * num / total, "#" * (50 * num // total)))
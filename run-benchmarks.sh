@@ -0,0 +1,5 @@
+#!/bin/bash
+cd ..
+for bench in libwifi/benchmarks/bench_*.py; do
+	python -m libwifi.benchmarks.$(basename $bench .py) $@
+done
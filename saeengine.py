@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# Event-driven engine that runs many SAE handshakes concurrently, e.g. to stress test an AP using
+# spoofed station addresses. Elliptic curve operations are offloaded to an executor.
+from .dragonfly import *
+import asyncio, os, threading
+
+#### Elliptic curve work executed by the worker pool ####
+
+# Every worker process keeps its own cache of derived PWEs. The lock is needed for thread pools.
+_worker_pwe_cache = PweCache(maxsize=1024, window=0)
+_worker_pwe_lock = threading.Lock()
+
+def _get_pwe(password, stamac, bssid, group_id, ssid, identifier):
+	with _worker_pwe_lock:
+		return _worker_pwe_cache.get(password, stamac, bssid, group_id, ssid, identifier)
+
+def sae_worker_commit(password, stamac, bssid, group_id, ssid=None, identifier=None):
+	"""Returns rand, the commit scalar, and the commit element as integers"""
+	pwe, table = _get_pwe(password, stamac, bssid, group_id, ssid, identifier)
+	rand, scalar, element = sae_commit_values(pwe, group_id, table)
+	return rand, scalar, int(element.x), int(element.y)
+
+def sae_worker_keys(password, stamac, bssid, group_id, ssid, identifier, rand, scalar, peer_scalar, peer_x, peer_y):
+	"""Returns the KCK and PMK. Raises a ValueError if the peer element is not on the curve."""
+	curve = get_curve(group_id)
+	pwe, table = _get_pwe(password, stamac, bssid, group_id, ssid, identifier)
+	peer_element = ECC.EccPoint(peer_x, peer_y, curve.name)
+	hashmod = sae_hash(curve, ssid is not None)
+	k, kck, pmk = calc_k_kck_pmk(pwe, peer_element, peer_scalar, rand, scalar, curve, table, hashmod)
+	return kck, pmk
+
+#### Handshake state machine ####
+
+class SAESession():
+	"""State of a single SAE handshake between a (spoofed) station and the AP"""
+	NOTHING, COMMITTED, CONFIRMED, ACCEPTED, FAILED = range(5)
+	__slots__ = ["stamac", "bssid", "state", "token", "rand", "scalar", "element", "peer_scalar", "peer_element",
+	             "kck", "pmk", "peer_confirm", "last_frame", "retries", "timer", "start", "end", "done", "reason"]
+
+	def __init__(self, stamac, bssid):
+		self.stamac = stamac
+		self.bssid = bssid
+		self.state = SAESession.NOTHING
+		self.token = b""
+		self.rand = self.scalar = self.element = None
+		self.peer_scalar = self.peer_element = None
+		self.kck = self.pmk = None
+		self.peer_confirm = None
+		self.last_frame = None
+		self.retries = 0
+		self.timer = None
+		self.start = self.end = None
+		self.done = asyncio.get_event_loop().create_future()
+		self.reason = None
+
+	def latency(self):
+		return self.end - self.start
+
+class SAEEngine():
+	"""
+	Runs SAE handshakes of many stations with one AP. Frames are sent using transport.send(frame),
+	where frame is a Dot11 packet, and received frames must be passed to frame_received.
+	"""
+	def __init__(self, bssid, password, transport, group_id=19, ssid=None, identifier=None, executor=None,
+	             timeout=0.5, max_retries=3):
+		# Scapy returns lowercase addresses, so use these as well
+		self.bssid = bssid.lower()
+		self.password = password
+		self.transport = transport
+		self.curve = get_curve(group_id)
+		self.ssid = ssid
+		self.identifier = identifier
+		self.executor = executor
+		self.timeout = timeout
+		self.max_retries = max_retries
+		self.status = SAE_STATUS_HASH_TO_ELEMENT if ssid is not None else SAE_STATUS_SUCCESS
+		self.hashmod = sae_hash(self.curve, ssid is not None)
+
+		# Sessions are indexed by the (addr1, addr2) pair of the frames that the AP sends to us
+		self.sessions = dict()
+		self.latencies = []
+		self.failed = 0
+		self.first_start = None
+		self.last_end = None
+
+	#### Public API ####
+
+	async def handshake(self, stamac):
+		"""Execute an SAE handshake as the given station and return the finished session"""
+		loop = asyncio.get_event_loop()
+		stamac = stamac.lower()
+		session = SAESession(stamac, self.bssid)
+		self.sessions[(stamac, self.bssid)] = session
+		session.start = loop.time()
+		if self.first_start is None:
+			self.first_start = session.start
+
+		try:
+			session.rand, session.scalar, x, y = await loop.run_in_executor(self.executor, sae_worker_commit,
+				self.password, stamac, self.bssid, self.curve.group, self.ssid, self.identifier)
+			session.element = ECC.EccPoint(x, y, self.curve.name)
+			self._send_commit(session)
+			await session.done
+		finally:
+			self._cancel_timer(session)
+			del self.sessions[(stamac, self.bssid)]
+		return session
+
+	async def run(self, stations, concurrency=256):
+		"""Perform the handshakes of all given stations with at most `concurrency` of them in parallel"""
+		semaphore = asyncio.Semaphore(concurrency)
+		async def limited(stamac):
+			async with semaphore:
+				return await self.handshake(stamac)
+		return await asyncio.gather(*[limited(stamac) for stamac in stations])
+
+	def frame_received(self, p):
+		"""Process a frame that was received from the AP. The frame can be raw bytes or a Dot11 packet."""
+		if isinstance(p, (bytes, bytearray)):
+			p = Dot11(p)
+		session = self.sessions.get((p.addr1, p.addr2))
+		if session is None or not is_sae(p):
+			return
+
+		if is_sae_commit(p):
+			self._process_commit(session, p[Dot11Auth])
+		elif is_sae_confirm(p):
+			self._process_confirm(session, p[Dot11Auth])
+
+	def statistics(self):
+		"""Return the number of successful handshakes per second and the latency percentiles in ms"""
+		stats = {"completed": len(self.latencies), "failed": self.failed, "handshakes_per_sec": 0.0}
+		if len(self.latencies) == 0:
+			return stats
+
+		duration = self.last_end - self.first_start
+		if duration > 0:
+			stats["handshakes_per_sec"] = len(self.latencies) / duration
+		latencies = sorted(self.latencies)
+		for percentile in [50, 90, 99]:
+			index = min(len(latencies) - 1, int(round(percentile / 100.0 * (len(latencies) - 1))))
+			stats["p%d_ms" % percentile] = latencies[index] * 1000
+		stats["max_ms"] = latencies[-1] * 1000
+		return stats
+
+	#### Frame handling ####
+
+	def _send(self, session, frame):
+		session.last_frame = frame
+		session.retries = 0
+		self.transport.send(frame)
+		self._start_timer(session)
+
+	def _send_commit(self, session):
+		identifier = self.identifier if self.ssid is not None else None
+		commit = build_sae_commit(session.stamac, self.bssid, session.scalar, session.element, session.token,
+		                          self.status, identifier, self.curve.group)
+		session.state = SAESession.COMMITTED
+		self._send(session, commit)
+
+	def _process_commit(self, session, auth):
+		if session.state != SAESession.COMMITTED or session.peer_scalar is not None:
+			return
+
+		try:
+			group_id, token, scalar, x, y, _ = parse_sae_commit(raw(auth.payload), auth.status)
+		except (ValueError, struct.error) as ex:
+			return self._fail(session, "malformed commit (%s)" % ex)
+
+		if auth.status == SAE_STATUS_ANTI_CLOGGING_TOKEN_REQUIRED:
+			log(DEBUG, "%s: AP requested anti-clogging token" % session.stamac)
+			session.token = token
+			self._cancel_timer(session)
+			self._send_commit(session)
+			return
+		elif auth.status != self.status:
+			return self._fail(session, "AP replied with status %d" % auth.status)
+		elif group_id != self.curve.group:
+			return self._fail(session, "AP used group %d" % group_id)
+		elif not 1 < scalar < self.curve.r:
+			return self._fail(session, "invalid commit scalar")
+		elif scalar == session.scalar and (x, y) == (session.element.x, session.element.y):
+			return self._fail(session, "AP reflected our commit")
+
+		self._cancel_timer(session)
+		session.peer_scalar = scalar
+		future = asyncio.get_event_loop().run_in_executor(self.executor, sae_worker_keys, self.password,
+			session.stamac, self.bssid, self.curve.group, self.ssid, self.identifier, session.rand,
+			session.scalar, scalar, x, y)
+		future.add_done_callback(lambda future: self._keys_derived(session, future, x, y))
+
+	def _keys_derived(self, session, future, x, y):
+		if session.done.done():
+			return
+		try:
+			session.kck, session.pmk = future.result()
+		except ValueError:
+			return self._fail(session, "commit element is not on the curve")
+		except Exception as ex:
+			# E.g. a broken process pool. No timer is running, so the session must fail here.
+			return self._fail(session, "deriving keys failed (%s)" % ex)
+		session.peer_element = ECC.EccPoint(x, y, self.curve.name)
+
+		send_confirm = 1
+		confirm = calculate_confirm_hash(session.kck, send_confirm, session.scalar, session.element,
+		                                 session.peer_scalar, session.peer_element, self.curve, self.hashmod)
+		session.state = SAESession.CONFIRMED
+		self._send(session, build_sae_confirm(session.stamac, self.bssid, send_confirm, confirm))
+
+		# The AP may have sent its confirm before we finished processing its commit
+		if session.peer_confirm is not None:
+			self._process_confirm(session, session.peer_confirm)
+
+	def _process_confirm(self, session, auth):
+		if auth.status != SAE_STATUS_SUCCESS:
+			return self._fail(session, "AP replied with status %d" % auth.status)
+		if session.state != SAESession.CONFIRMED:
+			session.peer_confirm = auth
+			return
+
+		try:
+			send_confirm, confirm = parse_sae_confirm(raw(auth.payload), self.hashmod.digest_size)
+		except struct.error as ex:
+			return self._fail(session, "malformed confirm (%s)" % ex)
+		expected = calculate_confirm_hash(session.kck, send_confirm, session.peer_scalar, session.peer_element,
+		                                  session.scalar, session.element, self.curve, self.hashmod)
+		if confirm != expected:
+			return self._fail(session, "invalid confirm")
+
+		session.state = SAESession.ACCEPTED
+		session.end = asyncio.get_event_loop().time()
+		self.last_end = session.end
+		self.latencies.append(session.latency())
+		self._cancel_timer(session)
+		session.done.set_result(session)
+
+	def _fail(self, session, reason):
+		# Frames can still arrive after the handshake finished
+		if session.done.done():
+			return
+		log(DEBUG, "%s: SAE handshake failed: %s" % (session.stamac, reason))
+		session.state = SAESession.FAILED
+		session.reason = reason
+		session.end = asyncio.get_event_loop().time()
+		self.failed += 1
+		self._cancel_timer(session)
+		session.done.set_result(session)
+
+	#### Retransmissions ####
+
+	def _start_timer(self, session):
+		self._cancel_timer(session)
+		session.timer = asyncio.get_event_loop().call_later(self.timeout, self._timeout, session)
+
+	def _cancel_timer(self, session):
+		if session.timer is not None:
+			session.timer.cancel()
+			session.timer = None
+
+	def _timeout(self, session):
+		session.timer = None
+		if session.retries >= self.max_retries:
+			return self._fail(session, "timeout")
+		session.retries += 1
+		self.transport.send(session.last_frame)
+		session.timer = asyncio.get_event_loop().call_later(self.timeout, self._timeout, session)
+
+#### Transports ####
+
+class MonitorSocketTransport():
+	"""Connects the engine to a MonitorSocket and reads frames using the asyncio event loop"""
+	def __init__(self, sock):
+		self.sock = sock
+		self.engine = None
+
+	def attach(self, engine):
+		self.engine = engine
+		asyncio.get_event_loop().add_reader(self.sock.fileno(), self._readable)
+
+	def detach(self):
+		asyncio.get_event_loop().remove_reader(self.sock.fileno())
+
+	def _readable(self):
+		p = self.sock.recv()
+		if p is not None:
+			self.engine.frame_received(p)
+
+	def send(self, frame):
+		self.sock.send(frame)
+
+class LocalTransport():
+	"""Delivers frames in-process to a receive function, e.g. that of a SoftwareSAEAccessPoint"""
+	def __init__(self, receive=None):
+		self.receive = receive
+		self.sent = 0
+
+	def send(self, frame):
+		self.sent += 1
+		asyncio.get_event_loop().call_soon(self.receive, raw(frame))
+
+def random_station_addr():
+	"""Random locally administered unicast MAC address"""
+	addr = bytearray(os.urandom(6))
+	addr[0] = (addr[0] & 0xfc) | 0x02
+	return ":".join("%02x" % b for b in addr)
+
+def sae_stress_test(sock, bssid, password, num_stations, concurrency=256, processes=None, **kwargs):
+	"""Authenticate num_stations spoofed stations with the AP using the given MonitorSocket"""
+	import concurrent.futures
+
+	async def run():
+		with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+			transport = MonitorSocketTransport(sock)
+			engine = SAEEngine(bssid, password, transport, executor=executor, **kwargs)
+			transport.attach(engine)
+			try:
+				await engine.run([random_station_addr() for _ in range(num_stations)], concurrency)
+			finally:
+				transport.detach()
+			return engine.statistics()
+
+	stats = asyncio.get_event_loop().run_until_complete(run())
+	log(STATUS, "Completed %d and failed %d handshakes (%.1f handshakes/s)" % (stats["completed"],
+		stats["failed"], stats["handshakes_per_sec"]))
+	if stats["completed"] > 0:
+		log(STATUS, "Latency: p50 %.1f ms, p90 %.1f ms, p99 %.1f ms" % (stats["p50_ms"], stats["p90_ms"],
+			stats["p99_ms"]))
+	return stats
+
+#### Local software AP stand-in ####
+
+class SoftwareSAEAccessPoint():
+	"""
+	Minimal AP side of SAE that can be used to test the engine without a radio. It can require
+	anti-clogging tokens and drop the first commits of each station to test retransmissions.
+	"""
+	def __init__(self, bssid, password, transport, group_id=19, ssid=None, identifier=None,
+	             require_token=False, drop_commits=0):
+		# Scapy returns lowercase addresses, so use these as well
+		self.bssid = bssid.lower()
+		self.password = password
+		self.transport = transport
+		self.curve = get_curve(group_id)
+		self.ssid = ssid
+		self.identifier = identifier
+		self.require_token = require_token
+		self.drop_commits = drop_commits
+		self.status = SAE_STATUS_HASH_TO_ELEMENT if ssid is not None else SAE_STATUS_SUCCESS
+		self.hashmod = sae_hash(self.curve, ssid is not None)
+
+		self.token_key = os.urandom(16)
+		self.pwe_cache = PweCache(maxsize=1024, window=0)
+		self.peers = dict()
+		self.dropped = dict()
+		self.accepted = dict()
+
+	def receive(self, frame):
+		p = Dot11(frame)
+		if p.addr1 != self.bssid or not is_sae(p):
+			return
+		if is_sae_commit(p):
+			self._process_commit(p.addr2, p[Dot11Auth])
+		elif is_sae_confirm(p):
+			self._process_confirm(p.addr2, p[Dot11Auth])
+
+	def _process_commit(self, stamac, auth):
+		if self.dropped.get(stamac, 0) < self.drop_commits:
+			self.dropped[stamac] = self.dropped.get(stamac, 0) + 1
+			return
+
+		group_id, token, scalar, x, y, _ = parse_sae_commit(raw(auth.payload), auth.status)
+		expected_token = HMAC256(self.token_key, addr2bin(stamac))
+		if self.require_token and token != expected_token:
+			payload = struct.pack("<H", group_id)
+			if self.status == SAE_STATUS_HASH_TO_ELEMENT:
+				payload += struct.pack("BBB", WLAN_EID_EXTENSION, 1 + len(expected_token), WLAN_EID_EXT_ANTI_CLOGGING_TOKEN)
+			reply = Dot11(addr1=stamac, addr2=self.bssid, addr3=self.bssid)
+			reply = reply/Dot11Auth(algo=3, seqnum=1, status=SAE_STATUS_ANTI_CLOGGING_TOKEN_REQUIRED)
+			self.transport.send(reply/Raw(payload + expected_token))
+			return
+
+		# Retransmitted commits are answered with the same commit
+		if stamac in self.peers:
+			self.transport.send(self.peers[stamac]["commit"])
+			return
+
+		pwe, table = self.pwe_cache.get(self.password, stamac, self.bssid, self.curve, self.ssid, self.identifier)
+		rand, my_scalar, my_element = sae_commit_values(pwe, self.curve, table)
+		peer_element = ECC.EccPoint(x, y, self.curve.name)
+		k, kck, pmk = calc_k_kck_pmk(pwe, peer_element, scalar, rand, my_scalar, self.curve, table, self.hashmod)
+
+		identifier = self.identifier if self.ssid is not None else None
+		commit = build_sae_commit(self.bssid, stamac, my_scalar, my_element, status=self.status,
+		                          identifier=identifier, group_id=self.curve.group)
+		self.peers[stamac] = {"commit": commit, "scalar": my_scalar, "element": my_element,
+		                      "peer_scalar": scalar, "peer_element": peer_element, "kck": kck, "pmk": pmk}
+		self.transport.send(commit)
+
+	def _process_confirm(self, stamac, auth):
+		peer = self.peers.get(stamac)
+		if peer is None:
+			return
+
+		send_confirm, confirm = parse_sae_confirm(raw(auth.payload), self.hashmod.digest_size)
+		expected = calculate_confirm_hash(peer["kck"], send_confirm, peer["peer_scalar"], peer["peer_element"],
+		                                  peer["scalar"], peer["element"], self.curve, self.hashmod)
+		if confirm != expected:
+			return
+
+		confirm = calculate_confirm_hash(peer["kck"], send_confirm, peer["scalar"], peer["element"],
+		                                 peer["peer_scalar"], peer["peer_element"], self.curve, self.hashmod)
+		self.accepted[stamac] = peer["pmk"]
+		self.transport.send(build_sae_confirm(self.bssid, stamac, send_confirm, confirm))
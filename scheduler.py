@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Send frames at precise moments. Frames are kept in a heap ordered by deadline, the scheduler
+# sleeps until shortly before the deadline and then busy-waits, and the jitter of recently sent
+# frames is recorded so it can be inspected.
+import collections, heapq, itertools, time
+
+class TokenBucket():
+	"""Allows rate frames per second on average, with bursts of at most burst frames"""
+	def __init__(self, rate, burst=1, clock=time.perf_counter):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.last = clock()
+
+	def delay(self, now):
+		"""Returns how long to wait before a token is available at the given time"""
+		self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+		self.last = now
+		if self.tokens >= 1:
+			return 0
+		return (1 - self.tokens) / self.rate
+
+	def take(self):
+		self.tokens -= 1
+
+class ScheduledFrame():
+	__slots__ = ["frame", "deadline", "sent", "jitter"]
+
+	def __init__(self, frame, deadline):
+		self.frame = frame
+		self.deadline = deadline
+		# Time the frame was sent and how late that was, filled in when sending
+		self.sent = None
+		self.jitter = None
+
+	def __repr__(self):
+		return "ScheduledFrame(deadline=%.6f, jitter=%s)" % (self.deadline, self.jitter)
+
+class InjectionScheduler():
+	"""
+	Sends frames on the given socket at their deadline, which are values of clock.
+	The scheduler sleeps until spin seconds before a deadline and busy-waits for the remainder,
+	which gives sub-millisecond accuracy. When rate is given at most rate frames per second are
+	sent, with bursts of at most burst frames, and frames are delayed when needed. The jitter of
+	the last history frames is kept. Another clock and sleep function can be given for testing.
+	"""
+	def __init__(self, sock, rate=None, burst=1, spin=0.002, send=None, history=4096,
+	             clock=time.perf_counter, sleep=time.sleep):
+		self.sock = sock
+		self.send = send if send is not None else sock.send
+		self.clock = clock
+		self.sleep = sleep
+		self.bucket = TokenBucket(rate, burst, clock) if rate is not None else None
+		self.spin = spin
+		self.queue = []
+		self.counter = itertools.count()
+		self.last_deadline = None
+		# Jitter of the most recently sent frames
+		self.jitter = collections.deque(maxlen=history)
+
+	def schedule(self, frame, at=None, delay=None, gap=None):
+		"""
+		Schedule a frame at an absolute time, after a delay relative to now, or gap seconds after
+		the previously scheduled frame. Without any of these the frame is sent as soon as possible.
+		"""
+		now = self.clock()
+		if at is not None:
+			deadline = at
+		elif delay is not None:
+			deadline = now + delay
+		elif gap is not None and self.last_deadline is not None:
+			deadline = max(self.last_deadline + gap, now)
+		else:
+			deadline = now
+		entry = ScheduledFrame(frame, deadline)
+		heapq.heappush(self.queue, (deadline, next(self.counter), entry))
+		self.last_deadline = deadline
+		return entry
+
+	def schedule_train(self, frames, gap=0, delay=0):
+		"""Schedule frames, such as fragments, with a fixed spacing between them"""
+		entries = [self.schedule(frames[0], delay=delay)]
+		for frame in frames[1:]:
+			entries.append(self.schedule(frame, gap=gap))
+		return entries
+
+	def _wait_until(self, deadline):
+		remaining = deadline - self.clock()
+		if remaining > self.spin:
+			self.sleep(remaining - self.spin)
+		while self.clock() < deadline:
+			pass
+
+	def run_once(self):
+		"""Send the next frame at its deadline. Returns the ScheduledFrame, or None if nothing is queued."""
+		if len(self.queue) == 0:
+			return None
+		deadline, _, entry = heapq.heappop(self.queue)
+		self._wait_until(deadline)
+		if self.bucket is not None:
+			wait = self.bucket.delay(self.clock())
+			if wait > 0:
+				self._wait_until(self.clock() + wait)
+			self.bucket.take()
+
+		self.send(entry.frame)
+		entry.sent = self.clock()
+		entry.jitter = entry.sent - deadline
+		self.jitter.append(entry.jitter)
+		return entry
+
+	def run(self):
+		"""Send all queued frames. Returns the ScheduledFrames in the order they were sent."""
+		sent = []
+		while len(self.queue) > 0:
+			sent.append(self.run_once())
+		return sent
+
+	def jitter_stats(self):
+		"""Returns the (mean, maximum, 99th percentile) jitter of recently sent frames in seconds"""
+		jitter = sorted(self.jitter)
+		if len(jitter) == 0:
+			return None
+		return sum(jitter) / len(jitter), jitter[-1], jitter[min(len(jitter) - 1, int(len(jitter) * 0.99))]
+
+	def __len__(self):
+		return len(self.queue)
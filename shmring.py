@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Hand raw frames to worker processes through a ring buffer in shared memory. This avoids
+# pickling packets, and workers read frames in place through memoryviews.
+from .wifi import *
+import multiprocessing, os, time
+from multiprocessing import shared_memory, resource_tracker
+
+# Every slot starts with: publish marker, release marker, timestamp, length, and metadata
+SHMRING_SLOT_HEADER = struct.Struct("<QQdII")
+SHMRING_SLOT_INFO = struct.Struct("<dII")
+# Metadata value of the frame that tells a ring_worker to exit
+SHMRING_STOP = 0xFFFFFFFF
+
+class RingRecord():
+	"""
+	A frame that was taken from a SharedRing. The data is a memoryview into shared memory that is
+	only valid until release() is called. Can be used as a context manager that releases it.
+	"""
+	__slots__ = ["ring", "index", "ts", "meta", "data"]
+
+	def __init__(self, ring, index, ts, meta, data):
+		self.ring = ring
+		self.index = index
+		self.ts = ts
+		self.meta = meta
+		self.data = data
+
+	def release(self):
+		if self.data is not None:
+			self.data.release()
+			self.data = None
+			self.ring._release(self.index)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+
+class SharedRing():
+	"""
+	Ring buffer of num_slots frames of at most slot_size bytes in shared memory. Several processes
+	can put and get frames: a lock serializes claiming a slot, while copying frames in and out
+	happens without holding it. A slot can only be reused once the record that was read from it
+	was released. Pass the ring as an argument to a multiprocessing.Process to share it.
+	"""
+	def __init__(self, num_slots=4096, slot_size=2048):
+		self.num_slots = num_slots
+		self.slot_size = slot_size
+		self.stride = SHMRING_SLOT_HEADER.size + slot_size
+		# The first 16 bytes contain the write and read index
+		self.shm = shared_memory.SharedMemory(create=True, size=16 + num_slots * self.stride)
+		self.shm.buf[:16] = b"\x00" * 16
+		# Only the creating process unlinks the memory, also when the ring was inherited by a fork
+		self.owner = os.getpid()
+		self.put_lock = multiprocessing.Lock()
+		self.get_lock = multiprocessing.Lock()
+		self.available = multiprocessing.Semaphore(0)
+		self._init_views()
+
+	def _init_views(self):
+		self.buf = self.shm.buf
+		self.indices = self.buf[:16].cast("Q")
+
+	def __getstate__(self):
+		return (self.num_slots, self.slot_size, self.shm.name, self.put_lock, self.get_lock, self.available)
+
+	def __setstate__(self, state):
+		self.num_slots, self.slot_size, name, self.put_lock, self.get_lock, self.available = state
+		self.stride = SHMRING_SLOT_HEADER.size + self.slot_size
+		self.shm = shared_memory.SharedMemory(name=name)
+		# Only the creator must unlink the memory, so don't let the tracker of this process do it
+		resource_tracker.unregister(self.shm._name, "shared_memory")
+		self.owner = None
+		self._init_views()
+
+	def put(self, data, ts=0.0, meta=0):
+		"""Add a frame. Returns False if the ring is full or the frame is too large."""
+		length = len(data)
+		if length > self.slot_size:
+			metrics.count("shmring.dropped.too_large")
+			return False
+
+		with self.put_lock:
+			index = self.indices[0]
+			pos = 16 + (index % self.num_slots) * self.stride
+			# The slot is free when the frame of the previous round was released
+			if index >= self.num_slots and struct.unpack_from("<Q", self.buf, pos + 8)[0] != index - self.num_slots + 1:
+				metrics.count("shmring.dropped.full")
+				return False
+			self.indices[0] = index + 1
+
+		start = pos + SHMRING_SLOT_HEADER.size
+		self.buf[start:start + length] = data
+		SHMRING_SLOT_INFO.pack_into(self.buf, pos + 16, ts, length, meta)
+		# Publish the slot only after the frame was written
+		struct.pack_into("<Q", self.buf, pos, index + 1)
+		self.available.release()
+		return True
+
+	def get(self, timeout=None):
+		"""Returns the next RingRecord, or None when no frame arrived within timeout seconds"""
+		if not self.available.acquire(timeout=timeout):
+			return None
+		with self.get_lock:
+			index = self.indices[1]
+			self.indices[1] = index + 1
+
+		pos = 16 + (index % self.num_slots) * self.stride
+		# With several producers the semaphore can be signalled before this slot was published
+		while True:
+			published, _, ts, length, meta = SHMRING_SLOT_HEADER.unpack_from(self.buf, pos)
+			if published == index + 1:
+				break
+			time.sleep(0)
+		start = pos + SHMRING_SLOT_HEADER.size
+		return RingRecord(self, index, ts, meta, self.buf[start:start + length])
+
+	def _release(self, index):
+		pos = 16 + (index % self.num_slots) * self.stride
+		struct.pack_into("<Q", self.buf, pos + 8, index + 1)
+
+	def __len__(self):
+		"""Number of frames that were put but not yet taken"""
+		return self.indices[0] - self.indices[1]
+
+	def close(self):
+		self.indices.release()
+		self.buf = self.indices = None
+		self.shm.close()
+		if self.owner == os.getpid():
+			self.shm.unlink()
+
+def capture_to_ring(sock, ring, count=None, timeout=None):
+	"""Put the raw frames received on a socket, e.g. a MonitorSocket, in the ring. Returns the number captured."""
+	num = 0
+	end = None if timeout is None else time.time() + timeout
+	while (count is None or num < count) and (end is None or time.time() < end):
+		cls, data, ts = sock.recv_raw(MTU)
+		if not data:
+			continue
+		if ring.put(data, ts if ts else time.time()):
+			num += 1
+	return num
+
+def ring_worker(frames, results, func):
+	"""
+	Process target that calls func(ts, meta, data) for every frame until a frame with meta set
+	to SHMRING_STOP is received. Results that aren't None are put in the results ring.
+	"""
+	while True:
+		with frames.get() as record:
+			if record.meta == SHMRING_STOP:
+				break
+			result = func(record.ts, record.meta, record.data)
+			if result is not None:
+				while not results.put(result, record.ts, record.meta):
+					time.sleep(0.0001)
+	frames.close()
+	results.close()
+
+def stop_ring_workers(frames, num_workers):
+	for i in range(num_workers):
+		while not frames.put(b"", meta=SHMRING_STOP):
+			time.sleep(0.0001)
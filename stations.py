@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Keep statistics of every station that is seen while capturing. Records are updated in constant
+# time per frame from the raw header bytes, so this can run on all traffic of a busy channel.
+from .wifi import *
+import collections, threading, time
+
+class StationRecord():
+	"""Counters and recent state of one MAC address"""
+	__slots__ = ["addr", "bssid", "tx_frames", "tx_bytes", "rx_frames", "rx_bytes", "tid_frames", "retries",
+	             "rssi", "last_pn", "last_seq", "power_save", "first_seen", "last_seen"]
+
+	def __init__(self, addr, ts):
+		self.addr = addr
+		self.bssid = None
+		self.tx_frames = self.tx_bytes = 0
+		self.rx_frames = self.rx_bytes = 0
+		# Number of transmitted QoS data frames per TID, created when the first one is seen
+		self.tid_frames = None
+		self.retries = 0
+		# Exponentially weighted moving average of the signal strength in dBm
+		self.rssi = None
+		self.last_pn = None
+		self.last_seq = None
+		self.power_save = False
+		self.first_seen = self.last_seen = ts
+
+	@property
+	def retry_ratio(self):
+		return self.retries / self.tx_frames if self.tx_frames > 0 else 0.0
+
+	def to_dict(self):
+		d = {name: getattr(self, name) for name in StationRecord.__slots__}
+		d["addr"] = bin2addr(self.addr)
+		d["bssid"] = bin2addr(self.bssid) if self.bssid is not None else None
+		d["tid_frames"] = list(self.tid_frames) if self.tid_frames is not None else None
+		d["retry_ratio"] = self.retry_ratio
+		return d
+
+	def __repr__(self):
+		return "StationRecord(%s, tx=%d, rx=%d, rssi=%s)" % (bin2addr(self.addr), self.tx_frames, self.rx_frames, self.rssi)
+
+class StationTable():
+	"""
+	Table of at most max_stations records, keyed by the MAC address as bytes. Stations that sent
+	or received nothing for idle_timeout seconds are evicted. When snapshot_interval is given,
+	callback is called with a snapshot every snapshot_interval seconds of capture time.
+	"""
+	def __init__(self, max_stations=4096, idle_timeout=300, alpha=0.25, snapshot_interval=None, callback=None):
+		self.max_stations = max_stations
+		self.idle_timeout = idle_timeout
+		self.alpha = alpha
+		self.snapshot_interval = snapshot_interval
+		self.callback = callback
+		self.last_snapshot = None
+		# Ordered from least to most recently seen, so idle stations are at the front
+		self.stations = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def _get(self, addr, ts):
+		station = self.stations.get(addr)
+		if station is None:
+			station = StationRecord(addr, ts)
+			self.stations[addr] = station
+			if len(self.stations) > self.max_stations:
+				self.stations.popitem(last=False)
+		else:
+			self.stations.move_to_end(addr)
+		station.last_seen = ts
+		return station
+
+	def update(self, data, offset=0, ts=None, rssi=None):
+		"""Account a frame given as the raw 802.11 header at the given offset"""
+		if len(data) < offset + 10:
+			return
+		ts = time.time() if ts is None else ts
+		fc0, fc1 = data[offset], data[offset + 1]
+		length = len(data) - offset
+		ra = bytes(data[offset + 4:offset + 10])
+
+		with self.lock:
+			# Multicast receivers are not stations
+			if ra[0] & 1 == 0:
+				receiver = self._get(ra, ts)
+				receiver.rx_frames += 1
+				receiver.rx_bytes += length
+
+			# Most control frames, such as ACKs, have no transmitter address
+			if len(data) >= offset + 16:
+				self._update_transmitter(data, offset, fc0, fc1, length, ts, rssi)
+			self._evict(ts)
+
+		if self.snapshot_interval is not None:
+			if self.last_snapshot is None:
+				self.last_snapshot = ts
+			elif ts - self.last_snapshot >= self.snapshot_interval:
+				self.last_snapshot = ts
+				self.callback(self.snapshot())
+
+	def _update_transmitter(self, data, offset, fc0, fc1, length, ts, rssi):
+		station = self._get(bytes(data[offset + 10:offset + 16]), ts)
+		station.tx_frames += 1
+		station.tx_bytes += length
+		if fc1 & 0x08:
+			station.retries += 1
+		if rssi is not None:
+			station.rssi = rssi if station.rssi is None else station.rssi + self.alpha * (rssi - station.rssi)
+
+		frame_type = fc0 & 0x0C
+		if frame_type == 0x04:
+			# PS-Poll frames are only sent by sleeping stations
+			if fc0 & 0xF0 == 0xA0:
+				station.power_save = True
+			return
+		if len(data) < offset + 24:
+			return
+		station.power_save = fc1 & 0x10 != 0
+		station.last_seq = (data[offset + 22] | (data[offset + 23] << 8)) >> 4
+
+		# The BSSID depends on the To DS and From DS flags
+		ds = fc1 & 0x03
+		if ds == 0:
+			station.bssid = bytes(data[offset + 16:offset + 22])
+		elif ds == 1:
+			station.bssid = bytes(data[offset + 4:offset + 10])
+		elif ds == 2:
+			station.bssid = station.addr
+
+		if frame_type == 0x08:
+			if fc0 & 0x80 and len(data) >= offset + raw_dot11_hdrlen(data, offset):
+				if station.tid_frames is None:
+					station.tid_frames = [0] * 16
+				station.tid_frames[data[offset + (30 if ds == 3 else 24)] & 0x0F] += 1
+			if fc1 & 0x40:
+				pn = raw_ccmp_pn(data, offset)
+				if pn is not None:
+					station.last_pn = pn
+
+	def update_raw(self, linktype, data, ts=None):
+		"""Account a frame given as bytes, e.g. a record of MmapPcapReader"""
+		offset = raw_dot11_offset(linktype, data)
+		if offset is None:
+			return
+		rssi = radiotap_antsignal(data) if linktype == DLT_IEEE802_11_RADIO else None
+		self.update(data, offset, ts, rssi)
+
+	def update_packet(self, p):
+		"""Account a scapy frame that starts with a RadioTap or Dot11 header"""
+		linktype = DLT_IEEE802_11_RADIO if RadioTap in p else DLT_IEEE802_11
+		self.update_raw(linktype, raw(p), float(p.time))
+
+	def _evict(self, now):
+		stations = self.stations
+		while len(stations) > 0:
+			station = next(iter(stations.values()))
+			if station.last_seen >= now - self.idle_timeout:
+				break
+			stations.popitem(last=False)
+
+	def get(self, addr):
+		return self.stations.get(addr2bin(addr) if isinstance(addr, str) else addr)
+
+	def snapshot(self):
+		"""Returns a dict with the statistics of all stations. Can be called while capturing."""
+		with self.lock:
+			return {bin2addr(addr): station.to_dict() for addr, station in self.stations.items()}
+
+	def __len__(self):
+		return len(self.stations)
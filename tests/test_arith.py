@@ -0,0 +1,59 @@
+from libwifi import arith
+from libwifi.dragonfly import get_curve, derive_pwe_ecc, derive_pwe_ecc_eappwd
+import random
+
+# PWEs of "password" for the groups 19, 20, and 21, and of EAP-pwd with group 19, computed with a separate
+# implementation of hunting-and-pecking that only uses hashlib and pow.
+KNOWN_PWES = [
+	(0xb3782afd596fb9424bdf46cb8af7093ae45d6839b27d0ea4c8114bc1b00bb91f,
+	 0xab1b247e6c4c7bdd50bc2e8a34d143850036d1ea8bc04cf37944a33a4e72ed87),
+	(0xb47ff5365c4d6f7b9b84b96ea0d05379343e43b723b6f79ddcf0881e8e16cb2546c6cf27991d9372c71c28aae90d2886,
+	 0x491c9c54376d15aefc728a1f1d33e006967582b1a9e7e5d20388a528274cc319932114ea2af5259880d90c2f5cd4e556),
+	(0x12f6990c1f1ec7ac384592d3875bca747967be6101aa0deac7ff3ff59a49c689e7774377b738ea2434ccf2e017065f874fafbc5d0412b395523ea459c3ebbe17f9f,
+	 0x1032ceb89f59853b1e2fb1a934230ad0ccad83d69301a2ff0eed565b84af8397f883ed4301189fb3f45f075b556dea8294f6858d5bc9aeab2c4b33650f27be99566),
+	(0x48757819c861241ea2a8e353e44fbcaa2fe689e7ecab4bb17b99b8c721166e76,
+	 0x9182a63c9491850d72cabf272a6ff5bf1e01407c0295947367e3267b9060d2e4),
+]
+
+def available_backends():
+	return ["python"] + (["gmpy2"] if arith.gmpy2 is not None else [])
+
+def test_arith():
+	rng = random.Random(1)
+	previous = arith.backend
+	for backend in available_backends():
+		arith.set_backend(backend)
+		assert arith.jacobi(2, 15) == 1 and arith.jacobi(7, 15) == -1 and arith.jacobi(5, 15) == 0
+		for group in [19, 20, 21]:
+			p = get_curve(group).p
+			for i in range(50):
+				a = rng.randrange(1, p)
+				euler = pow(a, (p - 1) // 2, p)
+				assert arith.jacobi(a, p) == (1 if euler == 1 else -1)
+				if euler == 1:
+					assert pow(arith.sqrt_3mod4(a, p), 2, p) == a
+			assert arith.jacobi(0, p) == 0 and arith.jacobi(p, p) == 0
+	arith.set_backend(previous)
+
+	try:
+		arith.set_backend("unknown")
+		assert False
+	except ValueError:
+		pass
+
+def test_arith_pwe():
+	sta, ap = "02:00:00:00:00:01", "02:00:00:00:00:02"
+	reference = None
+	previous = arith.backend
+	for backend in available_backends():
+		arith.set_backend(backend)
+		pwes = [derive_pwe_ecc("password%d" % i, sta, ap, curve) for curve in ["p256", "p384", "p521"] for i in range(3)]
+		pwes.append(derive_pwe_ecc_eappwd("password", "user", "server", 2546484939))
+		pwes = [(int(pwe.x), int(pwe.y)) for pwe in pwes]
+		assert reference is None or pwes == reference
+		reference = pwes
+
+		known = [derive_pwe_ecc("password", sta, ap, curve) for curve in ["p256", "p384", "p521"]]
+		known.append(derive_pwe_ecc_eappwd("password", "user", "server", 2546484939))
+		assert [(int(pwe.x), int(pwe.y)) for pwe in known] == KNOWN_PWES
+	arith.set_backend(previous)
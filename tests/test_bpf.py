@@ -0,0 +1,78 @@
+from libwifi.bpf import Dot11Filter
+from scapy.layers.dot11 import RadioTap, Dot11, Dot11Beacon, Dot11QoS
+from scapy.packet import Raw, raw
+import socket, struct
+
+AP, STA = "00:11:22:33:44:55", "02:00:00:00:00:01"
+
+def run_bpf(prog, data):
+	"""Minimal classic BPF interpreter for the instructions used by Dot11Filter"""
+	A = X = pc = 0
+	while True:
+		code, jt, jf, k = prog[pc]
+		pc += 1
+		cls, size, mode = code & 0x07, code & 0x18, code & 0xe0
+		if cls == 0x00:
+			pos = k + (X if mode == 0x40 else 0)
+			num = {0x00: 4, 0x08: 2, 0x10: 1}[size]
+			if pos + num > len(data):
+				return 0
+			A = int.from_bytes(data[pos:pos + num], "big")
+		elif cls == 0x01:
+			X = k
+		elif cls == 0x04:
+			operand = X if code & 0x08 else k
+			A = {0x40: A | operand, 0x50: A & operand, 0x60: A << operand}[code & 0xf0] & 0xffffffff
+		elif cls == 0x05:
+			pc += jt if A == k else jf
+		elif cls == 0x06:
+			return k
+		elif cls == 0x07:
+			X = A
+
+def test_dot11_filter():
+	beacon = raw(RadioTap()/Dot11(type=0, subtype=8, addr1="ff:ff:ff:ff:ff:ff", addr2=AP, addr3=AP)/Dot11Beacon())
+	qos = raw(RadioTap(present="TSFT+Flags")/Dot11(type=2, subtype=8, FCfield="protected", addr1=AP, addr2=STA, addr3=AP)/Dot11QoS()/Raw(b"label"))
+	data = raw(RadioTap()/Dot11(type=2, addr1=STA, addr2=AP, addr3=AP)/Raw(b"label"))
+	frames = [beacon, qos, data]
+
+	filters = [(Dot11Filter().frame_type(0, 8), [beacon]),
+	           (Dot11Filter().frame_type(2), [qos, data]),
+	           (Dot11Filter().frame_type(0, 8).qos(), [beacon, qos]),
+	           (Dot11Filter().addr2(AP), [beacon, data]),
+	           (Dot11Filter().addr1(AP).addr3(AP), [qos]),
+	           (Dot11Filter().protected(), [qos]),
+	           (Dot11Filter().protected(False).frame_type(2), [data]),
+	           (Dot11Filter().contains(b"label"), [qos, data])]
+	for flt, expected in filters:
+		assert [frame for frame in frames if flt.match(frame)] == expected
+		assert [frame for frame in frames if flt.match(memoryview(frame))] == expected
+		if flt.kernel_complete():
+			assert [frame for frame in frames if run_bpf(flt.compile(), frame)] == expected
+
+	flt = Dot11Filter(radiotap=False).addr2(STA)
+	assert run_bpf(flt.compile(), raw(Dot11(addr2=STA))) and not run_bpf(flt.compile(), raw(Dot11(addr2=AP)))
+	assert not flt.match(b"") and not Dot11Filter().frame_type(0).match(b"\x00\x00\x08")
+
+def test_attach_filter():
+	sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+	beacon = raw(RadioTap()/Dot11(type=0, subtype=8, addr2=AP)/Dot11Beacon())
+	data = raw(RadioTap()/Dot11(type=2, addr2=AP))
+	try:
+		Dot11Filter().frame_type(0, 8).addr2(AP).attach(receiver)
+		for frame in [data, beacon, data]:
+			sender.send(frame)
+		receiver.settimeout(0.5)
+		assert receiver.recv(4096) == beacon
+		receiver.setblocking(False)
+		try:
+			receiver.recv(4096)
+			assert False, "frame was not filtered"
+		except BlockingIOError:
+			pass
+		Dot11Filter.detach(receiver)
+		sender.send(data)
+		assert receiver.recv(4096) == data
+	finally:
+		sender.close()
+		receiver.close()
@@ -0,0 +1,66 @@
+from libwifi.capture import CaptureMux
+from libwifi.bpf import Dot11Filter
+from libwifi.wifi import MonitorSocket, monitor_filter, radiotap_tsft
+from scapy.layers.dot11 import RadioTap, Dot11
+from scapy.packet import Raw, raw
+from scapy.supersocket import SimpleSocket
+import socket, time
+
+AP = "00:11:22:33:44:55"
+
+class PairMonitorSocket(MonitorSocket):
+	"""MonitorSocket that reads RadioTap frames from a socketpair instead of an interface"""
+	def __init__(self, sock, detect_injected=False):
+		SimpleSocket.__init__(self, sock)
+		self.detect_injected = detect_injected
+		self.filter = self.raw_filter = self.dup_filter = None
+
+	def recv_raw(self, x):
+		return RadioTap, self.ins.recv(x), None
+
+def test_capture_mux():
+	pairs = {iface: socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for iface in ["wlan0", "wlan1"]}
+	mux = CaptureMux({"wlan0": PairMonitorSocket(pairs["wlan0"][0], detect_injected=True),
+	                  "wlan1": SimpleSocket(pairs["wlan1"][0])}, queue_size=2)
+	def frame(i, fcs=False):
+		p = RadioTap(present="TSFT+Flags", mac_timestamp=1000 + i, Flags="FCS" if fcs else 0)
+		p = p/Dot11(type=2, addr1=AP, addr2="02:00:00:00:00:01", addr3=AP, SC=i << 4)/Raw(b"data")
+		return raw(p) + (b"\x00" * 4 if fcs else b"")
+	assert radiotap_tsft(frame(5)) == 1005
+
+	# The second radio also receives frame 1, with an FCS, which is a duplicate. Our own injected
+	# frames and reflections of them are dropped by the MonitorSocket.
+	injected = RadioTap(present="TSFT+Flags")/Dot11(type=2, FCfield="MD", addr1=AP)
+	pairs["wlan0"][1].send(raw(injected))
+	pairs["wlan0"][1].send(raw(RadioTap()/Dot11(type=2, addr1=AP)))
+	pairs["wlan0"][1].send(frame(1))
+	assert mux.poll() == 3 and mux.stats["wlan0"].received == 1
+	pairs["wlan1"][1].send(frame(1, fcs=True))
+	pairs["wlan1"][1].send(frame(2))
+	mux.poll()
+	for i in [3, 4, 5]:
+		pairs["wlan1"][1].send(frame(i))
+		mux.poll()
+	assert mux.stats["wlan1"].duplicates == 1 and mux.stats["wlan1"].dropped == 2
+	assert mux.backlog() == 1.0
+
+	frames = [mux.recv(timeout=0.5) for i in range(3)]
+	assert [(f.iface, f.tsft) for f in frames] == [("wlan0", 1001), ("wlan1", 1002), ("wlan1", 1003)]
+	assert frames[0].packet()[Dot11].SC == 1 << 4
+	assert mux.recv(timeout=0.05) is None
+
+	# Frames of a lagging interface are merged in timestamp order
+	mux.start()
+	pairs["wlan1"][1].send(frame(6))
+	time.sleep(0.002)
+	pairs["wlan0"][1].send(frame(7))
+	assert [mux.recv(timeout=1).tsft for i in range(2)] == [1006, 1007]
+	mux.close()
+
+def test_monitor_filter():
+	sock = PairMonitorSocket(socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)[0])
+	beacons, data = Dot11Filter().frame_type(0, 8), Dot11Filter().frame_type(2)
+	sock.set_filter(beacons)
+	with monitor_filter(sock, data):
+		assert sock.filter is data
+	assert sock.filter is beacons
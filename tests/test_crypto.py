@@ -6,6 +6,29 @@ def get_ciphertext_mic(encrypted):
 	mic = dot11ccmp.payload.load
 	return ciphertext, mic
 
+def test_prf_sha1():
+	assert prf_sha1(b"\x0b" * 20, b"prefix", b"Hi There", 64) == bytes.fromhex("bcd4c650b30b9684951829e0d75f9d54"
+		"b862175ed9f00606e17d8da35402ffee75df78c3d31e0f889f012120c0862beb67753e7439ae242edb8373698356cf5a")
+
+def test_pmk(tmp_path):
+	pmk = bytes.fromhex("f42c6fc52df0ebef9ebb4b90b38a5f902e83fe1b135a70e23aed762e9710a12e")
+	assert derive_pmk("password", "IEEE") == pmk
+
+	cache = PmkCache(maxsize=2, filename=str(tmp_path / "pmks"))
+	networks = [("IEEE", "password"), ("lab", "passphrase1"), ("IEEE", "password")]
+	pmks = cache.get_many(networks, processes=2)
+	assert pmks[0] == pmks[2] == pmk and pmks[1] == derive_pmk("passphrase1", "lab")
+	cache.close()
+
+	# PMKs are loaded from disk, and the disk doesn't contain the passphrases
+	cache = PmkCache(filename=str(tmp_path / "pmks"))
+	assert cache.lookup("IEEE", "password") == pmk and cache.lookup("IEEE", "other") is None
+	cache.close()
+
+	keystore = KeyStore(pmk_cache=cache)
+	keystore.add_networks([("IEEE", "password", ["00:11:22:33:44:55", "00:11:22:33:44:66"])], processes=1)
+	assert keystore.get_pmk("00:11:22:33:44:66") == pmk and keystore.get_pmk("00:00:00:00:00:00") is None
+
 def test_ccmp():
 	payload = b"A" * 16
 	ptk = b'\x00' * 48
@@ -39,3 +62,17 @@ def test_ccmp():
 	assert ciphertext == bytes.fromhex("ff76206822afb77decc7ee87568a02c6")
 	assert mic == bytes.fromhex("8d6fd7578170ecb1")
 
+
+def test_amsdu():
+	tk = b"\x01" * 16
+	header = Dot11(type="Data", subtype=8, FCfield="from-DS", addr1="11:11:11:11:11:11",
+	               addr2="22:22:22:22:22:22", addr3="33:33:33:33:33:33")/Dot11QoS(TID=3)
+	msdus = [("11:11:11:11:11:11", "33:33:33:33:33:33", LLC()/SNAP()/conf.raw_layer(b"A" * 5)),
+	         ("11:11:11:11:11:11", "44:44:44:44:44:44", b"\xaa\xaa\x03\x00\x00\x00\x08\x00" + b"B" * 20)]
+	encrypted = encrypt_ccmp(create_amsdu(header, msdus), tk, 1)
+	decrypted = decrypt_ccmp(Dot11(raw(encrypted)), tk)
+	assert decrypted[Dot11QoS].A_MSDU_Present == 1 and LLC not in decrypted
+
+	subframes = list(amsdu_subframes(decrypted[Dot11QoS].load))
+	assert [(bytes(da), bytes(sa), bytes(msdu)) for da, sa, msdu in subframes] == \
+	       [(addr2bin(da), addr2bin(sa), raw(msdu)) for da, sa, msdu in msdus]
@@ -1,4 +1,6 @@
 from libwifi import *
+import libwifi.dragonfly
+import hmac, hashlib
 
 def test_crypto():
 	x = 32774075109236952337158599048510140249162039589740847669274255820096074575478
@@ -6,6 +8,10 @@ def test_crypto():
 	assert point_on_curve(x, y)
 	assert not point_on_curve(x, y + 1)
 
+	for key in [b"", b"\x00", b"key", b"k" * 64, b"k" * 100]:
+		prf = HmacPrf(key)
+		for data in [b"", b"The quick brown fox", b"d" * 200]:
+			assert prf(data) == HMAC256(prf, data) == hmac.new(key, data, hashlib.sha256).digest()
 
 def test_sae():
 	# KDF_Length with 256 bits
@@ -81,3 +87,209 @@ def test_eappwd():
 	assert pwe.x == 3008622341264366589487649162226557348235630833654679745848438214237061388319208914517686003128943873854271397962689455307621303688693893126759626682265352869
 	assert pwe.y == 649775647643090676911381912723346979966421674682002310678312738784243727860456911539411456724737204490685667258758093054491548052506429972664016924839683943
 
+
+
+def test_sae_h2e():
+	derive_pt_h2e.cache_clear()
+	pt = derive_pt_h2e("byteme", "mekmitasdigoat", "psk4internet")
+	assert point_on_curve(pt.x, pt.y)
+	assert pt.x == 0xb6e38c98750c684b5d17c3d8c9a4100b39931279187ca6cced5f37ef46ddfa97
+	assert pt.y == 0x5687e972e50f73e3898861e7edad21bea7d5f622df88243bb804920ae8e647fa
+	assert derive_pt_h2e("byteme", "mekmitasdigoat", "psk4internet") is pt
+	assert derive_pt_h2e.cache_info().hits == 1
+
+	# Known answer of the PWE between 00:09:5b:66:ec:1e and 00:0b:6b:d9:02:46
+	pwe = derive_pwe_h2e(pt, "00:09:5b:66:ec:1e", "00:0b:6b:d9:02:46")
+	assert pwe.x == 0xc93049b9e64000f848201649e999f2b5c22dea69b5632c9df4d633b8aa1f6c1e
+	assert pwe.y == 0x73634e94b53d82e7383a8d258199d9dc1a5ee8269d060382ccbf33e614ff59a0
+
+	# The PWE is bound to the MAC addresses but not to their order
+	pwe = derive_pwe_h2e(pt, "01:02:03:04:05:06", "11:22:33:44:55:66")
+	assert pwe == derive_pwe_h2e(pt, "11:22:33:44:55:66", "01:02:03:04:05:06")
+	assert pwe != derive_pwe_h2e(pt, "01:02:03:04:05:07", "11:22:33:44:55:66")
+	assert derive_pt_h2e("byteme", "mekmitasdigoat") != pt
+
+	for curve_name in ["p384", "p521"]:
+		pt = derive_pt_h2e("byteme", "mekmitasdigoat", curve_name=curve_name)
+		assert ECC.EccPoint(pt.x, pt.y, curve_name) == pt
+
+	commit = build_sae_commit("01:02:03:04:05:06", "11:22:33:44:55:66", 5, pwe, token=b"T" * 4,
+	                          status=SAE_STATUS_HASH_TO_ELEMENT, identifier="psk4internet")
+	payload = raw(commit[Dot11Auth].payload)
+	assert commit[Dot11Auth].status == 126
+	assert payload[2:34] == int_to_data(5)
+	assert payload[34:98] == point_to_data(pwe)
+	assert payload[98:] == b"\xff\x0d\x21psk4internet" + b"\xff\x05\x5dTTTT"
+	assert parse_sae_commit(payload, 126) == (19, b"TTTT", 5, pwe.x, pwe.y, b"psk4internet")
+
+	# Without H2E the identifier is not sent, so the commit can still be parsed
+	commit = build_sae_commit("01:02:03:04:05:06", "11:22:33:44:55:66", 5, pwe, identifier="psk4internet")
+	assert parse_sae_commit(raw(commit[Dot11Auth].payload)) == (19, b"", 5, pwe.x, pwe.y, None)
+
+
+def test_curve_context():
+	curve = get_curve(19)
+	assert curve is get_curve("p256") and get_curve(curve) is curve
+	assert curve.p == secp256r1_p and curve.r == secp256r1_r
+	try:
+		curve.p = 5
+		assert False
+	except AttributeError:
+		pass
+
+	for group, num_bytes in [(19, 32), (20, 48), (21, 66)]:
+		curve = get_curve(group)
+		assert len(curve.int_to_data(curve.p - 1)) == num_bytes
+		assert curve.data_to_int(curve.int_to_data(12345)) == 12345
+		assert curve.legendre(4) == 1 and curve.sqrt(4) in [2, curve.p - 2]
+
+	# SAE with groups 20 and 21 encodes all values using the length of the prime
+	for group, num_bytes in [(20, 48), (21, 66)]:
+		curve = get_curve(group)
+		pwe = derive_pwe_ecc("password", "01:02:03:04:05:06", "11:22:33:44:55:66", curve)
+		assert curve.data_to_point(curve.point_to_data(pwe)) == pwe
+		peer = curve.data_to_point(curve.point_to_data(pwe * 3))
+		k, kck, pmk = calc_k_kck_pmk(pwe, peer, 5, 7, 11, curve)
+		assert k == (pwe * 56).x and len(kck) == 32 and len(pmk) == 32
+		assert len(calculate_confirm_hash(kck, 1, 5, pwe, 11, peer, curve)) == 32
+		commit = build_sae_commit("01:02:03:04:05:06", "11:22:33:44:55:66", 5, pwe, group_id=group)
+		assert len(raw(commit[Dot11Auth].payload)) == 2 + 3 * num_bytes
+
+
+def test_fixed_base():
+	curve = get_curve(19)
+	pwe = derive_pwe_ecc("password", "01:02:03:04:05:06", "11:22:33:44:55:66")
+	table = FixedBaseTable(pwe, curve)
+	for scalar in [1, 2, 15, 16, 12345678901234567890, curve.r - 1]:
+		assert table.multiply(scalar) == pwe * scalar
+
+	element = pwe * 987654321
+	for a, b in [(1, 1), (curve.r - 1, 3), (2**200 + 7, 2**255 + 11)]:
+		expected = pwe * a + element * b
+		assert multi_scalar_mult(pwe, a, element, b, curve) == expected
+		assert multi_scalar_mult(pwe, a, element, b, curve, table) == expected
+
+	assert calc_k_kck_pmk(pwe, element, 5, 7, 11, curve, table) == calc_k_kck_pmk(pwe, element, 5, 7, 11, curve)
+
+	cache = PweCache(maxsize=1)
+	assert cache.get("password", "11:22:33:44:55:66", "01:02:03:04:05:06")[0] == pwe
+	assert cache.get("password", "01:02:03:04:05:06", "11:22:33:44:55:66")[1] is cache.get("password", "11:22:33:44:55:66", "01:02:03:04:05:06")[1]
+
+
+def test_validate_sae_commits():
+	sta, ap, other = "02:00:00:00:00:01", "02:00:00:00:00:02", "02:00:00:00:00:03"
+	pwe = derive_pwe_ecc("password", sta, ap)
+	element = pwe * 1234
+	commit = build_sae_commit(sta, ap, 5678, element)
+	bad_point = Dot11(raw(commit)[:-1] + bytes([raw(commit)[-1] ^ 1]))
+	frames = [commit, raw(commit), build_sae_commit(ap, sta, 5678, element), build_sae_commit(other, ap, 5678, element),
+	          build_sae_commit(sta, ap, 1, element, token=b"token"), bad_point, raw(commit)[:40],
+	          build_sae_confirm(sta, ap, 0, b"\x00" * 32)]
+	results = validate_sae_commits(frames)
+
+	assert len(results) == 7
+	assert results[0].problems == set() and results[0].srcaddr == sta and results[0].scalar == 5678
+	assert results[1].problems == {"retransmitted"}
+	assert results[2].problems == {"reflected"}
+	assert results[3].problems == {"duplicate"}
+	assert results[4].problems == {"scalar-range"} and results[4].token == b"token"
+	assert results[5].problems == {"not-on-curve"}
+	assert results[6].problems == {"malformed"}
+
+	# Only authentication frames are parsed, and the HT control field and FCS are skipped
+	payload = raw(commit[Dot11Auth])
+	data = Dot11(type=2, addr1=ap, addr2=sta, addr3=ap)/Raw(payload)
+	with_htc = raw(commit)[:1] + bytes([raw(commit)[1] | 0x80]) + raw(commit)[2:24] + b"\x00" * 4 + payload
+	with_fcs = RadioTap()/Dot11FCS(subtype=11, addr1=ap, addr2=sta, addr3=ap)/Raw(payload)
+	frames = [Dot11(type=1, subtype=13, addr1=sta), raw(Dot11(type=1, subtype=13, addr1=sta)), data, raw(data),
+	          with_htc, with_fcs]
+	results = validate_sae_commits(frames)
+	assert [result.index for result in results] == [4, 5]
+	assert results[0].problems == set() and results[0].scalar == 5678
+	assert results[1].problems == {"retransmitted"} and results[1].scalar == 5678
+	results = validate_sae_commits([raw(with_fcs[Dot11FCS])], fcs=True)
+	assert len(results) == 1 and results[0].problems == set() and results[0].scalar == 5678
+
+
+def test_sae_templates():
+	sta, ap = "02:00:00:00:00:01", "02:00:00:00:00:02"
+	pwe = derive_pwe_ecc("password", sta, ap)
+	element = pwe * 1234
+
+	template = sae_commit_template(sta, ap)
+	assert template.build(scalar=5678, element=element) == raw(RadioTap()/build_sae_commit(sta, ap, 5678, element))
+	expected = build_sae_commit(ap, ap, 5678, element)
+	expected.SC = 0x10
+	assert template.build(addr2=ap, sc=0x10) == raw(RadioTap()/expected)
+	template = sae_commit_template(sta, ap, token=b"token")
+	assert template.build(scalar=1, element=element) == raw(RadioTap()/build_sae_commit(sta, ap, 1, element, token=b"token"))
+	template = sae_commit_template(sta, ap, token=b"token", status=SAE_STATUS_HASH_TO_ELEMENT, identifier="id")
+	assert template.build(scalar=1, element=element) == raw(RadioTap()/build_sae_commit(sta, ap, 1, element, b"token",
+	                                                                                   SAE_STATUS_HASH_TO_ELEMENT, "id"))
+
+	template = sae_confirm_template(sta, ap)
+	assert template.build(send_confirm=3, confirm=b"\x01" * 32) == raw(RadioTap()/build_sae_confirm(sta, ap, 3, b"\x01" * 32))
+	template.add_marker("payload", b"\x01" * 32)
+	try:
+		template.build(payload=b"\x01")
+		assert False
+	except ValueError:
+		pass
+
+
+def test_sae_handshake(monkeypatch):
+	sent = []
+	monkeypatch.setattr(libwifi.dragonfly, "sendp", sent.append)
+	sta, ap = "02:00:00:00:00:01", "02:00:00:00:00:02"
+	handshake = SAEHandshake("password", sta, ap)
+	handshake.send_commit("password")
+
+	# An anti-clogging token request makes us resend the same commit with the token
+	request = Dot11(addr1=sta, addr2=ap, addr3=ap)/Dot11Auth(algo=3, seqnum=1, status=SAE_STATUS_ANTI_CLOGGING_TOKEN_REQUIRED)
+	handshake.process_commit(request/Raw(struct.pack("<H", 19) + b"token"))
+	assert len(sent) == 2 and handshake.kck is None
+	assert parse_sae_commit(raw(sent[1][Dot11Auth].payload))[:3] == (19, b"token", handshake.scalar)
+
+	peer = SAEHandshake("password", ap, sta, group_id=20)
+	peer.send_commit("password")
+	try:
+		handshake.process_commit(sent[-1])
+		assert False
+	except ValueError:
+		pass
+
+	peer = SAEHandshake("password", ap, sta)
+	peer.send_commit("password")
+	handshake.process_commit(sent[-1])
+	peer.process_commit(sent[1])
+	assert handshake.pmk == peer.pmk
+	assert peer.process_confirm(sent[-2]) and handshake.process_confirm(sent[-1])
+
+
+def test_sae_h2e_group20(monkeypatch):
+	# With H2E, group 20 uses SHA-384 for the keyseed, KCK, and confirm
+	curve = get_curve(20)
+	assert sae_hash(curve, h2e=True) is SHA384 and sae_hash(curve) is SHA256
+	pt = derive_pt_h2e("byteme", "mekmitasdigoat", curve_name="p384")
+	pwe = derive_pwe_h2e(pt, "00:09:5b:66:ec:1e", "00:0b:6b:d9:02:46", curve)
+	assert pwe.x == 0xc7a0cb11669260c40e99a98145a6839859574935296f8d79d11fb0439e7a3fb012494374b6186c183eadef0879071f29
+	assert pwe.y == 0x5ea9fcb3a45a07ab256af366636a84d6064d8ea12f020f2e608306df2ec9e6836a9e6e22bc309299ddcf3d92fd6a97e8
+
+	peer = pwe * 99
+	k, kck, pmk = calc_k_kck_pmk(pwe, peer, 5, 7, 11, curve, hashmod=SHA384)
+	assert kck == bytes.fromhex("1a07adf389107ce394a30806a9038495221baa010dc425aeb30584282beceaf2360170f2734126164b4776c48d3535ef")
+	assert pmk == bytes.fromhex("346cb35512ef7ac3007d571ec24186abdb969725a2feb44f32d3a69a849609eb")
+	confirm = calculate_confirm_hash(kck, 1, 11, pwe, 5, peer, curve, SHA384)
+	assert confirm == bytes.fromhex("b7e0ea670ed856ea26f2ce1926ffd5f9fcfbbaf080151adcf74b6b2b2922098b37f5f33547d9f5dd4d53eba40f5fbe00")
+
+	sent = []
+	monkeypatch.setattr(libwifi.dragonfly, "sendp", sent.append)
+	sta, ap = "02:00:00:00:00:01", "02:00:00:00:00:02"
+	handshake = SAEHandshake("password", sta, ap, ssid="byteme", group_id=20)
+	peer = SAEHandshake("password", ap, sta, ssid="byteme", group_id=20)
+	handshake.send_commit("password")
+	peer.send_commit("password")
+	handshake.process_commit(sent[1])
+	peer.process_commit(sent[0])
+	assert len(handshake.kck) == 48 and handshake.pmk == peer.pmk and len(raw(sent[-1][Dot11Auth].payload)) == 2 + 48
+	assert peer.process_confirm(sent[-2]) and handshake.process_confirm(sent[-1])
@@ -0,0 +1,74 @@
+from libwifi.eappwd import EapPwdAnalyzer, EapPwdCredentials
+from libwifi.dragonfly import derive_pwe_ecc_eappwd, calculate_confirm_eappwd, get_curve
+from scapy.layers.l2 import Ether
+from scapy.layers.eap import EAPOL
+from scapy.packet import Raw
+import struct
+
+SERVER, PEER = "00:11:22:33:44:55", "02:00:00:00:00:01"
+
+def eap_pwd(code, ident, flags, body):
+	data = struct.pack(">BBHBB", code, ident, 6 + len(body), 52, flags) + body
+	src, dst = (SERVER, PEER) if code == 1 else (PEER, SERVER)
+	return Ether(src=src, dst=dst)/EAPOL(type=0)/Raw(data)
+
+def test_eappwd_analyzer():
+	curve = get_curve(19)
+	token, password = 0x1234abcd, b"password"
+	pwe = derive_pwe_ecc_eappwd(password, b"user", b"server", token)
+
+	server_private, server_mask = 12345678901234567890, 98765432109876543210
+	peer_private, peer_mask = 1122334455667788, 8877665544332211
+	server_scalar = (server_private + server_mask) % curve.r
+	server_element = -(pwe * server_mask)
+	peer_scalar = (peer_private + peer_mask) % curve.r
+	peer_element = -(pwe * peer_mask)
+	k = int(((pwe * peer_scalar + peer_element) * server_private).x)
+	server_confirm = calculate_confirm_eappwd(k, server_element, server_scalar, peer_element, peer_scalar)
+	peer_confirm = calculate_confirm_eappwd(k, peer_element, peer_scalar, server_element, server_scalar)
+
+	id_params = struct.pack(">HBBIB", 19, 1, 1, token, 0)
+	server_commit = curve.point_to_data(server_element) + curve.scalar_to_data(server_scalar)
+	peer_commit = curve.point_to_data(peer_element) + curve.scalar_to_data(peer_scalar)
+	frames = [eap_pwd(1, 1, 1, id_params + b"server"),
+	          eap_pwd(2, 1, 1, id_params + b"user"),
+	          # Server commit is fragmented, the peer acknowledges the first fragment
+	          eap_pwd(1, 2, 0x80 | 0x40 | 2, struct.pack(">H", len(server_commit)) + server_commit[:50]),
+	          eap_pwd(2, 2, 2, b""),
+	          eap_pwd(1, 3, 2, server_commit[50:]),
+	          eap_pwd(2, 3, 2, peer_commit),
+	          eap_pwd(1, 4, 3, server_confirm),
+	          eap_pwd(2, 4, 3, peer_confirm),
+	          Ether(src=SERVER, dst=PEER)/EAPOL(type=0)/Raw(b"\x03\x04\x00\x04")]
+
+	results = []
+	analyzer = EapPwdAnalyzer({b"user": EapPwdCredentials(password, server_private=server_private)},
+	                          callback=results.append)
+	for p in frames:
+		analyzer.process(Ether(bytes(p)))
+	assert len(results) == 1 and len(analyzer.sessions) == 0
+	session = results[0]
+	assert session.result == "success" and session.k == k and session.pwe == pwe
+	assert session.server_confirm_ok and session.peer_confirm_ok and not session.problems
+
+	# With only the password the PWE is derived but the confirms can't be checked. Wrong
+	# confirms are detected when the peer's private value is known.
+	results = []
+	analyzer = EapPwdAnalyzer({b"user": password}, callback=results.append)
+	for p in frames[:-1]: analyzer.process(p)
+	analyzer.flush()
+	assert results[0].pwe == pwe and results[0].server_confirm_ok is None
+
+	results = []
+	analyzer = EapPwdAnalyzer({b"user": EapPwdCredentials(password, peer_private=peer_private)},
+	                          callback=results.append)
+	for p in frames[:7] + [eap_pwd(2, 4, 3, b"\x00" * 32)]: analyzer.process(p)
+	analyzer.flush()
+	assert results[0].server_confirm_ok and results[0].peer_confirm_ok is False
+
+	# Sessions are bounded
+	results = []
+	analyzer = EapPwdAnalyzer(max_sessions=1, callback=results.append)
+	analyzer.process(frames[0])
+	analyzer.process(Ether(src=SERVER, dst="02:00:00:00:00:02")/frames[0][EAPOL])
+	assert len(analyzer.sessions) == 1 and "evicted" in results[0].problems
@@ -0,0 +1,47 @@
+from libwifi.framestore import FrameStore, addr2int, int2addr, NO_PN, NO_TID
+from libwifi.wifi import DLT_IEEE802_11_RADIO, radiotap_antsignal, raw_ccmp_pn
+from scapy.layers.dot11 import RadioTap, Dot11, Dot11QoS, Dot11CCMP
+from scapy.packet import raw
+import os
+
+AP, STA = "00:11:22:33:44:55", "02:00:00:00:00:01"
+
+def ccmp_frame(pn, seqnum, retry=False):
+	pn = pn.to_bytes(6, "little")
+	p = RadioTap(present="Flags+dBm_AntSignal", dBm_AntSignal=-42)/Dot11(type=2, subtype=8, FCfield="protected",
+	    addr1=AP, addr2=STA, addr3=AP, SC=seqnum << 4)/Dot11QoS(TID=5)
+	if retry:
+		p.FCfield |= 0x08
+	return p/Dot11CCMP(PN0=pn[0], PN1=pn[1], ext_iv=1, PN2=pn[2], PN3=pn[3], PN4=pn[4], PN5=pn[5], data=b"\x00" * 16)
+
+def test_framestore(tmp_path):
+	assert int2addr(addr2int(AP)) == AP
+	assert radiotap_antsignal(raw(ccmp_frame(1, 1))) == -42
+	assert raw_ccmp_pn(raw(ccmp_frame(0x010203040506, 1)[Dot11])) == 0x010203040506
+
+	with FrameStore(chunk_size=4, spill_dir=str(tmp_path)) as store:
+		frames = [ccmp_frame(1, 1), ccmp_frame(2, 2), ccmp_frame(2, 2, retry=True), ccmp_frame(3, 3),
+		          ccmp_frame(2, 4), RadioTap()/Dot11(type=1, subtype=13, addr1=STA)]
+		for i, p in enumerate(frames):
+			p.time = 1000 + i
+			assert store.append_packet(p)
+		for i in range(10):
+			store.append(2000 + i, addr2int(AP), addr2int(STA), 0x0008 if i < 5 else 0x0808, i << 4, length=100)
+
+		assert len(store) == 16
+		assert len(os.listdir(str(tmp_path))) == 3
+		assert list(store.column("ts"))[:6] == [1000, 1001, 1002, 1003, 1004, 1005]
+		assert list(store.columns("tid", "pn"))[4:6] == [(5, 2), (NO_TID, NO_PN)]
+		assert store.pn_reuse() == [(addr2int(STA), addr2int(AP), 2, 1, 4)]
+		assert store.retransmissions() == {addr2int(STA): 1, addr2int(AP): 5}
+		groups = store.group_by_transmitter()
+		assert groups[addr2int(AP)] == (10, 1000) and groups[addr2int(STA)][0] == 5 and groups[0] == (1, 10)
+	assert os.listdir(str(tmp_path)) == []
+
+	# Only the packet numbers of the last window to 2 * window frames of a link are remembered
+	with FrameStore() as store:
+		for row, pn in enumerate([1, 2, 1, 3, 4, 5, 1]):
+			store.append(row, addr2int(STA), addr2int(AP), 0x4088, row << 4, pn=pn)
+		store.append(7, addr2int(AP), addr2int(STA), 0x4088, 0, pn=4)
+		assert store.pn_reuse(window=2) == [(addr2int(STA), addr2int(AP), 1, 0, 2)]
+		assert store.pn_reuse() == [(addr2int(STA), addr2int(AP), 1, 0, 2), (addr2int(STA), addr2int(AP), 1, 0, 6)]
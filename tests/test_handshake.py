@@ -0,0 +1,84 @@
+from libwifi.handshake import HandshakeTracker, calc_ptk, calc_eapol_mic, EAPOL_KEY_MIC_OFFSET, \
+	KEY_INFO_VERSION_MASK, KEY_INFO_PAIRWISE, KEY_INFO_INSTALL, KEY_INFO_ACK, KEY_INFO_MIC, KEY_INFO_SECURE, \
+	KEY_VERSION_HMAC_SHA1, KEY_VERSION_AES_CMAC
+from libwifi.crypto import encrypt_ccmp, KeyStore
+from scapy.layers.dot11 import Dot11, Dot11QoS
+from scapy.layers.eap import EAPOL
+from scapy.layers.l2 import LLC, SNAP
+from scapy.packet import Raw, raw
+import os, struct
+
+AP, STA = "00:11:22:33:44:55", "02:00:00:00:00:01"
+
+def eapol_key(key_info, replay_counter, nonce, key_data=b"", kck=None):
+	body = struct.pack(">BHHQ32s16s8s8s16sH", 2, key_info, 16, replay_counter, nonce, b"\x00" * 16,
+	                   b"\x00" * 8, b"\x00" * 8, b"\x00" * 16, len(key_data)) + key_data
+	frame = struct.pack(">BBH", 2, 3, len(body)) + body
+	if kck is not None:
+		mic = calc_eapol_mic(kck, key_info & KEY_INFO_VERSION_MASK, frame)
+		frame = frame[:EAPOL_KEY_MIC_OFFSET] + mic + frame[EAPOL_KEY_MIC_OFFSET + 16:]
+	from_ap = key_info & KEY_INFO_ACK
+	header = Dot11(type=2, FCfield="from-DS" if from_ap else "to-DS", addr1=STA if from_ap else AP,
+	               addr2=AP if from_ap else STA, addr3=AP)
+	return Dot11(raw(header/LLC()/SNAP()/EAPOL(frame)))
+
+def handshake(pmk, key_version, replay_counter=1):
+	anonce, snonce = os.urandom(32), os.urandom(32)
+	kck, kek, tk = calc_ptk(pmk, anonce, snonce, AP, STA, key_version)
+	info = KEY_INFO_PAIRWISE | key_version
+	frames = [eapol_key(info | KEY_INFO_ACK, replay_counter, anonce),
+	          eapol_key(info | KEY_INFO_MIC, replay_counter, snonce, b"\x30\x14" + b"\x00" * 20, kck),
+	          eapol_key(info | KEY_INFO_ACK | KEY_INFO_MIC | KEY_INFO_INSTALL | KEY_INFO_SECURE,
+	                    replay_counter + 1, anonce, b"\x00" * 24, kck),
+	          eapol_key(info | KEY_INFO_MIC | KEY_INFO_SECURE, replay_counter + 1, b"\x00" * 32, kck=kck)]
+	return frames, tk
+
+def data_frame(tk, pn, qos=False):
+	header = Dot11(type=2, subtype=8 if qos else 0, FCfield="to-DS", addr1=AP, addr2=STA, addr3=AP)
+	if qos:
+		header = header/Dot11QoS(TID=3)
+	encrypted = encrypt_ccmp(header/LLC()/SNAP()/Raw(b"payload %d" % pn), tk, pn)
+	return Dot11(raw(encrypted))
+
+def test_handshake_tracker():
+	pmk = os.urandom(32)
+	installed = []
+	tracker = HandshakeTracker({AP: pmk}, callback=lambda state: installed.append(state.epoch))
+
+	for key_version in [KEY_VERSION_HMAC_SHA1, KEY_VERSION_AES_CMAC]:
+		frames, tk = handshake(pmk, key_version)
+		for p in frames:
+			assert tracker.process(p) is None
+		state = tracker.states[(AP, STA)]
+		assert state.tk == tk and state.complete
+
+		decrypted = tracker.process(data_frame(tk, 1))
+		assert decrypted[SNAP].payload.load == b"payload 1"
+		decrypted = tracker.process(data_frame(tk, 2, qos=True))
+		assert decrypted[Dot11QoS].TID == 3 and decrypted[SNAP].payload.load == b"payload 2"
+	assert installed == [1, 2]
+
+	# During a rekey frames protected by the previous key can still be decrypted, and a
+	# missed message 1 is recovered using the ANonce in message 3.
+	old_tk = tk
+	frames, tk = handshake(pmk, KEY_VERSION_HMAC_SHA1, replay_counter=5)
+	for p in frames[1:]:
+		tracker.process(p)
+	assert tracker.states[(AP, STA)].epoch == 3
+	assert tracker.process(data_frame(old_tk, 10)) is not None
+	assert tracker.process(data_frame(tk, 11)) is not None
+	assert tracker.process(data_frame(os.urandom(16), 12)) is None
+
+	# A wrong PMK is detected using the MIC
+	tracker = HandshakeTracker(os.urandom(32), max_pairs=1)
+	for p in frames:
+		tracker.process(p)
+	assert tracker.states[(AP, STA)].tk is None and len(tracker.keystore) == 0
+
+	# The PMKs can also be provided by the KeyStore
+	keystore = KeyStore()
+	keystore.set_pmk(AP, pmk)
+	tracker = HandshakeTracker(keystore=keystore)
+	for p in frames:
+		tracker.process(p)
+	assert keystore.get_keys(AP, STA) == [tk]
@@ -0,0 +1,38 @@
+from libwifi import metrics
+from libwifi.dragonfly import derive_pwe_ecc
+from libwifi.mschap import MSCHAPv2Verifier
+import json
+
+def test_metrics():
+	metrics.reset()
+	metrics.count("disabled")
+	with metrics.timed("disabled.section"):
+		pass
+	assert metrics.snapshot() == {"counters": {}, "histograms": {}}
+
+	metrics.enable()
+	try:
+		@metrics.timed("decorated")
+		def func(x):
+			return x + 1
+		assert func(1) == 2
+
+		metrics.count("frames", 2)
+		with metrics.timed("section"):
+			derive_pwe_ecc("OtherPassword4", "01:02:03:04:05:06", "11:22:33:44:55:66")
+		verifier = MSCHAPv2Verifier()
+		assert verifier.verify(b"unknown", b"\x00" * 16, b"\x00" * 16, b"\x00" * 24) is None
+	finally:
+		metrics.disable()
+
+	data = metrics.snapshot()
+	assert data["counters"] == {"frames": 2, "mschap.verify.unknown_user": 1}
+	assert set(data["histograms"]) == {"decorated", "section", "dragonfly.derive_pwe_ecc", "dragonfly.pwe.iterations"}
+	assert dict(data["histograms"]["dragonfly.pwe.iterations"]["buckets"])[4] == 1
+	assert json.loads(metrics.to_json())["counters"]["frames"] == 2
+
+	text = metrics.to_prometheus()
+	assert "libwifi_frames_total 2\n" in text
+	assert 'libwifi_dragonfly_pwe_iterations_bucket{le="3"} 0\n' in text
+	assert 'libwifi_section_bucket{le="+Inf"} 1\n' in text
+	metrics.reset()
@@ -12,3 +12,22 @@ def test_mschap():
 	auth_resp = generate_authenticator_response(password, nt_response, peer_challenge, auth_challenge, username)
 	assert auth_resp == b"\x0f\x91\x69\x7e\x8e\x8f\xd6\xb7\x25\xf3\x3c\x30\xd8\x1d\x67\xa7\x47\xfc\xba\x01"
 
+
+def test_mschap_verifier():
+	username = b"peapuser"
+	auth_challenge = binascii.unhexlify("59ff644c1462df4d59a4465d6bc8096c")
+	peer_challenge = binascii.unhexlify("0d605a24da8d6ef758ee23698f370446")
+	nt_response = generate_nt_response_mschap2(auth_challenge, peer_challenge, username, "password")
+	auth_resp = generate_authenticator_response("password", nt_response, peer_challenge, auth_challenge, username)
+
+	assert expand_des_key(b"\x00" * 7) == b"\x01" * 8
+	assert expand_des_key(b"\xff" * 7) == b"\xff" * 8
+	assert expand_des_key(b"\x81\x02\x04\x08\x10\x20\x40") == b"\x81" * 8
+
+	verifier = MSCHAPv2Verifier()
+	verifier.add_user(username, "password")
+	verifier.add_user(b"other", password_hash=nt_password_hash("secret"))
+	assert verifier.verify(username, auth_challenge, peer_challenge, nt_response) == auth_resp
+	assert verifier.verify_batch([(username, auth_challenge, peer_challenge, nt_response),
+	                              (b"other", auth_challenge, peer_challenge, nt_response),
+	                              (b"unknown", auth_challenge, peer_challenge, nt_response)]) == [auth_resp, None, None]
@@ -0,0 +1,91 @@
+from libwifi.netlink import *
+import errno, socket, struct
+
+NL80211_ID = 0x1c
+
+class FakeNetlinkSocket():
+	"""Records all requests and answers them with replies created by the handler"""
+	def __init__(self, handler):
+		self.handler = handler
+		self.sent = []
+		self.pending = []
+
+	def send(self, data):
+		msg_type, flags, seq, payload = parse_nlmsgs(data)[0]
+		self.sent.append((msg_type, flags, payload))
+		reply = b""
+		for reply_type, reply_payload in self.handler(msg_type, payload):
+			reply += nlmsg(reply_type, 0, seq, reply_payload)
+		# Also deliver a stale reply that must be ignored
+		self.pending += [nlmsg(NLMSG_DONE, 0, seq - 1, b""), reply]
+		return len(data)
+
+	def recv(self, bufsize):
+		return self.pending.pop(0)
+
+	def close(self):
+		pass
+
+def ack(error=0):
+	return (NLMSG_ERROR, struct.pack("=i", error) + b"\x00" * 16)
+
+def genl_handler(iftype=2, freq=2437):
+	def handler(msg_type, payload):
+		if msg_type == GENL_ID_CTRL:
+			return [(GENL_ID_CTRL, GENL_HEADER.pack(1, 2, 0) + nlattr(CTRL_ATTR_FAMILY_ID, struct.pack("=H", NL80211_ID))), ack()]
+		cmd = payload[0]
+		if cmd == NL80211_CMD_GET_INTERFACE:
+			attrs = nlattr(NL80211_ATTR_IFNAME, "lo") + nlattr_u32(NL80211_ATTR_IFTYPE, iftype) + nlattr_u32(NL80211_ATTR_WIPHY_FREQ, freq)
+			return [(NL80211_ID, GENL_HEADER.pack(7, 1, 0) + attrs)]
+		elif cmd == NL80211_CMD_SET_WIPHY:
+			return [ack(-errno.EBUSY)]
+		return [ack()]
+	return handler
+
+def route_handler(msg_type, payload):
+	if msg_type == RTM_GETLINK:
+		attrs = nlattr(IFLA_ADDRESS, bytes.fromhex("020000000001")) + nlattr_u32(IFLA_MTU, 1500)
+		return [(RTM_NEWLINK, IFINFO_HEADER.pack(socket.AF_UNSPEC, 1, 1, IFF_UP, 0) + attrs)]
+	return [ack()]
+
+def test_encoding():
+	assert nlattr(CTRL_ATTR_FAMILY_NAME, "nl80211") == b"\x0c\x00\x02\x00nl80211\x00"
+	assert nlattr(IFLA_ADDRESS, b"\x02\x00\x00\x00\x00\x01") == b"\x0a\x00\x01\x00\x02\x00\x00\x00\x00\x01\x00\x00"
+	attrs = parse_nlattrs(nlattr_u32(5, 6) + nlattr(1 | 0x8000, b"\x01"))
+	assert attrs == {5: b"\x06\x00\x00\x00", 1: b"\x01"}
+
+	assert [channel_to_freq(ch) for ch in [1, 6, 13, 14, 36, 165]] == [2412, 2437, 2472, 2484, 5180, 5825]
+	assert [freq_to_channel(f) for f in [2412, 2437, 2472, 2484, 5180, 5825, 5955]] == [1, 6, 13, 14, 36, 165, 1]
+
+def test_netlink_client():
+	genl = FakeNetlinkSocket(genl_handler())
+	route = FakeNetlinkSocket(route_handler)
+	client = NetlinkClient(genl, route)
+
+	state = client.refresh("lo")
+	assert (state.index, state.iftype, state.channel, state.up, state.mac, state.mtu) == (1, "managed", 6, True, "02:00:00:00:00:01", 1500)
+	assert genl.sent[0][0] == GENL_ID_CTRL and genl.sent[1][0] == NL80211_ID
+
+	# Queries are answered from the cache, and changes update it
+	client.set_iftype("lo", "monitor")
+	client.set_up("lo", False)
+	client.set_macaddress("lo", "02:00:00:00:00:AA")
+	assert len(genl.sent) == 3 and len(route.sent) == 3
+	assert client.get_iftype("lo") == "monitor" and client.states["lo"].up == False
+	assert client.states["lo"].mac == "02:00:00:00:00:aa"
+
+	msg_type, flags, payload = genl.sent[2]
+	assert flags & NLM_F_ACK and payload[0] == NL80211_CMD_SET_INTERFACE
+	assert parse_nlattrs(payload, GENL_HEADER.size)[NL80211_ATTR_IFTYPE] == struct.pack("=I", 6)
+	msg_type, flags, payload = route.sent[1]
+	assert msg_type == RTM_NEWLINK and IFINFO_HEADER.unpack_from(payload) == (socket.AF_UNSPEC, 0, 1, 0, IFF_UP)
+	assert parse_nlattrs(route.sent[2][2], IFINFO_HEADER.size)[IFLA_ADDRESS] == bytes.fromhex("0200000000aa")
+
+	# Errors reported by the kernel raise an OSError and leave the cache untouched
+	try:
+		client.set_channel("lo", 11)
+		assert False
+	except OSError as ex:
+		assert ex.errno == errno.EBUSY
+	assert client.get_channel("lo") == 6
+	assert client.get_channel("lo", cached=False) == 6
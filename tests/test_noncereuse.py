@@ -0,0 +1,47 @@
+from libwifi.noncereuse import BloomFilter, NonceReuseDetector
+from scapy.layers.dot11 import RadioTap, Dot11, Dot11CCMP
+
+AP, STA = "00:11:22:33:44:55", "02:00:00:00:00:01"
+
+def test_bloom_filter():
+	bloom = BloomFilter(1000, 0.01)
+	assert sum(bloom.add(b"%d" % i) for i in range(1000)) < 20
+	assert all(b"%d" % i in bloom for i in range(1000))
+	false_positives = sum(b"x%d" % i in bloom for i in range(10000))
+	assert false_positives < 300
+	assert BloomFilter.capacity_for(len(bloom.bits), 0.01) in range(990, 1010)
+
+def test_nonce_reuse():
+	detector = NonceReuseDetector(max_stations=2, memory_budget=4096, window=4)
+	def frame(pn, seq, ts, retry=False):
+		p = RadioTap()/Dot11(type=2, FCfield="to-DS+protected" + ("+retry" if retry else ""), addr1=AP, addr2=STA,
+		                     addr3=AP, SC=seq << 4)/Dot11CCMP(PN0=pn & 0xFF, PN1=pn >> 8, ext_iv=1, data=b"\x00" * 16)
+		p.time = ts
+		return p
+
+	assert detector.process_packet(frame(1, 1, 0)) is None
+	assert detector.process_packet(frame(1, 1, 0.1, retry=True)) is None
+	reuse = detector.process_packet(frame(1, 2, 5))
+	assert reuse.confirmed and not reuse.retransmission and (reuse.ta, reuse.pn, reuse.first_seq) == (STA, 1, 1)
+	# A new key epoch starts with fresh packet numbers
+	assert detector.process_packet(frame(1, 3, 6), epoch=1) is None
+
+	# Packet numbers that left the window are reported as unconfirmed candidates
+	for pn in range(2, 10):
+		detector.process_packet(frame(pn, pn + 10, 7))
+	reuse = detector.process_packet(frame(2, 40, 8))
+	assert not reuse.confirmed and reuse.first_seq is None
+	# Unless they are retransmissions
+	assert detector.process_packet(frame(3, 13, 8, retry=True)) is None
+	assert len(detector.reuses) == 2
+
+	# The window is part of the memory budget
+	try:
+		NonceReuseDetector(max_stations=1024, memory_budget=1 << 20, window=1024)
+		assert False
+	except ValueError:
+		pass
+	detector = NonceReuseDetector(max_stations=1, memory_budget=4096, window=4, max_reuses=1)
+	for seq in range(3):
+		detector.process_packet(frame(1, seq, seq))
+	assert len(detector.reuses) == 1 and detector.reuses[0].seq == 2
@@ -0,0 +1,61 @@
+from libwifi.pcap import MmapPcapReader, BufferedPcapWriter, prefilter_dot11
+from libwifi.wifi import DLT_IEEE802_11_RADIO, DLT_IEEE802_11, radiotap_has_fcs
+from scapy.layers.dot11 import RadioTap, Dot11, Dot11Beacon, Dot11Elt
+from scapy.packet import Raw, raw
+from scapy.utils import rdpcap
+import struct
+
+AP = "00:11:22:33:44:55"
+
+def test_pcap(tmp_path):
+	beacon = RadioTap()/Dot11(type=0, subtype=8, addr1="ff:ff:ff:ff:ff:ff", addr2=AP, addr3=AP)/Dot11Beacon()/Dot11Elt(ID=0, info=b"test")
+	data = RadioTap()/Dot11(type=2, addr1=AP, addr2="02:00:00:00:00:01", addr3=AP)/Raw(b"payload")
+	beacon.time = 1600000000.25
+
+	filename = str(tmp_path / "test.pcap")
+	with BufferedPcapWriter(filename, buffer_size=64) as writer:
+		writer.write(beacon)
+		for i in range(100):
+			writer.write(raw(data), ts=1600000001 + i)
+		writer.write(memoryview(raw(beacon)), ts=1600000200.5)
+	assert len(rdpcap(filename)) == 102
+
+	with MmapPcapReader(filename) as reader:
+		records = list(reader)
+		assert len(records) == 102
+		assert records[0][0] == 1600000000.25 and records[0][1] == DLT_IEEE802_11_RADIO
+		assert bytes(records[0][2]) == raw(beacon) and bytes(records[1][2]) == raw(data)
+
+	with MmapPcapReader(filename, prefilter_dot11(types=[(0, 8)])) as reader:
+		assert [ts for ts, _, _ in reader] == [1600000000.25, 1600000200.5]
+	with MmapPcapReader(filename, prefilter_dot11(addr="02:00:00:00:00:01")) as reader:
+		assert sum(1 for _ in reader) == 100
+
+def test_pcapng(tmp_path):
+	def block(block_type, body):
+		body += b"\x00" * (-len(body) % 4)
+		return struct.pack("<II", block_type, len(body) + 12) + body + struct.pack("<I", len(body) + 12)
+
+	frame = raw(Dot11(type=2, addr1=AP, addr2=AP, addr3=AP)/Raw(b"data"))
+	ts = 1600000000123456789
+	content = block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1))
+	# Interface with nanosecond timestamps followed by one using the default resolution
+	content += block(1, struct.pack("<HHI", DLT_IEEE802_11, 0, 65535) + struct.pack("<HHB3xHH", 9, 1, 9, 0, 0))
+	content += block(1, struct.pack("<HHI", DLT_IEEE802_11_RADIO, 0, 65535))
+	content += block(6, struct.pack("<IIIII", 0, ts >> 32, ts & 0xffffffff, len(frame), len(frame)) + frame)
+	content += block(6, struct.pack("<IIIII", 1, 0, 5000000, 4, 4) + b"abcd")
+	# Corrupt block with an undefined interface, which is skipped
+	content += block(6, struct.pack("<IIIII", 7, 0, 5000000, 4, 4) + b"efgh")
+	content += block(3, struct.pack("<I", len(frame)) + frame)
+
+	filename = tmp_path / "test.pcapng"
+	filename.write_bytes(content)
+	with MmapPcapReader(str(filename)) as reader:
+		records = [(ts, linktype, bytes(data)) for ts, linktype, data in reader]
+	assert records == [(ts * 1e-9, DLT_IEEE802_11, frame), (5.0, DLT_IEEE802_11_RADIO, b"abcd"),
+	                   (0.0, DLT_IEEE802_11, frame)]
+
+def test_radiotap_fcs():
+	p = RadioTap(present="TSFT+Flags", Flags="FCS")/Dot11()
+	assert radiotap_has_fcs(raw(p))
+	assert not radiotap_has_fcs(raw(RadioTap(present="TSFT+Flags")/Dot11()))
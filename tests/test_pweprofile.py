@@ -0,0 +1,16 @@
+from libwifi.pweprofile import profile_pwe, CsvResultStore, counter_histogram, timing_histogram, iteration_timing
+
+def test_profile_pwe(tmp_path):
+	inputs = [(1, "password", "01:02:03:04:05:06", "11:22:33:44:55:66"),
+	          (2, "OtherPassword4", "01:02:03:04:05:06", "11:22:33:44:55:66")]
+	store = profile_pwe(inputs, processes=1)
+	assert sorted(zip(store.ids, store.counters)) == [(1, 1), (2, 4)]
+	assert counter_histogram(store) == {1: 1, 4: 1}
+	assert sum(timing_histogram(store).values()) == 2
+
+	store = profile_pwe(inputs, CsvResultStore(str(tmp_path / "pwe.csv")), processes=2, chunksize=1)
+	store.close()
+	assert sorted((input_id, counter) for input_id, counter, _ in store.records()) == [(1, 1), (2, 4)]
+
+	store = profile_pwe([(1, "password", "user", "server", 2546484939)], method="eappwd", processes=1)
+	assert len(store) == 1 and iteration_timing(store).keys() == {store.counters[0]}
@@ -0,0 +1,80 @@
+from libwifi.saeengine import SAEEngine, SAESession, SoftwareSAEAccessPoint, LocalTransport, random_station_addr, sae_worker_keys
+from scapy.layers.dot11 import Dot11, Dot11Auth
+from scapy.packet import Raw
+import asyncio, concurrent.futures, concurrent.futures.process
+
+class BrokenKeysExecutor(concurrent.futures.Executor):
+	"""Computes commits inline, but fails to derive keys like a process pool whose worker died"""
+	def submit(self, fn, *args):
+		future = concurrent.futures.Future()
+		if fn is sae_worker_keys:
+			future.set_exception(concurrent.futures.process.BrokenProcessPool("worker died"))
+		else:
+			future.set_result(fn(*args))
+		return future
+
+def run_handshakes(num_stations, executor=None, **kwargs):
+	bssid = "02:00:00:00:00:01"
+	to_ap, to_engine = LocalTransport(), LocalTransport()
+	engine_kwargs = {key: kwargs.pop(key) for key in ["ssid", "identifier", "group_id"] if key in kwargs}
+	engine = SAEEngine(bssid, "password", to_ap, executor=executor, timeout=0.05, **engine_kwargs)
+	ap = SoftwareSAEAccessPoint(bssid, "password", to_engine, **engine_kwargs, **kwargs)
+	to_ap.receive, to_engine.receive = ap.receive, engine.frame_received
+
+	stations = [random_station_addr() for _ in range(num_stations)]
+	sessions = asyncio.get_event_loop().run_until_complete(engine.run(stations, concurrency=4))
+	return engine, ap, sessions
+
+def test_sae_engine():
+	engine, ap, sessions = run_handshakes(6, require_token=True, drop_commits=1)
+	assert all(session.pmk == ap.accepted[session.stamac] for session in sessions)
+	stats = engine.statistics()
+	assert stats["completed"] == 6 and stats["failed"] == 0 and stats["p50_ms"] <= stats["p99_ms"]
+	assert len(engine.sessions) == 0
+
+	engine, ap, sessions = run_handshakes(2, ssid="byteme", identifier="id", require_token=True)
+	assert all(session.pmk == ap.accepted[session.stamac] for session in sessions)
+	engine, ap, sessions = run_handshakes(2, ssid="byteme", group_id=21)
+	assert all(len(session.kck) == 64 and session.pmk == ap.accepted[session.stamac] for session in sessions)
+
+	with concurrent.futures.ProcessPoolExecutor(2) as executor:
+		engine, ap, sessions = run_handshakes(4, executor)
+	assert engine.statistics()["completed"] == 4
+
+def test_sae_engine_failure():
+	bssid = "02:00:00:00:00:01"
+	to_ap, to_engine = LocalTransport(), LocalTransport()
+	engine = SAEEngine(bssid, "password", to_ap, timeout=0.01, max_retries=2)
+	ap = SoftwareSAEAccessPoint(bssid, "wrong password", to_engine)
+	to_ap.receive, to_engine.receive = ap.receive, engine.frame_received
+
+	session = asyncio.get_event_loop().run_until_complete(engine.handshake(random_station_addr()))
+	assert session.reason == "timeout" and engine.statistics()["failed"] == 1
+
+	# Malformed frames make the session fail, and later frames don't change finished sessions
+	to_ap, to_engine = LocalTransport(), LocalTransport()
+	engine = SAEEngine(bssid.upper(), "password", to_ap, timeout=0.05)
+	ap = SoftwareSAEAccessPoint(bssid, "password", to_engine)
+	to_ap.receive, to_engine.receive = ap.receive, engine.frame_received
+	session = asyncio.get_event_loop().run_until_complete(engine.handshake("02:AA:00:00:00:01"))
+	assert session.state == session.ACCEPTED and session.stamac == "02:aa:00:00:00:01"
+	reject = Dot11(addr1=session.stamac, addr2=bssid, addr3=bssid)/Dot11Auth(algo=3, seqnum=2, status=1)
+	engine._process_confirm(session, reject[Dot11Auth])
+	assert session.state == session.ACCEPTED and engine.failed == 0
+
+	engine.transport = LocalTransport(lambda frame: None)
+	for seqnum in [1, 2]:
+		task = asyncio.get_event_loop().create_task(engine.handshake(random_station_addr()))
+		while len(engine.sessions) == 0 or list(engine.sessions.values())[0].state != SAESession.COMMITTED:
+			asyncio.get_event_loop().run_until_complete(asyncio.sleep(0.001))
+		session = list(engine.sessions.values())[0]
+		# Pretend the keys were already derived so the confirm is parsed
+		if seqnum == 2:
+			session.state = SAESession.CONFIRMED
+		engine.frame_received(Dot11(addr1=session.stamac, addr2=bssid, addr3=bssid)/Dot11Auth(algo=3, seqnum=seqnum)/Raw(b"\x13"))
+		assert asyncio.get_event_loop().run_until_complete(task).reason.startswith("malformed")
+	assert engine.failed == 2
+
+	engine, ap, sessions = run_handshakes(2, BrokenKeysExecutor())
+	assert all(session.reason.startswith("deriving keys failed") for session in sessions)
+	assert engine.statistics()["failed"] == 2
@@ -0,0 +1,37 @@
+from libwifi.scheduler import InjectionScheduler, TokenBucket
+
+class FakeClock():
+	"""Advances a little on every reading, so busy-waiting terminates, and by the full duration when sleeping"""
+	def __init__(self):
+		self.now = 0.0
+
+	def __call__(self):
+		self.now += 0.0001
+		return self.now
+
+	def sleep(self, duration):
+		self.now += duration
+
+def test_scheduler():
+	sent, clock = [], FakeClock()
+	scheduler = InjectionScheduler(None, send=lambda frame: sent.append((frame, clock.now)), clock=clock, sleep=clock.sleep)
+	start = clock()
+	scheduler.schedule("late", at=start + 0.02)
+	scheduler.schedule_train(["frag0", "frag1", "frag2"], gap=0.005)
+	entries = scheduler.run()
+
+	assert [frame for frame, _ in sent] == ["frag0", "frag1", "frag2", "late"]
+	assert all(entry.jitter >= 0 and entry.jitter < 0.001 for entry in entries)
+	assert abs(entries[2].deadline - entries[0].deadline - 0.01) < 1e-9 and sent[3][1] - start >= 0.02
+	assert scheduler.jitter_stats()[1] == max(entry.jitter for entry in entries)
+
+	# At most 100 frames per second after the initial burst of 2
+	sent.clear()
+	scheduler = InjectionScheduler(None, rate=100, burst=2, send=lambda frame: sent.append((frame, clock.now)),
+	                               history=3, clock=clock, sleep=clock.sleep)
+	for i in range(5):
+		scheduler.schedule(i)
+	scheduler.run()
+	assert sent[-1][1] - sent[0][1] >= 0.029
+	# Only the jitter of the most recent frames is kept
+	assert len(scheduler.jitter) == 3
@@ -0,0 +1,41 @@
+from libwifi.shmring import SharedRing, ring_worker, stop_ring_workers
+import hashlib, multiprocessing
+
+def digest(ts, meta, data):
+	return hashlib.sha256(data).digest()
+
+def test_shmring():
+	ring = SharedRing(num_slots=2, slot_size=16)
+	assert ring.put(b"frame1", ts=1.5, meta=7) and ring.put(b"frame2")
+	assert not ring.put(b"frame3") and not ring.put(b"\x00" * 17)
+	record = ring.get(timeout=0)
+	assert (record.ts, record.meta, bytes(record.data)) == (1.5, 7, b"frame1")
+	# The slot can only be reused after the record was released
+	assert not ring.put(b"frame3")
+	record.release()
+	assert ring.put(b"frame3") and len(ring) == 2
+	with ring.get() as record:
+		assert bytes(record.data) == b"frame2"
+	with ring.get() as record:
+		assert bytes(record.data) == b"frame3"
+	assert ring.get(timeout=0) is None
+	ring.close()
+
+	frames, results = SharedRing(num_slots=8, slot_size=64), SharedRing(num_slots=64, slot_size=32)
+	workers = [multiprocessing.Process(target=ring_worker, args=(frames, results, digest)) for i in range(2)]
+	for worker in workers:
+		worker.start()
+	for i in range(50):
+		while not frames.put(b"frame%d" % i, meta=i):
+			pass
+	stop_ring_workers(frames, len(workers))
+	for worker in workers:
+		worker.join()
+
+	received = dict()
+	for i in range(50):
+		with results.get(timeout=1) as record:
+			received[record.meta] = bytes(record.data)
+	assert received == {i: hashlib.sha256(b"frame%d" % i).digest() for i in range(50)}
+	frames.close()
+	results.close()
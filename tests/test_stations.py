@@ -0,0 +1,30 @@
+from libwifi.stations import StationTable
+from scapy.layers.dot11 import RadioTap, Dot11, Dot11QoS, Dot11CCMP
+from scapy.packet import Raw
+
+AP, STA, OTHER = "00:11:22:33:44:55", "02:00:00:00:00:01", "02:00:00:00:00:02"
+
+def test_station_table():
+	snapshots = []
+	table = StationTable(idle_timeout=10, alpha=0.5, snapshot_interval=5, callback=snapshots.append)
+	def add(p, ts, rssi=None):
+		p = (RadioTap(present="dBm_AntSignal", dBm_AntSignal=rssi) if rssi is not None else RadioTap())/p
+		p.time = ts
+		table.update_packet(p)
+
+	add(Dot11(type=2, subtype=8, FCfield="to-DS", addr1=AP, addr2=STA, addr3=AP, SC=5 << 4)/Dot11QoS(TID=6)/Raw(b"x" * 10), 1, -40)
+	add(Dot11(type=2, subtype=8, FCfield="to-DS+retry+pw-mgt", addr1=AP, addr2=STA, addr3=AP, SC=5 << 4)/Dot11QoS(TID=6), 2, -50)
+	add(Dot11(type=2, FCfield="from-DS+protected", addr1=STA, addr2=AP, addr3=AP, SC=7 << 4)/Dot11CCMP(PN0=3, ext_iv=1), 3)
+	add(Dot11(type=1, subtype=13, addr1=AP), 4)
+
+	sta, ap = table.get(STA), table.get(AP)
+	assert (sta.tx_frames, sta.rx_frames, sta.retries, sta.retry_ratio) == (2, 1, 1, 0.5)
+	assert sta.rssi == -45 and sta.power_save and sta.last_seq == 5 and sta.tid_frames[6] == 2
+	assert table.snapshot()[STA]["bssid"] == AP and table.snapshot()[AP]["bssid"] == AP
+	assert (ap.tx_frames, ap.rx_frames, ap.last_pn, ap.last_seq) == (1, 3, 3, 7)
+	assert len(snapshots) == 0
+
+	# Broadcast frames don't create receivers, and idle stations are evicted
+	add(Dot11(type=0, subtype=8, addr1="ff:ff:ff:ff:ff:ff", addr2=OTHER, addr3=OTHER), 13.5)
+	assert len(table) == 2 and table.get(STA) is None and table.get(OTHER).bssid == b"\x02\x00\x00\x00\x00\x02"
+	assert len(snapshots) == 1 and list(snapshots[0]) == [AP, OTHER]
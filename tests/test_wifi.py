@@ -0,0 +1,41 @@
+from libwifi.wifi import DuplicateFilter, amsdu_subframes, build_amsdu
+from scapy.layers.dot11 import RadioTap, Dot11, Dot11QoS
+from scapy.packet import Raw, raw
+
+AP, STA = "00:11:22:33:44:55", "02:00:00:00:00:01"
+
+def test_duplicate_filter():
+	def frame(seqnum, tid=None, retry=False, src=STA):
+		p = Dot11(type=2, subtype=0 if tid is None else 8, addr1=AP, addr2=src, addr3=AP, SC=seqnum << 4)
+		p.FCfield |= 0x08 if retry else 0
+		return p/Dot11QoS(TID=tid)/Raw(b"data") if tid is not None else p/Raw(b"data")
+
+	dedup = DuplicateFilter(max_entries=3)
+	assert not dedup.is_duplicate_packet(frame(1))
+	assert dedup.is_duplicate_packet(frame(1, retry=True))
+	# Without the Retry flag the frame is treated as new
+	assert not dedup.is_duplicate_packet(frame(1))
+	assert not dedup.is_duplicate_packet(frame(2, retry=True))
+
+	# QoS data frames are tracked per TID
+	assert not dedup.is_duplicate_packet(frame(2, tid=1))
+	assert not dedup.is_duplicate_packet(frame(2, tid=2, retry=True))
+	assert dedup.is_duplicate_packet(frame(2, tid=1, retry=True))
+	assert dedup.is_duplicate(raw(RadioTap()/frame(2, tid=2, retry=True)), len(raw(RadioTap())))
+
+	# Control frames are ignored and the oldest entry is evicted
+	assert not dedup.is_duplicate_packet(Dot11(type=1, subtype=13, addr1=STA))
+	assert not dedup.is_duplicate_packet(frame(5, src=AP))
+	assert not dedup.is_duplicate_packet(frame(2, retry=True))
+	assert dedup.duplicates == 3
+
+def test_amsdu_subframes():
+	payload = build_amsdu([("ff:ff:ff:ff:ff:ff", AP, b"x"), (STA, AP, b"yyyy"), (STA, AP, b"")])
+	assert len(payload) == 15 + 1 + 18 + 2 + 14
+	assert [(bytes(da), bytes(msdu)) for da, sa, msdu in amsdu_subframes(payload)] == \
+	       [(b"\xff" * 6, b"x"), (b"\x02\x00\x00\x00\x00\x01", b"yyyy"), (b"\x02\x00\x00\x00\x00\x01", b"")]
+	try:
+		list(amsdu_subframes(payload[:-1]))
+		assert False
+	except ValueError:
+		pass
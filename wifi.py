@@ -5,7 +5,12 @@
 from scapy.all import *
 from Crypto.Cipher import AES
 from datetime import datetime
-import binascii
+import binascii, os, struct, collections
+from . import metrics
+from .bpf import Dot11Filter
+from .scheduler import InjectionScheduler
+from .netlink import NetlinkClient
+import contextlib
 
 #### Constants ####
 
@@ -53,11 +58,9 @@ if not "Dot11Encrypted" in locals():
 
 def get_device_driver(iface):
 	path = "/sys/class/net/%s/device/driver" % iface
-	try:
-		output = subprocess.check_output(["readlink", "-f", path])
-		return output.decode('utf-8').strip().split("/")[-1]
-	except:
+	if not os.path.exists(path):
 		return None
+	return os.path.realpath(path).split("/")[-1]
 
 #### Utility ####
 
@@ -67,24 +70,55 @@ def get_mac_address(interface):
 def addr2bin(addr):
 	return binascii.a2b_hex(addr.replace(':', ''))
 
+def bin2addr(data):
+	return ":".join("%02x" % b for b in bytes(data))
+
+_netlink = None
+
+def netlink_client():
+	"""Shared netlink client, or None when netlink can't be used, e.g. on non-Linux systems"""
+	global _netlink
+	if _netlink is None:
+		try:
+			_netlink = NetlinkClient()
+		except (OSError, AttributeError):
+			_netlink = False
+	return _netlink or None
+
+def _with_netlink(func, *args):
+	"""Returns (True, result) if the netlink operation succeeded, otherwise (False, None)"""
+	client = netlink_client()
+	if client is None:
+		return False, None
+	try:
+		return True, func(client, *args)
+	except (OSError, KeyError, IndexError) as ex:
+		log(DEBUG, "Netlink operation failed (%s), falling back to external tools" % ex)
+		return False, None
+
 def get_channel(iface):
+	ok, channel = _with_netlink(NetlinkClient.get_channel, iface, False)
+	if ok and channel is not None:
+		return channel
+
 	output = str(subprocess.check_output(["iw", iface, "info"]))
 	p = re.compile("channel (\d+)")
 	m = p.search(output)
 	if m == None: return None
 	return int(m.group(1))
 
-def get_channel(iface):
-	output = str(subprocess.check_output(["iw", iface, "info"]))
-	p = re.compile("channel (\d+)")
-	return int(p.search(output).group(1))
-
 def set_channel(iface, channel):
-	subprocess.check_output(["iw", iface, "set", "channel", str(channel)])
+	ok, _ = _with_netlink(NetlinkClient.set_channel, iface, channel)
+	if not ok:
+		subprocess.check_output(["iw", iface, "set", "channel", str(channel)])
 
 def set_macaddress(iface, macaddr):
-	subprocess.check_output(["ifconfig", iface, "down"])
-	subprocess.check_output(["macchanger", "-m", macaddr, iface])
+	ok, _ = _with_netlink(NetlinkClient.set_up, iface, False)
+	if ok:
+		ok, _ = _with_netlink(NetlinkClient.set_macaddress, iface, macaddr)
+	if not ok:
+		subprocess.check_output(["ifconfig", iface, "down"])
+		subprocess.check_output(["macchanger", "-m", macaddr, iface])
 
 def get_macaddress(iface):
 	"""This works even for interfaces in monitor mode."""
@@ -92,13 +126,33 @@ def get_macaddress(iface):
 	return ("%02x:" * 6)[:-1] % tuple(orb(x) for x in s)
 
 def get_iface_type(iface):
+	ok, iftype = _with_netlink(NetlinkClient.get_iftype, iface, False)
+	if ok and iftype is not None:
+		return iftype
+
 	output = str(subprocess.check_output(["iw", iface, "info"]))
 	p = re.compile("type (\w+)")
 	return str(p.search(output).group(1))
 
+def _set_monitor_mode_netlink(client, iface):
+	if client.get_iftype(iface, cached=False) != "monitor":
+		client.set_up(iface, False)
+		# Some kernels (Debian jessie - 3.16.0-4-amd64) don't properly add the monitor interface the
+		# first time. Instead of always repeating the command after a delay, verify the new type.
+		client.set_iftype(iface, "monitor")
+		if client.get_iftype(iface, cached=False) != "monitor":
+			client.set_iftype(iface, "monitor")
+
+	client.set_up(iface, True)
+	client.set_mtu(iface, 2200)
+
 def set_monitor_mode(iface):
 	# Note: we let the user put the device in monitor mode, such that they can control optional
 	#       parameters such as "iw wlan0 set monitor active" for devices that support it.
+	ok, _ = _with_netlink(_set_monitor_mode_netlink, iface)
+	if ok:
+		return
+
 	if get_iface_type(iface) != "monitor":
 		# Some kernels (Debian jessie - 3.16.0-4-amd64) don't properly add the monitor interface. The following ugly
 		# sequence of commands assures the virtual interface is properly registered as a 802.11 monitor interface.
@@ -115,9 +169,10 @@ def set_monitor_mode(iface):
 def get_nearby_ap_addr(sin):
 	# If this interface itself is also hosting an AP, the beacons transmitted by it might be
 	# returned as well. We filter these out by the condition `p.dBm_AntSignal != None`.
-	beacons = list(sniff(opened_socket=sin, timeout=0.5, lfilter=lambda p: (Dot11 in p or Dot11FCS in p) \
-									and p.type == 0 and p.subtype == 8 \
-									and p.dBm_AntSignal != None))
+	with monitor_filter(sin, Dot11Filter().frame_type(0, 8)):
+		beacons = list(sniff(opened_socket=sin, timeout=0.5, lfilter=lambda p: (Dot11 in p or Dot11FCS in p) \
+										and p.type == 0 and p.subtype == 8 \
+										and p.dBm_AntSignal != None))
 	if len(beacons) == 0:
 		return None, None
 	beacons.sort(key=lambda p: p.dBm_AntSignal, reverse=True)
@@ -128,20 +183,23 @@ def inject_and_capture(sout, sin, p, count=0):
 	label = b"AAAA" + struct.pack(">II", random.randint(0, 2**32), random.randint(0, 2**32))
 	toinject = p/Raw(label)
 	log(DEBUG, "Injecting test frame: " + repr(toinject))
-	sout.send(RadioTap()/toinject)
+	scheduler = InjectionScheduler(sout)
+	scheduler.schedule(RadioTap()/toinject)
 
 	# TODO:Move this to a shared socket interface?
 	# Note: this workaround for Intel is only needed if the fragmented frame is injected using
 	#       valid MAC addresses. But for simplicity just execute it after any fragmented frame.
 	if sout.intel_mf_workaround and toinject.FCfield & Dot11(FCfield="MF").FCfield != 0:
-		sout.send(RadioTap()/Dot11())
+		scheduler.schedule(RadioTap()/Dot11(), gap=0)
 		log(DEBUG, "Sending dummy frame after injecting frame with MF flag set")
+	scheduler.run()
 
 	# 1. When using a 2nd interface: capture the actual packet that was injected in the air.
 	# 2. Not using 2nd interface: capture the "reflected" frame sent back by the kernel. This allows
 	#    us to at least detect if the kernel (and perhaps driver) is overwriting fields. It generally
 	#    doesn't allow us to detect if the device/firmware itself is overwriting fields.
-	packets = sniff(opened_socket=sin, timeout=1, count=count, lfilter=lambda p: p != None and label in raw(p))
+	with monitor_filter(sin, Dot11Filter().contains(label)):
+		packets = sniff(opened_socket=sin, timeout=1, count=count, lfilter=lambda p: p != None and label in raw(p))
 
 	return packets
 
@@ -186,10 +244,13 @@ def test_injection_order(sout, sin, ref, strtype):
 	p6 = Dot11(FCfield=ref.FCfield, addr1=ref.addr1, addr2=ref.addr2, type=2, subtype=8, SC=33)/Dot11QoS(TID=6)
 
 	# First frame causes Tx queue to be busy. Next two frames tests if frames are reordered.
-	for p in [p2, p2, p2, p6]:
-		sout.send(RadioTap()/p/Raw(label))
+	scheduler = InjectionScheduler(sout)
+	scheduler.schedule_train([RadioTap()/p/Raw(label) for p in [p2, p2, p2, p6]])
+	scheduler.run()
+	log(DEBUG, "Send jitter (mean, max, p99): " + str(scheduler.jitter_stats()))
 
-	packets = sniff(opened_socket=sin, timeout=1.5, lfilter=lambda p: Dot11QoS in p and label in raw(p))
+	with monitor_filter(sin, Dot11Filter().qos().contains(label)):
+		packets = sniff(opened_socket=sin, timeout=1.5, lfilter=lambda p: Dot11QoS in p and label in raw(p))
 	tids = [p[Dot11QoS].TID for p in packets]
 	log(STATUS, "Captured TIDs: " + str(tids))
 
@@ -362,42 +423,96 @@ class MonitorSocket(L2Socket):
 	def __init__(self, detect_injected=False, **kwargs):
 		super(MonitorSocket, self).__init__(**kwargs)
 		self.detect_injected = detect_injected
+		# Dot11Filter given to set_filter, restored by monitor_filter
+		self.filter = None
+		# Filter that is evaluated on the raw bytes of received frames before dissecting them
+		self.raw_filter = None
+		# Optional DuplicateFilter that drops retransmissions before dissecting them
+		self.dup_filter = None
+
+	def set_filter(self, flt):
+		"""
+		Only receive frames that match the given Dot11Filter, or remove the filter when None.
+		The filter is attached to the socket as a BPF program, and predicates that the kernel
+		can't evaluate, or all of them if attaching fails, are checked before dissection.
+		"""
+		Dot11Filter.detach(self.ins)
+		self.filter = self.raw_filter = flt
+		if flt is None:
+			return
+		try:
+			flt.attach(self.ins)
+			if flt.kernel_complete():
+				self.raw_filter = None
+		except OSError as ex:
+			log(DEBUG, "Unable to attach BPF filter (%s), filtering in userspace" % ex)
+
+	def set_duplicate_filter(self, dup_filter):
+		"""Drop retransmitted frames using the given DuplicateFilter, or stop doing so when None"""
+		self.dup_filter = dup_filter
+
+	def _drop_raw(self, data):
+		"""Returns True if the raw filter or the duplicate filter drops the frame"""
+		if self.raw_filter is not None and not self.raw_filter.match(data):
+			metrics.count("wifi.recv.dropped.filter")
+			return True
+		if self.dup_filter is not None and len(data) >= 4 and self.dup_filter.is_duplicate(data, radiotap_len(data)):
+			metrics.count("wifi.recv.dropped.duplicate")
+			return True
+		return False
+
+	def _recv_filtered(self, x):
+		cls, data, ts = self.recv_raw(x)
+		if not data or not cls or self._drop_raw(data):
+			return None
+		p = cls(data)
+		if ts:
+			p.time = ts
+		return p
 
 	def send(self, p):
 		# Hack: set the More Data flag so we can detect injected frames (and so clients stay awake longer)
 		if self.detect_injected:
 			p.FCfield |= 0x20
 		L2Socket.send(self, RadioTap()/p)
+		metrics.count("wifi.send.frames")
+
+	def send_template(self, template, **values):
+		"""Send a frame generated by a FrameTemplate that includes a RadioTap header"""
+		if self.detect_injected:
+			pos = template.fields["fc"][0] + 1
+			template.buffer[pos] |= 0x20
+		self.outs.send(template.build(**values))
+		metrics.count("wifi.send.frames")
 
 	def _strip_fcs(self, p):
 		# Older scapy can't handle the optional Frame Check Sequence (FCS) field automatically
-		if p[RadioTap].present & 2 != 0 and not Dot11FCS in p:
-			rawframe = raw(p[RadioTap])
-			pos = 8
-			while orb(rawframe[pos - 1]) & 0x80 != 0: pos += 4
-
-			# If the TSFT field is present, it must be 8-bytes aligned
-			if p[RadioTap].present & 1 != 0:
-				pos += (8 - (pos % 8))
-				pos += 8
-
-			# Remove FCS if present
-			if orb(rawframe[pos]) & 0x10 != 0:
-				return Dot11(raw(p[Dot11])[:-4])
+		if not Dot11FCS in p and radiotap_has_fcs(raw(p[RadioTap])):
+			return Dot11(raw(p[Dot11])[:-4])
 
 		return p[Dot11]
 
 	def recv(self, x=MTU, reflected=False):
-		p = L2Socket.recv(self, x)
-		if p == None or not (Dot11 in p or Dot11FCS in p):
+		with metrics.timed("wifi.recv.dissect"):
+			if self.raw_filter is None and self.dup_filter is None:
+				p = L2Socket.recv(self, x)
+			else:
+				p = self._recv_filtered(x)
+		if p == None:
+			return None
+		metrics.count("wifi.recv.frames")
+		if not (Dot11 in p or Dot11FCS in p):
+			metrics.count("wifi.recv.dropped.non_dot11")
 			return None
 
 		# Hack: ignore frames that we just injected and are echoed back by the kernel
 		if self.detect_injected and p.FCfield & 0x20 != 0:
+			metrics.count("wifi.recv.dropped.injected")
 			return None
 
 		# Ignore reflection of injected frames. These have a small RadioTap header.
 		if not reflected and p[RadioTap].len <= 13:
+			metrics.count("wifi.recv.dropped.reflected")
 			return None
 
 		# Strip the FCS if present, and drop the RadioTap header
@@ -406,6 +521,28 @@ class MonitorSocket(L2Socket):
 		else:
 			return self._strip_fcs(p)
 
+	def recv_frame(self, x=MTU, reflected=False):
+		"""
+		Receive a frame without dissecting it. Returns (data, ts), where data starts with the RadioTap
+		header and still includes the FCS, or None if recv() would drop the frame.
+		"""
+		cls, data, ts = self.recv_raw(x)
+		if not data or not cls or self._drop_raw(data):
+			return None
+		metrics.count("wifi.recv.frames")
+		if cls is not RadioTap or len(data) < 8 or len(data) < radiotap_len(data) + 10:
+			metrics.count("wifi.recv.dropped.non_dot11")
+			return None
+
+		offset = radiotap_len(data)
+		if self.detect_injected and data[offset + 1] & 0x20 != 0:
+			metrics.count("wifi.recv.dropped.injected")
+			return None
+		if not reflected and offset <= 13:
+			metrics.count("wifi.recv.dropped.reflected")
+			return None
+		return data, ts
+
 	def close(self):
 		super(MonitorSocket, self).close()
 
@@ -413,6 +550,19 @@ class MonitorSocket(L2Socket):
 class MitmSocket(MonitorSocket):
 	pass
 
+@contextlib.contextmanager
+def monitor_filter(sock, flt):
+	"""Temporarily apply a Dot11Filter to a MonitorSocket, restoring its previous filter afterwards"""
+	if not isinstance(sock, MonitorSocket):
+		yield sock
+		return
+	previous = sock.filter
+	sock.set_filter(flt)
+	try:
+		yield sock
+	finally:
+		sock.set_filter(previous)
+
 def dot11_get_seqnum(p):
 	return p.SC >> 4
 
@@ -467,6 +617,209 @@ def dot11_get_priority(p):
 	if not Dot11QoS in p: return 0
 	return p[Dot11QoS].TID
 
+#### Frame templates ####
+
+class FrameTemplate():
+	"""
+	Serializes a scapy prototype once and produces new frames by patching the variable fields
+	in a preallocated buffer. Offsets are relative to the start of the 802.11 header. The
+	addresses, sequence control, and the authentication fields are registered automatically.
+	"""
+	def __init__(self, p, radiotap=True):
+		self.buffer = bytearray(raw(RadioTap()/p) if radiotap else raw(p))
+		self.base = len(self.buffer) - len(raw(p))
+		self.fields = dict()
+		if Dot11 in p:
+			self.add_field("fc", 0, 2)
+			for i in range(1, 4):
+				self.add_field("addr%d" % i, 4 + 6 * (i - 1), 6)
+			self.add_field("sc", 22, 2)
+		if Dot11Auth in p:
+			offset = len(raw(p)) - len(raw(p[Dot11Auth]))
+			self.add_field("algo", offset, 2)
+			self.add_field("seqnum", offset + 2, 2)
+			self.add_field("status", offset + 4, 2)
+
+	def add_field(self, name, offset, length, encode=None):
+		"""
+		Register a field. The optional encode function converts values that aren't bytes. By
+		default integers are encoded as little-endian and strings as MAC addresses.
+		"""
+		self.fields[name] = (self.base + offset, length, encode)
+
+	def add_marker(self, name, marker, encode=None):
+		"""Register a field at the position of a byte string that occurs once in the prototype"""
+		pos = self.buffer.find(marker)
+		if pos < 0 or self.buffer.find(marker, pos + 1) >= 0:
+			raise ValueError("Marker of field %s must occur exactly once in the frame" % name)
+		self.add_field(name, pos - self.base, len(marker), encode)
+
+	def set(self, **values):
+		"""Patch the given fields in the template"""
+		for name, value in values.items():
+			pos, length, encode = self.fields[name]
+			if isinstance(value, (bytes, bytearray)):
+				pass
+			elif encode is not None:
+				value = encode(value)
+			elif isinstance(value, int):
+				value = value.to_bytes(length, "little")
+			elif isinstance(value, str):
+				value = addr2bin(value)
+			if len(value) != length:
+				raise ValueError("Field %s must be %d bytes" % (name, length))
+			self.buffer[pos:pos + length] = value
+
+	def build(self, **values):
+		"""Patch the given fields and return the resulting frame as bytes"""
+		self.set(**values)
+		return bytes(self.buffer)
+
+#### Raw frame helpers ####
+
+# These work on bytes or memoryviews, so frames can be inspected without dissecting them
+DLT_EN10MB = 1
+DLT_IEEE802_11 = 105
+DLT_IEEE802_11_RADIO = 127
+
+def radiotap_len(data):
+	return struct.unpack_from("<H", data, 2)[0]
+
+def radiotap_has_fcs(data):
+	"""Returns True if the Flags field of the RadioTap header says the frame ends with an FCS"""
+	present = struct.unpack_from("<I", data, 4)[0]
+	if present & 2 == 0:
+		return False
+
+	# Skip all extended present bitmasks
+	pos = 8
+	while data[pos - 1] & 0x80 != 0: pos += 4
+
+	# If the TSFT field is present, it must be 8-bytes aligned
+	if present & 1 != 0:
+		pos += -pos % 8
+		pos += 8
+
+	return data[pos] & 0x10 != 0
+
+def radiotap_tsft(data):
+	"""Returns the TSFT field of the RadioTap header in microseconds, or None if it's not present"""
+	if struct.unpack_from("<I", data, 4)[0] & 1 == 0:
+		return None
+	pos = 8
+	while data[pos - 1] & 0x80 != 0: pos += 4
+	pos += -pos % 8
+	return struct.unpack_from("<Q", data, pos)[0]
+
+# Alignment and size of the RadioTap fields that precede the antenna signal field
+RADIOTAP_FIELDS = [(8, 8), (1, 1), (1, 1), (2, 4), (1, 2)]
+
+def radiotap_antsignal(data):
+	"""Returns the antenna signal in dBm from the RadioTap header, or None if it's not present"""
+	present = struct.unpack_from("<I", data, 4)[0]
+	if present & 0x20 == 0:
+		return None
+
+	pos = 8
+	while data[pos - 1] & 0x80 != 0: pos += 4
+	for i, (align, size) in enumerate(RADIOTAP_FIELDS):
+		if present & (1 << i) != 0:
+			pos += -pos % align
+			pos += size
+	return struct.unpack_from("b", data, pos)[0]
+
+def raw_dot11_offset(linktype, data):
+	"""Returns the offset of the 802.11 header, or None if the linktype isn't 802.11"""
+	if linktype == DLT_IEEE802_11_RADIO:
+		return radiotap_len(data)
+	elif linktype == DLT_IEEE802_11:
+		return 0
+	return None
+
+def raw_dot11_type(data, offset=0):
+	"""Returns the (type, subtype, flags) of the 802.11 header at the given offset"""
+	fc0 = data[offset]
+	return (fc0 >> 2) & 3, fc0 >> 4, data[offset + 1]
+
+def raw_dot11_addr(data, index, offset=0):
+	"""Returns addr1, addr2, or addr3 as bytes"""
+	pos = offset + 4 + 6 * (index - 1)
+	return bytes(data[pos:pos + 6])
+
+def raw_dot11_hdrlen(data, offset=0):
+	"""Returns the length of the 802.11 header of a data frame, including the QoS control field"""
+	fc0, fc1 = data[offset], data[offset + 1]
+	hdrlen = 30 if fc1 & 3 == 3 else 24
+	if fc0 & 0x8C == 0x88:
+		hdrlen += 2
+		# The HT control field is present in QoS data frames with the Order flag set
+		if fc1 & 0x80: hdrlen += 4
+	return hdrlen
+
+def raw_ccmp_pn(data, offset=0):
+	"""Returns the packet number of a protected data frame, or None if it has no CCMP/GCMP header"""
+	pos = offset + raw_dot11_hdrlen(data, offset)
+	if len(data) < pos + 8 or data[pos + 3] & 0x20 == 0:
+		return None
+	return data[pos] | (data[pos + 1] << 8) | (int.from_bytes(data[pos + 4:pos + 8], "little") << 16)
+
+class DuplicateFilter():
+	"""
+	Detects retransmitted frames using the 802.11 duplicate detection rules: a frame with the
+	Retry flag set is a duplicate when its sequence control equals the one of the previous frame
+	of the same transmitter, where QoS data frames are tracked per TID. At most max_entries
+	transmitters and TIDs are remembered.
+	"""
+	def __init__(self, max_entries=4096):
+		self.max_entries = max_entries
+		# Maps (TA, TID) to the last sequence control. Non-QoS frames use TID 16.
+		self.cache = collections.OrderedDict()
+		self.duplicates = 0
+
+	def is_duplicate(self, data, offset=0):
+		"""Check the raw 802.11 header at the given offset. Control frames are never duplicates."""
+		if len(data) < offset + 24 or data[offset] & 0x0C == 0x04:
+			return False
+
+		fc0 = data[offset]
+		tid = 16
+		if fc0 & 0x8C == 0x88:
+			qos = offset + (30 if data[offset + 1] & 3 == 3 else 24)
+			if len(data) < qos + 2:
+				return False
+			tid = data[qos] & 0x0F
+		key = (bytes(data[offset + 10:offset + 16]), tid)
+		sc = data[offset + 22] | (data[offset + 23] << 8)
+
+		cache = self.cache
+		last = cache.get(key)
+		if last is not None:
+			cache.move_to_end(key)
+			if last == sc and data[offset + 1] & 0x08:
+				self.duplicates += 1
+				metrics.count("wifi.duplicates")
+				return True
+		cache[key] = sc
+		if len(cache) > self.max_entries:
+			cache.popitem(last=False)
+		return False
+
+	def is_duplicate_packet(self, p):
+		"""Check a scapy frame"""
+		return self.is_duplicate(raw(p[Dot11]))
+
+	def reset(self):
+		self.cache.clear()
+		self.duplicates = 0
+
+def get_eapol_addresses(p):
+	"""Returns the (source, destination) addresses of an EAPOL frame"""
+	if Dot11 in p:
+		return p[Dot11].addr2, p[Dot11].addr1
+	elif Ether in p:
+		return p[Ether].src, p[Ether].dst
+	return None, None
+
 
 #### Crypto functions and util ####
 
@@ -477,7 +830,9 @@ def get_ccmp_payload(p):
 		# - Exclude first 4 bytes of the CCMP MIC (note that last 4 are saved in the WEP ICV field)
 		return str(p.wepdata[4:-4])
 	elif Dot11CCMP in p or Dot11TKIP in p or Dot11Encrypted in p:
-		return p[Dot11Encrypted].data
+		# Some scapy versions don't return subclasses when indexing with Dot11Encrypted
+		layer = p.getlayer(Dot11CCMP) or p.getlayer(Dot11TKIP) or p.getlayer(Dot11Encrypted)
+		return layer.data
 	else:
 		return p[Raw].load
 
@@ -531,6 +886,48 @@ def create_fragments(header, data, num_frags):
 
 	return fragments
 
+#### A-MSDU ####
+
+def amsdu_subframes(data):
+	"""
+	Iterate over the (DA, SA, MSDU) of all subframes in an A-MSDU payload. These are memoryview
+	slices of the given data, so nothing is copied. Raises ValueError if a subframe is truncated.
+	"""
+	view = memoryview(data)
+	pos, end = 0, len(view)
+	while pos < end:
+		if pos + 14 > end:
+			raise ValueError("Truncated A-MSDU subframe header")
+		length = (view[pos + 12] << 8) | view[pos + 13]
+		if pos + 14 + length > end:
+			raise ValueError("Truncated A-MSDU subframe")
+		yield view[pos:pos + 6], view[pos + 6:pos + 12], view[pos + 14:pos + 14 + length]
+		# All subframes except the last one are padded to a multiple of 4 bytes
+		pos += 14 + length
+		pos += -pos % 4
+
+def build_amsdu(msdus):
+	"""Build an A-MSDU payload from (DA, SA, MSDU) tuples, where the MSDU usually starts with an LLC/SNAP header"""
+	buf = bytearray()
+	for da, sa, msdu in msdus:
+		if isinstance(msdu, Packet):
+			msdu = raw(msdu)
+		buf += -len(buf) % 4 * b"\x00"
+		buf += addr2bin(da) if isinstance(da, str) else da
+		buf += addr2bin(sa) if isinstance(sa, str) else sa
+		buf += struct.pack(">H", len(msdu))
+		buf += msdu
+	return bytes(buf)
+
+def create_amsdu(header, msdus, tid=0):
+	"""Put MSDUs in one QoS data frame with the A-MSDU present flag set, e.g. before encrypting it"""
+	p = header.copy()
+	p.subtype |= 8
+	if Dot11QoS not in p:
+		p = p/Dot11QoS(TID=tid)
+	p[Dot11QoS].A_MSDU_Present = 1
+	return p/Raw(build_amsdu(msdus))
+
 def get_element(el, id):
 	el = el[Dot11Elt]
 	while not el is None: